@@ -1,18 +1,43 @@
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QPushButton, 
                            QLabel, QHBoxLayout, QWidget, QScrollArea)
-from PyQt6.QtCore import Qt, QPointF
-from PyQt6.QtGui import QPainter, QColor, QPen, QImage
+from PyQt6.QtCore import Qt, QPointF, QRectF
+from PyQt6.QtGui import QPainter, QColor, QPen
+import math
 import numpy as np
-from scipy.ndimage import zoom
+from utils.terrain_stats import TerrainStats
+from .preview_image import grayscale_pixels, grayscale_image
+
+def halve_pixels(pixels):
+    """Average 2x2 blocks of uint8 pixels, odd edges are replicated"""
+    rows, cols = pixels.shape
+    if rows % 2 or cols % 2:
+        pixels = np.pad(pixels, ((0, rows % 2), (0, cols % 2)), mode='edge')
+    total = pixels[0::2, 0::2].astype(np.uint16)
+    total += pixels[1::2, 0::2]
+    total += pixels[0::2, 1::2]
+    total += pixels[1::2, 1::2]
+    total += 2
+    return (total // 4).astype(np.uint8)
 
 class DamPreviewWidget(QWidget):
-    def __init__(self, terrain_data, parent=None):
+    def __init__(self, terrain_data, parent=None, stats=None):
         super().__init__(parent)
         self.terrain_data = terrain_data
+        if stats is None and terrain_data is not None:
+            stats = TerrainStats.compute(terrain_data)
+        self.stats = stats
         self.points = []  # 3 points: 2 dam points and flood direction point
-        self.background_image = None
         self.setMinimumSize(500, 500)
         
+        # uint8 preview levels, each half the size of the previous one, all
+        # with the grey levels of the full terrain range. Painting picks the
+        # level matching the zoom and wraps only its visible part.
+        self.preview_levels = None
+        self.min_level_size = 256
+        self.tile_key = None
+        self.tile_pixels = None
+        self.tile_image = None
+        
         # Zoom and pan variables
         self.zoom_factor = 1.0
         self.pan_offset = QPointF(0, 0)
@@ -95,16 +120,19 @@ class DamPreviewWidget(QWidget):
         painter = QPainter(self)
         
         # Create terrain visualization if not exists
-        if self.background_image is None:
-            self.create_background_image()
+        if self.preview_levels is None:
+            self.create_preview_levels()
             
         # Apply zoom and pan transformation
         painter.translate(self.pan_offset)
         painter.scale(self.zoom_factor, self.zoom_factor)
         
         # Draw terrain
-        if self.background_image:
-            painter.drawImage(0, 0, self.background_image)
+        tile = self.visible_tile()
+        if tile is not None:
+            target, image = tile
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(target, image)
             
         # Draw points and lines
         if self.points:
@@ -144,43 +172,77 @@ class DamPreviewWidget(QWidget):
                     p3[1] * self.height()
                 )
 
-    def create_background_image(self):
-        """Create visualization of the terrain"""
+    def create_preview_levels(self):
+        """Build the uint8 preview pyramid once per terrain"""
         if self.terrain_data is None:
             return
             
-        # Normalize terrain data
-        normalized = (self.terrain_data - np.min(self.terrain_data)) / (
-            np.max(self.terrain_data) - np.min(self.terrain_data))
-        
-        # Scale to 0-255 and convert to uint8
-        grayscale = (normalized * 255).astype(np.uint8)
-        
-        # Resize array to match widget size
-        scale_y = self.height() / grayscale.shape[0]
-        scale_x = self.width() / grayscale.shape[1]
-        resized = zoom(grayscale, (scale_y, scale_x), order=0)
-        
-        # Create RGB image
-        rgb = np.stack([resized] * 3, axis=-1)
-        
-        # Convert to QImage
-        height, width = rgb.shape[:2]
-        bytes_per_line = 3 * width
-        self.background_image = QImage(
-            rgb.data.tobytes(),
-            width,
-            height,
-            bytes_per_line,
-            QImage.Format.Format_RGB888
-        )
+        # Map row blocks so a memory-mapped terrain is never copied as float
+        rows, cols = self.terrain_data.shape
+        level = np.empty((rows, cols), dtype=np.uint8)
+        step = max(1, (1 << 20) // cols)
+        for start in range(0, rows, step):
+            level[start:start + step] = grayscale_pixels(
+                self.terrain_data[start:start + step], self.stats.min, self.stats.max
+            )
+            
+        levels = [level]
+        while max(levels[-1].shape) > self.min_level_size:
+            levels.append(halve_pixels(levels[-1]))
+        self.preview_levels = levels
+        
+    def visible_tile(self):
+        """
+        Image of the visible part of the terrain at the level matching the zoom
+        
+        The terrain fills the widget at zoom 1, so scene coordinates run over
+        the widget size. Only the visible rows and columns of the level are
+        wrapped as an image, Qt resamples them to the screen.
         
-    def resizeEvent(self, event):
-        self.background_image = None
-        super().resizeEvent(event)
+        Returns:
+            tuple: (target QRectF in scene coordinates, QImage), or None
+        """
+        if not self.preview_levels or self.width() <= 0 or self.height() <= 0:
+            return None
+            
+        # Visible scene rectangle as fractions of the terrain
+        top_left = self.mapToScene(QPointF(0, 0))
+        bottom_right = self.mapToScene(QPointF(self.width(), self.height()))
+        u0 = min(max(top_left.x() / self.width(), 0.0), 1.0)
+        v0 = min(max(top_left.y() / self.height(), 0.0), 1.0)
+        u1 = min(max(bottom_right.x() / self.width(), 0.0), 1.0)
+        v1 = min(max(bottom_right.y() / self.height(), 0.0), 1.0)
+        if u1 <= u0 or v1 <= v0:
+            return None
+            
+        # Coarsest level that still has a pixel per screen pixel
+        rows, cols = self.preview_levels[0].shape
+        pixels_per_screen = max(cols / (self.width() * self.zoom_factor),
+                                rows / (self.height() * self.zoom_factor))
+        index = 0
+        if pixels_per_screen > 1:
+            index = min(int(math.log2(pixels_per_screen)), len(self.preview_levels) - 1)
+        level = self.preview_levels[index]
+        level_rows, level_cols = level.shape
+        
+        r0, r1 = int(v0 * level_rows), min(level_rows, math.ceil(v1 * level_rows))
+        c0, c1 = int(u0 * level_cols), min(level_cols, math.ceil(u1 * level_cols))
+        key = (index, r0, r1, c0, c1)
+        if key != self.tile_key:
+            self.tile_pixels = np.ascontiguousarray(level[r0:r1, c0:c1])
+            self.tile_image = grayscale_image(self.tile_pixels)
+            self.tile_key = key
+            
+        target = QRectF(
+            c0 / level_cols * self.width(),
+            r0 / level_rows * self.height(),
+            (c1 - c0) / level_cols * self.width(),
+            (r1 - r0) / level_rows * self.height()
+        )
+        return target, self.tile_image
 
 class DamSelectionDialog(QDialog):
-    def __init__(self, terrain_data, parent=None):
+    def __init__(self, terrain_data, parent=None, stats=None):
         super().__init__(parent)
         self.setWindowTitle("Select Dam Location")
         self.setModal(True)
@@ -203,7 +265,7 @@ class DamSelectionDialog(QDialog):
         
         # Create scroll area for preview
         scroll_area = QScrollArea()
-        self.preview = DamPreviewWidget(terrain_data, self)
+        self.preview = DamPreviewWidget(terrain_data, self, stats)
         scroll_area.setWidget(self.preview)
         scroll_area.setWidgetResizable(True)
         layout.addWidget(scroll_area)
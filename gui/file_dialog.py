@@ -32,4 +32,21 @@ class FileDialog:
                 # For small files, return full file without region selection
                 return file_path, None
                 
-        return None, None 
\ No newline at end of file
+        return None, None
+        
+    def get_terrain_directory(self):
+        """Select a directory of .hgt/.tif tiles and a region of the mosaic"""
+        directory = QFileDialog.getExistingDirectory(None, "Select Terrain Tile Directory")
+        if not directory:
+            return None, None
+            
+        # Mosaics are always large, so go straight to region selection
+        try:
+            region_dialog = RegionSelectorDialog(directory)
+        except ValueError as e:
+            QMessageBox.warning(None, "Invalid Tile Directory", str(e))
+            return None, None
+            
+        if region_dialog.exec():
+            return directory, region_dialog.get_selected_region()
+        return None, None
\ No newline at end of file
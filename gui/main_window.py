@@ -1,6 +1,7 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QPushButton, QComboBox, 
-                            QLabel, QFrame, QGroupBox, QDoubleSpinBox)
+                            QLabel, QFrame, QGroupBox, QDoubleSpinBox, QSlider,
+                            QCheckBox, QProgressBar, QMessageBox)
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import  QColor, QLinearGradient
 from .file_dialog import FileDialog
@@ -18,6 +19,8 @@ class MainWindow(QMainWindow):
         # File selection
         self.load_button = QPushButton("Load Terrain")
         self.load_button.clicked.connect(self.load_terrain)
+        self.load_tiles_button = QPushButton("Load Tile Folder")
+        self.load_tiles_button.clicked.connect(self.load_terrain_tiles)
         
         # Rendering scheme
         self.scheme_combo = QComboBox()
@@ -28,6 +31,27 @@ class MainWindow(QMainWindow):
         self.reset_button = QPushButton("Reset View")
         self.reset_button.clicked.connect(self.reset_camera)
         
+        # Detail level, applied when the slider is released
+        self.detail_slider = QSlider(Qt.Orientation.Horizontal)
+        self.detail_slider.setRange(1, 100)
+        self.detail_slider.setValue(100)
+        self.detail_slider.setTracking(False)
+        self.detail_label = QLabel("100%")
+        self.detail_slider.sliderMoved.connect(lambda value: self.detail_label.setText(f"{value}%"))
+        self.detail_slider.valueChanged.connect(self.change_detail_level)
+        
+        # Adaptive mesh tolerance, 0 keeps the uniform grid
+        self.max_error_spin = QDoubleSpinBox()
+        self.max_error_spin.setRange(0, 1000)
+        self.max_error_spin.setSuffix(" m")
+        self.max_error_spin.setSpecialValueText("Uniform grid")
+        self.max_error_spin.setKeyboardTracking(False)
+        self.max_error_spin.valueChanged.connect(self.change_max_error)
+        
+        # Quadtree of chunks refined by screen-space error
+        self.chunked_lod_check = QCheckBox("Chunked LOD")
+        self.chunked_lod_check.toggled.connect(self.change_chunked_lod)
+        
         # Dam creation button
         self.dam_button = QPushButton("Create Dam")
         self.dam_button.clicked.connect(self.create_dam)
@@ -43,6 +67,10 @@ class MainWindow(QMainWindow):
         
         # Create OpenGL widget
         self.gl_widget = TerrainRenderer()
+        self.gl_widget.load_progress.connect(self.update_load_progress)
+        self.gl_widget.load_finished.connect(self.hide_load_progress)
+        self.gl_widget.load_failed.connect(self.show_load_error)
+        self.gl_widget.flood_levels_ready.connect(self.enable_water_level)
         left_layout.addWidget(self.gl_widget)
         
         # Controls panel - change to VBoxLayout for vertical arrangement
@@ -51,10 +79,21 @@ class MainWindow(QMainWindow):
         # Top controls (file and render scheme) in horizontal layout
         top_controls = QHBoxLayout()
         top_controls.addWidget(self.load_button)
+        top_controls.addWidget(self.load_tiles_button)
         top_controls.addWidget(QLabel("Render Scheme:"))
         top_controls.addWidget(self.scheme_combo)
         controls_layout.addLayout(top_controls)
         
+        # Detail level slider
+        detail_controls = QHBoxLayout()
+        detail_controls.addWidget(QLabel("Detail:"))
+        detail_controls.addWidget(self.detail_slider)
+        detail_controls.addWidget(self.detail_label)
+        detail_controls.addWidget(QLabel("Max Error:"))
+        detail_controls.addWidget(self.max_error_spin)
+        detail_controls.addWidget(self.chunked_lod_check)
+        controls_layout.addLayout(detail_controls)
+        
         # Reset view button
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(self.reset_button)
@@ -104,6 +143,10 @@ class MainWindow(QMainWindow):
         self.stats_label.setWordWrap(True)
         self.stats_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
         right_layout.addWidget(self.stats_label)
+        
+        # GPU memory held by terrain and dam buffers
+        self.gpu_memory_label = QLabel("GPU Memory: 0.0 MB")
+        right_layout.addWidget(self.gpu_memory_label)
         right_layout.addStretch()
         
         # Add dam statistics to right panel
@@ -115,18 +158,80 @@ class MainWindow(QMainWindow):
         self.dam_height_label = QLabel("Dam Height: N/A")
         dam_stats_layout.addWidget(self.dam_height_label)
         
+        # Reservoir behind the dam, the terrain has no ground units so the
+        # area is given in cells
+        self.flood_area_label = QLabel("Flooded Cells: N/A")
+        dam_stats_layout.addWidget(self.flood_area_label)
+        self.flood_depth_label = QLabel("Mean Depth: N/A")
+        dam_stats_layout.addWidget(self.flood_depth_label)
+        
+        # Water level between the reservoir floor and the dam top, enabled
+        # once the flooding order behind the dam is computed
+        self.water_level_label = QLabel("Water Level: N/A")
+        dam_stats_layout.addWidget(self.water_level_label)
+        self.water_level_slider = QSlider(Qt.Orientation.Horizontal)
+        self.water_level_slider.setRange(0, 1000)
+        self.water_level_slider.setEnabled(False)
+        self.water_level_slider.valueChanged.connect(self.change_water_level)
+        dam_stats_layout.addWidget(self.water_level_slider)
+        
         self.dam_stats_group.setLayout(dam_stats_layout)
         right_layout.addWidget(self.dam_stats_group)
         
         # Add right panel to main layout
         main_layout.addWidget(right_panel, stretch=1)
         
+        # Progress of background loads in the status bar
+        self.load_progress_bar = QProgressBar()
+        self.load_progress_bar.setRange(0, 100)
+        self.load_progress_bar.setMaximumWidth(200)
+        self.cancel_load_button = QPushButton("Cancel")
+        self.cancel_load_button.clicked.connect(self.cancel_load)
+        self.statusBar().addPermanentWidget(self.load_progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_load_button)
+        self.hide_load_progress()
+        
     def load_terrain(self):
         file_dialog = FileDialog()
         file_path, region = file_dialog.get_terrain_file()
         if file_path:
             self.gl_widget.load_terrain(file_path, region)
             
+    def load_terrain_tiles(self):
+        """Load a region from a directory of terrain tiles"""
+        file_dialog = FileDialog()
+        directory, region = file_dialog.get_terrain_directory()
+        if directory:
+            self.gl_widget.load_terrain(directory, region)
+            
+    def update_load_progress(self, stage, percent):
+        """Show the stage of the terrain load in the status bar"""
+        self.statusBar().showMessage(f"{stage}...")
+        self.load_progress_bar.setValue(percent)
+        self.load_progress_bar.setVisible(True)
+        self.cancel_load_button.setVisible(True)
+        
+    def hide_load_progress(self):
+        self.statusBar().clearMessage()
+        self.load_progress_bar.setVisible(False)
+        self.cancel_load_button.setVisible(False)
+        
+    def cancel_load(self):
+        """Cancel the terrain load in flight, the current terrain stays"""
+        self.gl_widget.cancel_terrain_task()
+        self.hide_load_progress()
+        
+    def show_load_error(self, message):
+        self.hide_load_progress()
+        QMessageBox.warning(self, "Load Failed", message)
+        
+    def closeEvent(self, event):
+        # Let the worker stop before the renderer goes away
+        self.gl_widget.cancel_terrain_task()
+        self.gl_widget.cancel_flood_task()
+        self.gl_widget.task_pool.waitForDone()
+        super().closeEvent(event)
+        
     def change_scheme(self, scheme):
         self.gl_widget.set_render_scheme(scheme)
         
@@ -134,28 +239,40 @@ class MainWindow(QMainWindow):
         self.isoline_group.setVisible("Isolines" in scheme)
         
         # Update color legend with new scheme
-        if self.gl_widget.terrain_data is not None:
+        stats = self.gl_widget.terrain_stats
+        if stats is not None:
             show_isolines = "Isolines" in scheme
             use_yellow_red = scheme.startswith("Yellow-Red")
-            min_height = np.min(self.gl_widget.terrain_data)
-            max_height = np.max(self.gl_widget.terrain_data)
-            self.color_legend.set_height_range(min_height, max_height, show_isolines, use_yellow_red)
+            self.color_legend.set_height_range(stats.min, stats.max, show_isolines, use_yellow_red)
             
         
+    def change_detail_level(self, value):
+        """Re-mesh the loaded terrain at the new detail level"""
+        self.detail_label.setText(f"{value}%")
+        self.gl_widget.set_detail_level(value)
+        
+    def change_max_error(self, value):
+        """Re-mesh the terrain with the new maximum vertical error"""
+        self.gl_widget.set_max_vertical_error(value)
+        
+    def change_chunked_lod(self, enabled):
+        """Toggle the chunked quadtree LOD renderer"""
+        self.max_error_spin.setEnabled(not enabled)
+        self.gl_widget.set_chunked_lod(enabled)
+        
     def reset_camera(self):
         self.gl_widget.reset_camera() 
         
-    def update_statistics(self, terrain_data):
-        """Update the statistics display"""
-        if terrain_data is None:
+    def update_statistics(self, stats):
+        """Update the statistics display from the renderer's TerrainStats"""
+        if stats is None:
             self.stats_label.setText("No terrain loaded")
             self.color_legend.set_height_range(0, 1, False, False)
             return
         
-        
-        min_height = np.min(terrain_data)
-        max_height = np.max(terrain_data)
-        rows, cols = terrain_data.shape
+        min_height = stats.min
+        max_height = stats.max
+        rows, cols = stats.shape
         
         # Update color legend with scheme and isoline state
         current_scheme = self.scheme_combo.currentText()
@@ -163,13 +280,23 @@ class MainWindow(QMainWindow):
         use_yellow_red = current_scheme.startswith("Yellow-Red")
         self.color_legend.set_height_range(min_height, max_height, show_isolines, use_yellow_red)
         
-        stats = (
+        stats_text = (
             f"Resolution:\n{cols} × {rows}\n\n"
             f"Height Range:\n"
             f"Min: {min_height:.1f}\n"
-            f"Max: {max_height:.1f}\n\n"
+            f"Max: {max_height:.1f}\n"
+            f"Mean: {stats.mean:.1f}\n\n"
+            f"Percentiles:\n"
         )
-        self.stats_label.setText(stats) 
+        for p, value in stats.percentiles.items():
+            stats_text += f"P{p}: {value:.1f}\n"
+        if stats.nodata_count:
+            stats_text += f"\nNo data: {stats.nodata_count} cells\n"
+        self.stats_label.setText(stats_text)
+        
+    def update_gpu_memory(self, total_bytes):
+        """Update the GPU memory display"""
+        self.gpu_memory_label.setText(f"GPU Memory: {total_bytes / 1024**2:.1f} MB")
         
     def update_isoline_spacing(self, value):
         """Update the isoline spacing in the renderer"""
@@ -180,25 +307,60 @@ class MainWindow(QMainWindow):
         if self.gl_widget.terrain_data is None:
             return
             
-        dialog = DamSelectionDialog(self.gl_widget.terrain_data, self)
+        dialog = DamSelectionDialog(self.gl_widget.terrain_data, self, self.gl_widget.terrain_stats)
         if dialog.exec():
             points = dialog.get_dam_points()
             if points and len(points) == 3:
                 # First two points are dam ends, third point indicates flood direction
                 dam_points = points[:2]
                 flood_point = points[2]
+                self.water_level_slider.setEnabled(False)
                 self.gl_widget.create_dam(dam_points, flood_point)
                 self.update_dam_statistics()
                 
+    def enable_water_level(self):
+        """Let the water level be dragged once the dam's reservoir is ordered"""
+        level_range = self.gl_widget.dam_builder.water_level_range()
+        stats = self.gl_widget.dam_builder.get_dam_stats()
+        if level_range is None or stats is None:
+            return
+        low, high = level_range
+        position = (stats['water_level'] - low) / (high - low) if high > low else 1.0
+        self.water_level_slider.blockSignals(True)
+        self.water_level_slider.setValue(int(round(min(max(position, 0.0), 1.0) * 1000)))
+        self.water_level_slider.blockSignals(False)
+        self.water_level_slider.setEnabled(True)
+        
+    def change_water_level(self, value):
+        """Move the water behind the dam to the slider position"""
+        level_range = self.gl_widget.dam_builder.water_level_range()
+        if level_range is None:
+            return
+        low, high = level_range
+        self.gl_widget.set_water_level(low + (high - low) * value / 1000)
+        self.update_dam_statistics()
+                
     def update_dam_statistics(self):
         """Update dam statistics display"""
         stats = self.gl_widget.dam_builder.get_dam_stats()
         if stats:
             self.dam_stats_group.setVisible(True)
             self.dam_height_label.setText(f"Dam Height: {stats['height']:.1f} m")
+            if 'water_level' in stats:
+                self.water_level_label.setText(f"Water Level: {stats['water_level']:.1f} m")
+            area = stats.get('flood_area', 0)
+            self.flood_area_label.setText(f"Flooded Cells: {area:,.0f}")
+            if area > 0:
+                self.flood_depth_label.setText(f"Mean Depth: {stats['flood_volume'] / area:.1f} m")
+            else:
+                self.flood_depth_label.setText("Mean Depth: N/A")
         else:
             self.dam_stats_group.setVisible(False)
             self.dam_height_label.setText("Dam Height: N/A")
+            self.flood_area_label.setText("Flooded Cells: N/A")
+            self.flood_depth_label.setText("Mean Depth: N/A")
+            self.water_level_label.setText("Water Level: N/A")
+            self.water_level_slider.setEnabled(False)
         
 class ColorLegend(QFrame):
     def __init__(self, parent=None):
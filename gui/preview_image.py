@@ -0,0 +1,32 @@
+from PyQt6.QtGui import QImage
+import numpy as np
+
+def grayscale_pixels(data, low, high):
+    """
+    Map heights to 0-255 grey levels in one vectorized pass
+
+    Args:
+        data (numpy.ndarray): Heights, NaN for no data
+        low (float): Height drawn black
+        high (float): Height drawn white
+
+    Returns:
+        numpy.ndarray: uint8 pixels, no data is black
+    """
+    scale = 255.0 / (high - low) if high > low else 0.0
+    pixels = np.asarray(data, dtype=np.float32) - np.float32(low)
+    pixels *= np.float32(scale)
+    np.nan_to_num(pixels, copy=False, nan=0.0)
+    np.clip(pixels, 0, 255, out=pixels)
+    return pixels.astype(np.uint8)
+
+def grayscale_image(pixels):
+    """
+    Wrap uint8 pixels as a QImage without copying them
+
+    The image reads the array's memory, so the caller has to keep the
+    array alive as long as the image is used.
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape
+    return QImage(pixels.data, width, height, pixels.strides[0], QImage.Format.Format_Grayscale8)
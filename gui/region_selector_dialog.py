@@ -1,9 +1,12 @@
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
                            QPushButton, QDoubleSpinBox, QGroupBox, QWidget)
 from PyQt6.QtCore import Qt, QRectF, QPointF
-from PyQt6.QtGui import QPainter, QColor, QPen, QImage
+from PyQt6.QtGui import QPainter, QColor, QPen
 import numpy as np
+import os
 from osgeo import gdal
+from utils.terrain_mosaic import shared_mosaic
+from .preview_image import grayscale_pixels, grayscale_image
 
 class TerrainPreviewWidget(QWidget):
     def __init__(self, parent=None):
@@ -17,19 +20,15 @@ class TerrainPreviewWidget(QWidget):
         self.last_pos = None
         self.drag_mode = None
         self.background_image = None  # Cache for the terrain image
+        self.background_pixels = None  # Memory behind background_image
+        self.preview_size = 400  # Longer side of the preview read
         
     def set_terrain_data(self, dataset):
         """Set the terrain data and compute preview"""
         band = dataset.GetRasterBand(1)
         
         # Read a downsampled version for preview
-        preview_width = 400
-        preview_height = 400
-        
-        self.terrain_data = band.ReadAsArray(
-            buf_xsize=preview_width,
-            buf_ysize=preview_height
-        )
+        self.terrain_data = self.read_overview(band, self.preview_size)
         
         self.full_width = dataset.RasterXSize
         self.full_height = dataset.RasterYSize
@@ -39,40 +38,63 @@ class TerrainPreviewWidget(QWidget):
         self.create_background_image()
         self.update()
         
-    def create_background_image(self):
-        """Create cached image of the terrain"""
-        if self.terrain_data is None:
-            return
-            
-        self.background_image = QImage(self.width(), self.height(), QImage.Format.Format_RGB32)
-        self.background_image.fill(Qt.GlobalColor.black)
+    def set_mosaic(self, mosaic):
+        """Set a tile mosaic and preview it through its low resolution overview"""
+        self.terrain_data = mosaic.overview(max(self.width(), self.height(), self.preview_size))
         
-        painter = QPainter(self.background_image)
+        self.full_width = mosaic.width
+        self.full_height = mosaic.height
+        self.geo_transform = mosaic.geo_transform
         
-        # Draw terrain preview
-        normalized = (self.terrain_data - np.min(self.terrain_data)) / (np.max(self.terrain_data) - np.min(self.terrain_data))
-        height, width = normalized.shape
+        self.create_background_image()
+        self.update()
         
-        for y in range(height):
-            for x in range(width):
-                value = int(normalized[y, x] * 255)
-                painter.setPen(QColor(value, value, value))
-                painter.drawPoint(x * self.width() / width, y * self.height() / height)
+    def read_overview(self, band, max_size):
+        """
+        Read a band decimated so its longer side is max_size
+        
+        The read comes from the smallest overview of the file that still has
+        max_size pixels, so only a small part of a huge raster is decoded.
+        
+        Returns:
+            numpy.ndarray: float32 heights, NaN for no data
+        """
+        scale = min(1.0, max_size / max(band.XSize, band.YSize))
+        buf_width = max(1, int(round(band.XSize * scale)))
+        buf_height = max(1, int(round(band.YSize * scale)))
+        
+        source = band
+        for i in range(band.GetOverviewCount()):
+            overview = band.GetOverview(i)
+            if (overview.XSize >= buf_width and overview.YSize >= buf_height and
+                    overview.XSize < source.XSize):
+                source = overview
                 
-        painter.end()
+        data = source.ReadAsArray(buf_xsize=buf_width, buf_ysize=buf_height).astype(np.float32)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            data[data == np.float32(nodata)] = np.nan
+        return data
         
-    def resizeEvent(self, event):
-        """Recreate background image when widget is resized"""
-        super().resizeEvent(event)
-        if self.terrain_data is not None:
-            self.create_background_image()
+    def create_background_image(self):
+        """Create cached image of the terrain, scaled to the widget when painted"""
+        if self.terrain_data is None:
+            return
+            
+        if np.all(np.isnan(self.terrain_data)):
+            low = high = 0.0
+        else:
+            low, high = np.nanmin(self.terrain_data), np.nanmax(self.terrain_data)
+        self.background_pixels = grayscale_pixels(self.terrain_data, low, high)
+        self.background_image = grayscale_image(self.background_pixels)
         
     def paintEvent(self, event):
         painter = QPainter(self)
         
-        # Draw cached background
-        if self.background_image:
-            painter.drawImage(0, 0, self.background_image)
+        # Draw cached background, Qt scales it to the widget
+        if self.background_image is not None:
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawImage(QRectF(0, 0, self.width(), self.height()), self.background_image)
         
         if self.terrain_data is None:
             return
@@ -227,17 +249,25 @@ class RegionSelectorDialog(QDialog):
         self.setWindowTitle("Select Region of Interest")
         self.setModal(True)
         
-        # Load dataset
-        self.dataset = gdal.Open(file_path)
-        if self.dataset is None:
-            raise ValueError("Could not open terrain file")
+        # Load dataset, a directory is browsed as a mosaic of its tiles
+        self.mosaic = None
+        self.dataset = None
+        if os.path.isdir(file_path):
+            self.mosaic = shared_mosaic(file_path)
+        else:
+            self.dataset = gdal.Open(file_path)
+            if self.dataset is None:
+                raise ValueError("Could not open terrain file")
             
         # Create layout
         layout = QVBoxLayout(self)
         
         # Preview widget
         self.preview = TerrainPreviewWidget()
-        self.preview.set_terrain_data(self.dataset)
+        if self.mosaic is not None:
+            self.preview.set_mosaic(self.mosaic)
+        else:
+            self.preview.set_terrain_data(self.dataset)
         layout.addWidget(self.preview)
         
         # Coordinate inputs
@@ -0,0 +1,198 @@
+import numpy as np
+
+class RTINMesher:
+    def __init__(self, max_tile_size=1024):
+        """
+        Error-bounded terrain triangulation with right-triangulated irregular
+        networks (RTIN)
+
+        The terrain is cut into square (2^k + 1) tiles sharing their border
+        samples, and an error hierarchy is built once per terrain for each
+        tile. Tiles past the terrain edge are padded with the edge heights,
+        never resampled, so errors are measured on the terrain samples.
+        Extracting a mesh for any maximum vertical error afterwards only
+        walks the hierarchies.
+
+        Args:
+            max_tile_size (int): Largest tile side in cells, a power of two.
+                Smaller terrains use the smallest tile that fits their
+                shorter side.
+        """
+        self.max_tile_size = max_tile_size
+        self.terrain = None
+        self.size = None
+        self.levels = None
+        self.tiles = []
+
+    def build(self, terrain):
+        """Build the error hierarchies for a terrain, skipped if it is unchanged"""
+        if terrain is self.terrain:
+            return
+
+        rows, cols = terrain.shape
+        tile_size = 2
+        while tile_size + 1 < min(rows, cols) and tile_size < self.max_tile_size:
+            tile_size *= 2
+        size = tile_size + 1
+
+        if size != self.size:
+            self.levels = self._levels(size)
+            self.size = size
+        levels = self.levels
+
+        self.terrain = None
+        self.tiles = []
+        for row in range(0, max(rows - 1, 1), tile_size):
+            for col in range(0, max(cols - 1, 1), tile_size):
+                block = np.asarray(terrain[row:row + size, col:col + size], dtype=np.float32)
+                valid_rows, valid_cols = block.shape
+                heights = np.pad(block, ((0, size - valid_rows), (0, size - valid_cols)), mode='edge').ravel()
+
+                # Borders shared with a neighbour tile keep every sample, so
+                # both sides end in the same unit edges and the seam has no
+                # cracks
+                borders = (row > 0, row + tile_size < rows - 1,
+                           col > 0, col + tile_size < cols - 1)
+                errors = self._errors(heights, levels, size, borders, valid_rows, valid_cols)
+                self.tiles.append((row, col, valid_rows, valid_cols, errors))
+        self.terrain = terrain
+
+    def mesh(self, terrain, max_error, scale_x=1.0, scale_z=1.0, height_scale=1.0):
+        """
+        Triangulate a terrain so no sample deviates more than max_error
+
+        Args:
+            terrain (numpy.ndarray): Height data in metres
+            max_error (float): Maximum vertical error in metres
+            scale_x (float): World width of the terrain, centred on 0
+            scale_z (float): World depth of the terrain, centred on 0
+            height_scale (float): Factor from metres to world height
+
+        Returns:
+            tuple: (vertices, indices), float32 (N, 3) positions and uint32
+                indices for GL_TRIANGLES
+        """
+        self.build(terrain)
+        size = self.size
+        rows, cols = terrain.shape
+
+        triangles = []
+        for row, col, valid_rows, valid_cols, errors in self.tiles:
+            tile = self._extract(errors, size, max_error)
+            tile_rows, tile_cols = np.divmod(tile, size)
+            # Triangles in the padding have a vertex past the terrain edge
+            inside = ((tile_rows < valid_rows) & (tile_cols < valid_cols)).all(axis=1)
+            triangles.append((tile_rows[inside] + row) * cols + (tile_cols[inside] + col))
+
+        triangles = np.concatenate(triangles)
+        used, indices = np.unique(triangles, return_inverse=True)
+
+        used_rows, used_cols = np.divmod(used, cols)
+        vertices = np.empty((used.size, 3), dtype=np.float32)
+        vertices[:, 0] = (used_cols / max(cols - 1, 1) - 0.5) * scale_x
+        vertices[:, 1] = np.asarray(terrain[used_rows, used_cols], dtype=np.float32) * height_scale
+        vertices[:, 2] = (used_rows / max(rows - 1, 1) - 0.5) * scale_z
+
+        return vertices, indices.reshape(-1).astype(np.uint32)
+
+    def _levels(self, size):
+        """
+        Every level of triangles of a tile as flat indices of (a, b, c), where
+        a-b is the hypotenuse and c the right angle. The last level has an
+        axis aligned hypotenuse of length 2, the smallest with an integer
+        midpoint.
+        """
+        levels = [self._root_triangles(size)]
+        while True:
+            a, b, c = levels[-1]
+            if abs(int(a[0] % size) - int(b[0] % size)) + abs(int(a[0] // size) - int(b[0] // size)) <= 2:
+                break
+            levels.append(self._split(a, b, c))
+        return levels
+
+    def _errors(self, heights, levels, size, borders, valid_rows, valid_cols):
+        """
+        Midpoint errors of one tile
+
+        Errors go bottom-up. A triangle deviates from the data by at most its
+        midpoint error plus the larger error of its children, so the sum is a
+        strict bound and keeps parents above children, which avoids cracks.
+        Triangles that must always split get an infinite error: those with
+        their midpoint on a shared border, and those across the terrain edge
+        of a padded tile, which end split into triangles fully inside or
+        fully in the padding.
+
+        Args:
+            heights (numpy.ndarray): Flat float32 heights of the padded tile
+            levels (list): Triangle levels from _levels
+            size (int): Tile side in samples
+            borders (tuple): Whether the top, bottom, left and right borders
+                are shared with another tile
+            valid_rows (int): Terrain rows in the tile, the rest is padding
+            valid_cols (int): Terrain columns in the tile
+
+        Returns:
+            numpy.ndarray: Flat float32 error per midpoint sample
+        """
+        last = size - 1
+        errors = np.zeros(size * size, dtype=np.float32)
+        for depth in range(len(levels) - 1, -1, -1):
+            a, b, c = levels[depth]
+            middle = (a + b) // 2
+            middle_error = np.abs((heights[a] + heights[b]) / 2 - heights[middle])
+            if depth < len(levels) - 1:
+                left = (a + c) // 2
+                right = (b + c) // 2
+                middle_error = middle_error + np.maximum(errors[left], errors[right])
+
+            middle_row, middle_col = np.divmod(middle, size)
+            forced = np.zeros(middle.shape, dtype=bool)
+            for shared, line in zip(borders, (middle_row == 0, middle_row == last,
+                                              middle_col == 0, middle_col == last)):
+                if shared:
+                    forced |= line
+            for valid, axis in ((valid_rows, 0), (valid_cols, 1)):
+                if valid < size:
+                    coords = [np.divmod(vertex, size)[axis] for vertex in (a, b, c)]
+                    low = np.minimum(np.minimum(coords[0], coords[1]), coords[2])
+                    high = np.maximum(np.maximum(coords[0], coords[1]), coords[2])
+                    forced |= (low < valid - 1) & (high > valid - 1)
+            middle_error[forced] = np.inf
+
+            np.maximum.at(errors, middle, middle_error)
+        return errors
+
+    def _extract(self, errors, size, max_error):
+        """Triangles of one tile within max_error, as an (N, 3) array of flat indices"""
+        triangles = []
+        a, b, c = self._root_triangles(size)
+        while a.size:
+            ax, ay = a % size, a // size
+            cx, cy = c % size, c // size
+
+            # Triangles with unit legs cannot be split any further
+            splittable = np.abs(ax - cx) + np.abs(ay - cy) > 1
+            split = np.zeros(a.shape, dtype=bool)
+            middle = (a[splittable] + b[splittable]) // 2
+            split[splittable] = errors[middle] > max_error
+
+            keep = ~split
+            triangles.append(np.stack([a[keep], b[keep], c[keep]], axis=1))
+            a, b, c = self._split(a[split], b[split], c[split])
+        return np.concatenate(triangles)
+
+    def _root_triangles(self, size):
+        """The two triangles splitting the grid along its main diagonal"""
+        n = size - 1
+        corner = n * size + n  # (n, n)
+        a = np.array([0, corner], dtype=np.int64)
+        b = np.array([corner, 0], dtype=np.int64)
+        c = np.array([n, n * size], dtype=np.int64)  # (n, 0) and (0, n)
+        return a, b, c
+
+    def _split(self, a, b, c):
+        """Split triangles at their hypotenuse midpoint into left and right children"""
+        middle = (a + b) // 2
+        return (np.concatenate([c, b]),
+                np.concatenate([a, c]),
+                np.concatenate([middle, middle]))
@@ -1,12 +1,19 @@
 from PyQt6.QtGui import QVector3D
 import numpy as np
-from OpenGL.arrays import vbo
 from OpenGL.GL import *
+from .gpu_resources import GPUResources
+from utils.flood_engine import FloodEngine, grid_cell, mask_rectangles
 
 class DamBuilder:
-    def __init__(self):
+    def __init__(self, resources=None):
+        """
+        Args:
+            resources (GPUResources): Owner of the dam and water meshes, whose
+                methods need the GL context to be current
+        """
+        self.resources = resources or GPUResources()
         self.vertices = None
-        self.vbo = None
+        self.mesh = None
         self.thickness = 0.005
         self.color = QVector3D(0.0, 0.0, 0.0)  # Black color
         self.water_color = QVector3D(0.2, 0.4, 0.8)  # Blue color for water
@@ -14,9 +21,19 @@ class DamBuilder:
         
         # Add water mesh attributes
         self.water_vertices = None
-        self.water_vbo = None
+        self.water_indices = None
+        self.water_mesh = None
         self.water_alpha = 0.6  # Water transparency
         self.dam_height = None  # Add dam height attribute
+        self.flood = None  # FloodResult of the last dam
+        self.flood_engine = None
+        
+        # Flooding order behind the last dam, set once computed so the water
+        # level can change without flooding again, see set_water_level
+        self.flood_source = None  # (dam_start, dam_end, seed) cells
+        self.max_water_height = None  # Top of the dam the water stays under
+        self.spill_order = None
+        self.flood_count = 0  # Cells of spill_order under water
 
     def find_terrain_height_at(self, terrain_data, x, z, terrain_shape):
         """Find terrain height at given world coordinates"""
@@ -74,131 +91,121 @@ class DamBuilder:
         
         return min(heights), max(heights)  # Return both min and max heights
 
+    def get_flood_engine(self, terrain_data):
+        """Return the flood engine for terrain_data, made once per terrain"""
+        if self.flood_engine is None or self.flood_engine.terrain_data is not terrain_data:
+            self.flood_engine = FloodEngine(terrain_data)
+        return self.flood_engine
+
     def calculate_flood_area(self, terrain_data, dam_points, flood_point, terrain_shape):
         """Calculate the area that would be flooded by the dam"""
-        rows, cols = terrain_shape
+        engine = self.get_flood_engine(terrain_data)
         
-        # Convert dam points to terrain indices
-        x1 = int(dam_points[0][0] * cols)
-        y1 = int(dam_points[0][1] * rows)
-        x2 = int(dam_points[1][0] * cols)
-        y2 = int(dam_points[1][1] * rows)
-        flood_x = int(flood_point[0] * cols)
-        flood_y = int(flood_point[1] * rows)
-        
-        # Create a mask for the dam line
-        mask = np.zeros((rows, cols), dtype=bool)
-        
-        # Draw dam line on mask using Bresenham's line algorithm
-        def draw_line(x0, y0, x1, y1):
-            dx = abs(x1 - x0)
-            dy = abs(y1 - y0)
-            x, y = x0, y0
-            sx = 1 if x0 < x1 else -1
-            sy = 1 if y0 < y1 else -1
-            err = dx - dy
-            
-            while True:
-                mask[y, x] = True
-                if x == x1 and y == y1:
-                    break
-                e2 = 2 * err
-                if e2 > -dy:
-                    err -= dy
-                    x += sx
-                if e2 < dx:
-                    err += dx
-                    y += sy
-        
-        # Draw dam line
-        draw_line(x1, y1, x2, y2)
+        # Convert dam points to terrain cells
+        dam_start = grid_cell(dam_points[0], terrain_shape)
+        dam_end = grid_cell(dam_points[1], terrain_shape)
+        seed = grid_cell(flood_point, terrain_shape)
         
         # Get dam height based on terrain at dam location
-        dam_height = np.max(terrain_data[mask]) * 1.2  # This is the top of the dam
-        water_height = dam_height * 0.95  # Set water slightly below dam top
-        
-        # Create containment mask based on terrain height
-        containment_mask = terrain_data < water_height  # Use water height for containment
-        
-        # Check which side of the dam line the flood point is on
-        dam_dir_x = x2 - x1
-        dam_dir_y = y2 - y1
-        flood_vec_x = flood_x - x1
-        flood_vec_y = flood_y - y1
-        cross_product = dam_dir_x * flood_vec_y - dam_dir_y * flood_vec_x
-        
-        # Create side mask
-        side_mask = np.zeros((rows, cols), dtype=bool)
-        for i in range(rows):
-            for j in range(cols):
-                point_vec_x = j - x1
-                point_vec_y = i - y1
-                point_cross = dam_dir_x * point_vec_y - dam_dir_y * point_vec_x
-                side_mask[i, j] = (point_cross * cross_product > 0)
-        
-        # Create initial flood mask
-        flood_mask = containment_mask & side_mask
-        flood_mask[mask] = False  # Block dam line
-        
-        # Start flood fill from flood point
-        fill_mask = np.zeros_like(flood_mask)
-        fill_mask[flood_y, flood_x] = True
-        
-        # Perform flood fill
-        flood_area = np.zeros_like(flood_mask)
-        stack = [(flood_y, flood_x)]
-        while stack:
-            y, x = stack.pop()
-            if not flood_area[y, x] and flood_mask[y, x]:
-                flood_area[y, x] = True
-                # Check neighbors
-                for ny, nx in [(y+1,x), (y-1,x), (y,x+1), (y,x-1)]:
-                    if (0 <= ny < rows and 0 <= nx < cols and 
-                        not flood_area[ny, nx] and flood_mask[ny, nx]):
-                        stack.append((ny, nx))
-        
-        # Create water mesh with proper height based on terrain
-        water_vertices = []
-        water_indices = []
-        vertex_count = 0
-        vertex_map = {}  # Map to store vertex indices
-        
-        # Create vertices for flooded area
-        for i in range(rows):
-            for j in range(cols):
-                if flood_area[i, j]:
-                    # Convert to world coordinates
-                    x = (j / cols) - 0.5
-                    z = (i / rows) - 0.5
-                    
-                    # Set water height to be slightly below dam top
-                    y = water_height * self.height_scale
-                    
-                    # Store vertex and its index
-                    vertex_map[(i,j)] = vertex_count
-                    water_vertices.extend([x, y, z])
-                    vertex_count += 1
-        
-        # Create triangles
-        for i in range(rows-1):
-            for j in range(cols-1):
-                if (flood_area[i,j] and flood_area[i+1,j] and 
-                    flood_area[i,j+1] and flood_area[i+1,j+1]):
-                    # Get vertex indices
-                    v1 = vertex_map[(i,j)]
-                    v2 = vertex_map[(i+1,j)]
-                    v3 = vertex_map[(i,j+1)]
-                    v4 = vertex_map[(i+1,j+1)]
-                    
-                    # Create two triangles
-                    water_indices.extend([v1, v2, v3, v3, v2, v4])
-        
-        # Store water mesh if vertices exist
-        if water_vertices:
-            self.water_vertices = np.array(water_vertices, dtype=np.float32)
-            self.water_indices = np.array(water_indices, dtype=np.uint32)
-            self.water_vbo = vbo.VBO(self.water_vertices)
-            self.water_ibo = vbo.VBO(self.water_indices, target=GL_ELEMENT_ARRAY_BUFFER)
+        dam_height = engine.dam_height(dam_start, dam_end) * 1.2  # This is the top of the dam
+        # Water never rises over the dam drawn by create_dam, whose sampled
+        # top can be below the line's
+        self.max_water_height = float(min(dam_height, self.dam_height or dam_height))
+        water_height = min(dam_height * 0.95, self.max_water_height)  # Set water slightly below dam top
+        
+        # Flood the basin behind the dam that contains the flood point
+        self.flood = engine.flood(dam_start, dam_end, seed, water_height)
+        flood_area = self.flood.mask
+        self.flood_source = (dam_start, dam_end, seed)
+        self.spill_order = None
+        
+        self.create_water_mesh(flood_area, water_height, terrain_shape)
+
+    def set_spill_order(self, spill_order):
+        """
+        Use the flooding order behind the current dam for water level changes,
+        the context must be current
+        
+        The flood and its water mesh are rebuilt from the order, so the mask,
+        flooded cell count and mesh always come from it.
+        
+        Args:
+            spill_order (SpillOrder): FloodEngine.spill_order of flood_engine
+                for flood_source, up to max_water_height
+        """
+        water_height = self.flood.water_height
+        self.spill_order = spill_order
+        self.flood = spill_order.flood(water_height)
+        self.flood_count = spill_order.count(water_height)
+        self.create_water_mesh(self.flood.mask, water_height, spill_order.shape, spill_order.bounds)
+
+    def water_level_range(self):
+        """(lowest, highest) water level of the reservoir, None until it is ordered"""
+        if self.spill_order is None or len(self.spill_order.cells) == 0:
+            return None
+        return float(self.spill_order.spill_heights[0]), self.max_water_height
+
+    def set_water_level(self, water_height):
+        """
+        Raise or lower the water behind the dam, the context must be current
+        
+        Only the cells between the old and new level are flooded or drained,
+        the water mesh is then rebuilt.
+        """
+        if self.spill_order is None:
+            return
+        self.flood = self.spill_order.flood(water_height, self.flood.mask, self.flood_count)
+        self.flood_count = self.spill_order.count(water_height)
+        self.create_water_mesh(self.flood.mask, water_height, self.spill_order.shape,
+                               self.spill_order.bounds)
+
+    def create_water_mesh(self, flood_area, water_height, terrain_shape, bounds=None):
+        """
+        Mesh the flat water surface over the flooded cells
+        
+        The surface spans every grid square whose four corner cells are
+        flooded. Those squares are merged into rectangles, two triangles each,
+        so a large reservoir needs a few thousand triangles.
+        
+        Args:
+            flood_area (numpy.ndarray): Boolean grid of flooded cells
+            water_height (float): Water surface height in terrain units
+            terrain_shape (tuple): (rows, cols) of the terrain
+            bounds (tuple): (top, bottom, left, right) box holding every
+                flooded cell, ends exclusive, so only it is scanned
+        """
+        rows, cols = terrain_shape
+        top, bottom, left, right = bounds if bounds is not None else (0, rows, 0, cols)
+        area = flood_area[top:bottom, left:right]
+        squares = (area[:-1, :-1] & area[1:, :-1] &
+                   area[:-1, 1:] & area[1:, 1:])
+        row0, row1, col0, col1 = mask_rectangles(squares)
+        if row0.size == 0:
+            self.clear_water()
+            return
+        row0, row1 = row0 + top, row1 + top
+        col0, col1 = col0 + left, col1 + left
+            
+        # Corners (row0, col0), (row1, col0), (row0, col1), (row1, col1) of each rectangle
+        corner_rows = np.stack([row0, row1, row0, row1], axis=1)
+        corner_cols = np.stack([col0, col0, col1, col1], axis=1)
+        vertices = np.empty((row0.size, 4, 3), dtype=np.float32)
+        vertices[..., 0] = corner_cols / cols - 0.5
+        vertices[..., 1] = water_height * self.height_scale
+        vertices[..., 2] = corner_rows / rows - 0.5
+        
+        vertex_count = row0.size * 4
+        dtype = np.uint16 if vertex_count <= 0xFFFF else np.uint32
+        corners = np.arange(0, vertex_count, 4, dtype=dtype)[:, None]
+        indices = corners + np.array([0, 1, 2, 2, 1, 3], dtype=dtype)
+        
+        # Store and upload the water mesh, reusing the previous buffers
+        self.water_vertices = vertices.reshape(-1)
+        self.water_indices = indices.reshape(-1)
+        if self.water_mesh is None:
+            self.water_mesh = self.resources.mesh()
+        self.water_mesh.set_vertices(vertices.reshape(-1, 3))
+        self.water_mesh.set_indices(self.water_indices, GL_TRIANGLES)
 
     def create_dam(self, terrain_data, dam_points, flood_point, terrain_shape):
         """Create a dam mesh from the given points"""
@@ -292,9 +299,11 @@ class DamBuilder:
             back_right.x(), dam_height_scaled, back_right.z(),
         ])
         
-        # Store vertices and create VBO
+        # Store vertices and upload them, reusing the previous buffer
         self.vertices = np.array(vertices, dtype=np.float32)
-        self.vbo = vbo.VBO(self.vertices)
+        if self.mesh is None:
+            self.mesh = self.resources.mesh()
+        self.mesh.set_vertices(self.vertices.reshape(-1, 3), GL_TRIANGLE_STRIP)
         
         # Calculate flood area after creating dam
         self.calculate_flood_area(terrain_data, dam_points, flood_point, terrain_shape)
@@ -302,7 +311,7 @@ class DamBuilder:
     def render(self, shader_program):
         """Render the dam and water area"""
         # Render dam
-        if self.vbo is not None:
+        if self.mesh is not None:
             shader_program.use()
             # Use override_color (not override_color_with_alpha) for solid black dam
             shader_program.set_uniform_3f("override_color", 
@@ -312,15 +321,10 @@ class DamBuilder:
             shader_program.set_uniform_1i("use_override_color", True)
             shader_program.set_uniform_4f("override_color_with_alpha", 0, 0, 0, 0)  # Reset alpha uniform
             
-            self.vbo.bind()
-            glEnableVertexAttribArray(0)
-            glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
-            glDrawArrays(GL_TRIANGLE_STRIP, 0, len(self.vertices) // 3)
-            glDisableVertexAttribArray(0)
-            self.vbo.unbind()
+            self.mesh.draw()
         
         # Render water area
-        if self.water_vbo is not None:
+        if self.water_mesh is not None:
             # Enable transparency for water only
             glEnable(GL_BLEND)
             glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
@@ -333,14 +337,7 @@ class DamBuilder:
                                         self.water_alpha)
             shader_program.set_uniform_1i("use_override_color", True)
             
-            self.water_vbo.bind()
-            self.water_ibo.bind()
-            glEnableVertexAttribArray(0)
-            glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
-            glDrawElements(GL_TRIANGLES, len(self.water_indices), GL_UNSIGNED_INT, None)
-            glDisableVertexAttribArray(0)
-            self.water_vbo.unbind()
-            self.water_ibo.unbind()
+            self.water_mesh.draw()
             
             glDisable(GL_BLEND)
         
@@ -349,13 +346,25 @@ class DamBuilder:
         shader_program.set_uniform_4f("override_color_with_alpha", 0, 0, 0, 0)
 
     def clear(self):
-        """Clear all dam and water data"""
+        """Clear all dam and water data and free their GPU buffers"""
         self.vertices = None
-        self.vbo = None
-        self.water_vertices = None
-        self.water_vbo = None
-        self.water_ibo = None
+        if self.mesh is not None:
+            self.mesh.delete()
+            self.mesh = None
+        self.clear_water()
         self.dam_height = None  # Reset dam height
+        self.flood = None
+        self.flood_source = None
+        self.max_water_height = None
+        self.spill_order = None
+        
+    def clear_water(self):
+        """Free the water mesh"""
+        self.water_vertices = None
+        self.water_indices = None
+        if self.water_mesh is not None:
+            self.water_mesh.delete()
+            self.water_mesh = None
 
     def get_dam_stats(self):
         """Return dam statistics"""
@@ -363,6 +372,11 @@ class DamBuilder:
             return None
             
         # Convert from world scale to original terrain units (no height_scale division)
-        return {
+        stats = {
             'height': self.dam_height  # Return raw height value
-        } 
\ No newline at end of file
+        }
+        if self.flood is not None:
+            stats['water_level'] = self.flood.water_height
+            stats['flood_area'] = self.flood.area
+            stats['flood_volume'] = self.flood.volume
+        return stats 
\ No newline at end of file
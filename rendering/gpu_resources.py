@@ -0,0 +1,361 @@
+from collections import deque
+from OpenGL.GL import *
+import ctypes
+import numpy as np
+
+# Index that ends one triangle strip and starts the next, per index type
+PRIMITIVE_RESTART = {np.uint16: 0xFFFF, np.uint32: 0xFFFFFFFF}
+
+class GPUResources:
+    def __init__(self):
+        """
+        Owner of the GL buffers, textures and vertex arrays of a widget
+
+        Every object is created through here, so its memory is counted in
+        total_bytes until it is deleted. All methods need the GL context to
+        be current.
+        """
+        self.objects = set()
+
+    @property
+    def total_bytes(self):
+        """GPU memory held by live buffers and textures"""
+        return sum(obj.nbytes for obj in self.objects)
+
+    def buffer(self, target=GL_ARRAY_BUFFER, usage=GL_STATIC_DRAW):
+        return GPUBuffer(self, target, usage)
+
+    def texture(self):
+        return GPUTexture(self)
+
+    def mesh(self):
+        return Mesh(self)
+
+    def release_all(self):
+        """Delete every object, for example before the context goes away"""
+        for obj in list(self.objects):
+            obj.delete()
+
+class GPUBuffer:
+    def __init__(self, resources, target, usage):
+        self.resources = resources
+        self.target = target
+        self.usage = usage
+        self.buffer_id = glGenBuffers(1)
+        self.nbytes = 0
+        resources.objects.add(self)
+
+    def upload(self, data):
+        """
+        Replace the buffer contents, keeping the same buffer name
+
+        Same-sized updates orphan the old storage first, so the driver does
+        not wait for draws that still read it. The buffer is left bound,
+        which also records element buffers in the bound vertex array.
+        """
+        data = np.ascontiguousarray(data)
+        glBindBuffer(self.target, self.buffer_id)
+        if data.nbytes == self.nbytes:
+            glBufferData(self.target, data.nbytes, None, self.usage)
+            glBufferSubData(self.target, 0, data.nbytes, data)
+        else:
+            glBufferData(self.target, data.nbytes, data, self.usage)
+            self.nbytes = data.nbytes
+
+    def allocate(self, nbytes):
+        """Give the buffer uninitialised storage, filled later with write()"""
+        glBindBuffer(self.target, self.buffer_id)
+        glBufferData(self.target, nbytes, None, self.usage)
+        glBindBuffer(self.target, 0)
+        self.nbytes = nbytes
+
+    def write(self, offset, data):
+        """
+        Copy bytes into a range of the storage through a mapping
+
+        The range is mapped unsynchronized, so it must not be in use by
+        the GPU, as is the case for buffers that are not drawn yet.
+        """
+        glBindBuffer(self.target, self.buffer_id)
+        pointer = glMapBufferRange(
+            self.target, offset, data.nbytes,
+            GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_RANGE_BIT | GL_MAP_UNSYNCHRONIZED_BIT
+        )
+        if pointer:
+            ctypes.memmove(pointer, data.ctypes.data, data.nbytes)
+            glUnmapBuffer(self.target)
+        else:
+            glBufferSubData(self.target, offset, data.nbytes, data)
+        glBindBuffer(self.target, 0)
+
+    def bind(self):
+        glBindBuffer(self.target, self.buffer_id)
+
+    def delete(self):
+        if self.buffer_id is None:
+            return
+        glDeleteBuffers(1, [self.buffer_id])
+        self.buffer_id = None
+        self.nbytes = 0
+        self.resources.objects.discard(self)
+
+class GPUTexture:
+    def __init__(self, resources):
+        self.resources = resources
+        self.texture_id = glGenTextures(1)
+        self.shape = None
+        self.nbytes = 0
+        resources.objects.add(self)
+
+    def upload_heights(self, heights):
+        """Upload float32 heights as a single channel texture, reusing same-sized storage"""
+        heights = np.ascontiguousarray(heights, dtype=np.float32)
+        rows, cols = heights.shape
+
+        glBindTexture(GL_TEXTURE_2D, self.texture_id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        if self.shape == heights.shape:
+            glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, cols, rows, GL_RED, GL_FLOAT, heights)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_R32F, cols, rows, 0, GL_RED, GL_FLOAT, heights)
+            self._set_parameters(heights.shape)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def upload_heights_from(self, pixels, shape):
+        """Fill the texture from float32 heights in a pixel unpack buffer"""
+        rows, cols = shape
+        glBindTexture(GL_TEXTURE_2D, self.texture_id)
+        pixels.bind()
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        # With an unpack buffer bound the data pointer is an offset into it
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_R32F, cols, rows, 0, GL_RED, GL_FLOAT, None)
+        self._set_parameters(shape)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def _set_parameters(self, shape):
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        self.shape = tuple(shape)
+        self.nbytes = shape[0] * shape[1] * 4
+
+    def bind(self, unit=0):
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(GL_TEXTURE_2D, self.texture_id)
+
+    def delete(self):
+        if self.texture_id is None:
+            return
+        glDeleteTextures(1, [self.texture_id])
+        self.texture_id = None
+        self.nbytes = 0
+        self.resources.objects.discard(self)
+
+class Mesh:
+    def __init__(self, resources):
+        """
+        Vertex array with a float32 position buffer at attribute 0 and an
+        optional index buffer, which may be shared between meshes
+        """
+        self.resources = resources
+        self.vao = glGenVertexArrays(1)
+        self.vertex_buffer = None
+        self.index_buffer = None
+        self.owns_index_buffer = False
+        self.vertex_count = 0
+        self.index_count = 0
+        self.index_type = GL_UNSIGNED_INT
+        self.primitive = GL_TRIANGLES
+        self.nbytes = 0  # Buffers are counted on their own
+        resources.objects.add(self)
+
+    def set_vertices(self, vertices, primitive=None):
+        """Upload (N, 3) float32 positions"""
+        if self.vertex_buffer is None:
+            self.vertex_buffer = self.resources.buffer(GL_ARRAY_BUFFER)
+        vertices = np.asarray(vertices, dtype=np.float32)
+        self.vertex_buffer.upload(vertices)
+        self.set_vertex_buffer(self.vertex_buffer, len(vertices.reshape(-1, 3)), primitive)
+
+    def set_vertex_buffer(self, vertex_buffer, count, primitive=None):
+        """Draw positions from a buffer, which this mesh then owns"""
+        if self.vertex_buffer is not None and self.vertex_buffer is not vertex_buffer:
+            self.vertex_buffer.delete()
+        self.vertex_buffer = vertex_buffer
+
+        glBindVertexArray(self.vao)
+        vertex_buffer.bind()
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.vertex_count = count
+        if primitive is not None:
+            self.primitive = primitive
+
+    def clear_vertices(self):
+        """Free the position buffer, for meshes drawn without attributes"""
+        if self.vertex_buffer is None:
+            return
+        glBindVertexArray(self.vao)
+        glDisableVertexAttribArray(0)
+        glBindVertexArray(0)
+        self.vertex_buffer.delete()
+        self.vertex_buffer = None
+        self.vertex_count = 0
+
+    def set_indices(self, indices, primitive):
+        """Upload uint16 or uint32 indices into a buffer owned by this mesh"""
+        if not self.owns_index_buffer:
+            self.index_buffer = self.resources.buffer(GL_ELEMENT_ARRAY_BUFFER)
+            self.owns_index_buffer = True
+
+        glBindVertexArray(self.vao)
+        self.index_buffer.upload(indices)
+        glBindVertexArray(0)
+
+        self.index_count = len(indices)
+        self.index_type = GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT
+        self.primitive = primitive
+
+    def set_index_buffer(self, index_buffer, count, index_type, primitive, owned=False):
+        """Draw with an index buffer, shared with other meshes unless owned"""
+        if self.owns_index_buffer and self.index_buffer is not index_buffer:
+            self.index_buffer.delete()
+        self.index_buffer = index_buffer
+        self.owns_index_buffer = owned
+
+        glBindVertexArray(self.vao)
+        index_buffer.bind()
+        glBindVertexArray(0)
+
+        self.index_count = count
+        self.index_type = index_type
+        self.primitive = primitive
+
+    def draw(self):
+        glBindVertexArray(self.vao)
+        if self.index_buffer is not None:
+            if self.primitive == GL_TRIANGLE_STRIP:
+                dtype = np.uint16 if self.index_type == GL_UNSIGNED_SHORT else np.uint32
+                glPrimitiveRestartIndex(PRIMITIVE_RESTART[dtype])
+            glDrawElements(self.primitive, self.index_count, self.index_type, None)
+        else:
+            glDrawArrays(self.primitive, 0, self.vertex_count)
+        glBindVertexArray(0)
+
+    def delete(self):
+        """Free the vertex array and the buffers this mesh owns"""
+        if self.vao is None:
+            return
+        glDeleteVertexArrays(1, [self.vao])
+        self.vao = None
+        if self.vertex_buffer is not None:
+            self.vertex_buffer.delete()
+            self.vertex_buffer = None
+        if self.owns_index_buffer:
+            self.index_buffer.delete()
+        self.index_buffer = None
+        self.resources.objects.discard(self)
+
+class StreamingUpload:
+    def __init__(self, resources, chunk_bytes=8 << 20):
+        """
+        Fill new buffers and textures a chunk per frame
+
+        Buffers get their storage up front and are written through mapped
+        ranges, textures through a pixel unpack buffer, so the objects they
+        replace keep rendering meanwhile. After the last chunk a fence tells
+        when the GPU has consumed everything, and the new objects can be
+        swapped in without a stall.
+
+        Args:
+            resources (GPUResources): Owner of the new objects
+            chunk_bytes (int): Bytes copied per step
+        """
+        self.resources = resources
+        self.chunk_bytes = chunk_bytes
+        self.steps = deque()  # (function, bytes) pairs
+        self.objects = []
+        self.staging = []  # Pixel buffers freed once the fence signals
+        self.total_bytes = 0
+        self.uploaded_bytes = 0
+        self.fence = None
+        self.finished = False
+
+    def buffer(self, target, data):
+        """New buffer that will hold data"""
+        data = np.ascontiguousarray(data)
+        buffer = self.resources.buffer(target)
+        buffer.allocate(data.nbytes)
+        self.objects.append(buffer)
+        self._queue_copy(buffer, data)
+        return buffer
+
+    def texture_heights(self, heights):
+        """New single channel texture that will hold float32 heights"""
+        heights = np.ascontiguousarray(heights, dtype=np.float32)
+        texture = self.resources.texture()
+        pixels = self.resources.buffer(GL_PIXEL_UNPACK_BUFFER, GL_STREAM_DRAW)
+        pixels.allocate(heights.nbytes)
+        self.objects.extend([texture, pixels])
+        self.staging.append(pixels)
+
+        self._queue_copy(pixels, heights)
+        self.steps.append((lambda: texture.upload_heights_from(pixels, heights.shape), 0))
+        return texture
+
+    def _queue_copy(self, buffer, data):
+        raw = data.reshape(-1).view(np.uint8)
+        for offset in range(0, raw.nbytes, self.chunk_bytes):
+            chunk = raw[offset:offset + self.chunk_bytes]
+            self.steps.append((lambda chunk=chunk, offset=offset: buffer.write(offset, chunk), chunk.nbytes))
+        self.total_bytes += raw.nbytes
+
+    def step(self):
+        """
+        Copy the next chunk, the context must be current
+
+        Returns:
+            bool: True once the GPU has all the data
+        """
+        if self.finished:
+            return True
+
+        copied = 0
+        while self.steps and copied < self.chunk_bytes:
+            function, nbytes = self.steps.popleft()
+            function()
+            copied += nbytes
+        self.uploaded_bytes += copied
+        if self.steps:
+            return False
+
+        if self.fence is None:
+            self.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            glFlush()
+        # Poll without waiting, the next frame asks again
+        if glClientWaitSync(self.fence, 0, 0) not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+            return False
+
+        glDeleteSync(self.fence)
+        self.fence = None
+        for pixels in self.staging:
+            pixels.delete()
+        self.staging = []
+        self.finished = True
+        return True
+
+    def cancel(self):
+        """Free everything created for this upload, the context must be current"""
+        if self.fence is not None:
+            glDeleteSync(self.fence)
+            self.fence = None
+        for obj in self.objects:
+            obj.delete()
+        self.objects = []
+        self.staging = []
+        self.steps.clear()
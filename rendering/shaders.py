@@ -1,63 +1,211 @@
 from OpenGL.GL import *
+import hashlib
+import os
+import numpy as np
+
+def default_shader_cache_dir():
+    """Return the program binary cache directory, overridable with TERRAINVIZ_SHADER_CACHE_DIR"""
+    return os.environ.get(
+        'TERRAINVIZ_SHADER_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'terrainviz', 'shaders')
+    )
 
 class ShaderProgram:
-    def __init__(self):
+    def __init__(self, cache_dir=None, use_binary_cache=True):
+        """
+        Args:
+            cache_dir (str): Directory for linked program binaries
+            use_binary_cache (bool): Load and store program binaries so later
+                launches skip compiling, when the driver supports it
+        """
         self.program_id = glCreateProgram()
         self.shaders = []
+        self.sources = []
+        self.uniform_locations = {}
+        self.cache_dir = cache_dir or default_shader_cache_dir()
+        self.use_binary_cache = use_binary_cache
 
     def add_shader(self, shader_type, source):
-        """Add a shader to the program"""
+        """Add a shader to the program, compiled in link() unless a cached binary is used"""
+        self.sources.append((shader_type, source))
+
+    def compile_shader(self, shader_type, source):
+        """Compile and attach a shader"""
         shader = glCreateShader(shader_type)
         glShaderSource(shader, source)
         glCompileShader(shader)
-        
+
         # Check compilation status
         if not glGetShaderiv(shader, GL_COMPILE_STATUS):
             error = glGetShaderInfoLog(shader)
             raise RuntimeError(f"Shader compilation failed: {error}")
-            
+
         glAttachShader(self.program_id, shader)
         self.shaders.append(shader)
 
     def link(self):
         """Link the shader program"""
+        if self.use_binary_cache and self.load_binary():
+            self.cache_uniform_locations()
+            return
+
+        for shader_type, source in self.sources:
+            self.compile_shader(shader_type, source)
+
+        if self.use_binary_cache:
+            try:
+                glProgramParameteri(self.program_id, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+            except Exception:
+                # Program binaries need GL 4.1 or ARB_get_program_binary
+                self.use_binary_cache = False
+
         glLinkProgram(self.program_id)
-        
+
         # Check link status
         if not glGetProgramiv(self.program_id, GL_LINK_STATUS):
             error = glGetProgramInfoLog(self.program_id)
             raise RuntimeError(f"Program linking failed: {error}")
-            
+
         # Clean up individual shaders
         for shader in self.shaders:
+            glDetachShader(self.program_id, shader)
             glDeleteShader(shader)
         self.shaders.clear()
 
+        self.cache_uniform_locations()
+        if self.use_binary_cache:
+            self.save_binary()
+
+    def binary_path(self):
+        """Cache file for this program's sources on the current driver"""
+        parts = [glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION)]
+        key = hashlib.sha1()
+        for part in parts:
+            key.update(part or b'')
+        for shader_type, source in self.sources:
+            key.update(str(int(shader_type)).encode('utf-8'))
+            key.update(source.encode('utf-8'))
+        return os.path.join(self.cache_dir, f"{key.hexdigest()}.bin")
+
+    def load_binary(self):
+        """Link from a cached program binary, return False if there is none or the driver rejects it"""
+        try:
+            path = self.binary_path()
+            with open(path, 'rb') as f:
+                binary_format = int.from_bytes(f.read(4), 'little')
+                binary = np.frombuffer(f.read(), dtype=np.uint8)
+        except OSError:
+            return False
+
+        try:
+            glProgramBinary(self.program_id, binary_format, binary, binary.size)
+            if glGetProgramiv(self.program_id, GL_LINK_STATUS):
+                return True
+        except Exception:
+            pass
+
+        # Stale binary, for example after a driver update
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def save_binary(self):
+        """Store the linked program binary for later launches"""
+        try:
+            length = glGetProgramiv(self.program_id, GL_PROGRAM_BINARY_LENGTH)
+            if not length:
+                return
+            binary = np.empty(length, dtype=np.uint8)
+            written = np.zeros(1, dtype=np.int32)
+            binary_format = np.zeros(1, dtype=np.uint32)
+            glGetProgramBinary(self.program_id, length, written, binary_format, binary)
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.binary_path()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(int(binary_format[0]).to_bytes(4, 'little'))
+                f.write(binary[:int(written[0])].tobytes())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not cache shader program: {str(e)}")
+
+    def cache_uniform_locations(self):
+        """Resolve the locations of all active uniforms once after linking"""
+        self.uniform_locations.clear()
+        count = glGetProgramiv(self.program_id, GL_ACTIVE_UNIFORMS)
+        for i in range(count):
+            name = glGetActiveUniform(self.program_id, i)[0]
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            # Arrays are reported as name[0]
+            name = name.split('[')[0]
+            self.uniform_locations[name] = glGetUniformLocation(self.program_id, name)
+
+    def uniform_location(self, name):
+        """Cached uniform location, -1 for uniforms the program does not use"""
+        location = self.uniform_locations.get(name)
+        if location is None:
+            location = glGetUniformLocation(self.program_id, name)
+            self.uniform_locations[name] = location
+        return location
+
+    def bind_uniform_block(self, name, binding):
+        """Attach a uniform block of the program to a buffer binding point"""
+        index = glGetUniformBlockIndex(self.program_id, name)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(self.program_id, index, binding)
+
     def use(self):
         """Use this shader program"""
         glUseProgram(self.program_id)
 
     def set_uniform_matrix4fv(self, name, value):
         """Set a uniform mat4 value"""
-        location = glGetUniformLocation(self.program_id, name)
-        glUniformMatrix4fv(location, 1, GL_FALSE, value)
+        glUniformMatrix4fv(self.uniform_location(name), 1, GL_FALSE, value)
 
     def set_uniform_1f(self, name, value):
         """Set a uniform float value"""
-        location = glGetUniformLocation(self.program_id, name)
-        glUniform1f(location, value)
+        glUniform1f(self.uniform_location(name), value)
 
     def set_uniform_3f(self, name, x, y, z):
         """Set a uniform vec3 value"""
-        location = glGetUniformLocation(self.program_id, name)
-        glUniform3f(location, x, y, z)
+        glUniform3f(self.uniform_location(name), x, y, z)
 
     def set_uniform_4f(self, name, x, y, z, w):
         """Set a uniform vec4 value"""
-        location = glGetUniformLocation(self.program_id, name)
-        glUniform4f(location, x, y, z, w)
+        glUniform4f(self.uniform_location(name), x, y, z, w)
 
     def set_uniform_1i(self, name, value):
         """Set a uniform integer value"""
-        location = glGetUniformLocation(self.program_id, name)
-        glUniform1i(location, value) 
\ No newline at end of file
+        glUniform1i(self.uniform_location(name), value)
+
+class UniformBuffer:
+    def __init__(self, size, binding):
+        """
+        Uniform buffer object bound to a fixed binding point
+
+        Args:
+            size (int): Buffer size in bytes
+            binding (int): Uniform buffer binding point
+        """
+        self.size = size
+        self.binding = binding
+        self.buffer_id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.buffer_id)
+
+    def update(self, offset, data):
+        """Write float32 data at a byte offset"""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+        glBufferSubData(GL_UNIFORM_BUFFER, offset, data.nbytes, data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def delete(self):
+        glDeleteBuffers(1, [self.buffer_id])
+        self.buffer_id = None
@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from OpenGL.GL import *
+import math
+import numpy as np
+from .gpu_resources import GPUResources
+
+def grid_triangle_indices(n):
+    """GL_TRIANGLES indices of an (n + 1) x (n + 1) vertex grid"""
+    corner = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).ravel()
+    v0, v1 = corner, corner + 1
+    v2, v3 = corner + n + 1, corner + n + 2
+    return np.stack([v0, v2, v1, v1, v2, v3], axis=1).ravel().astype(np.uint32)
+
+def border_ring(n):
+    """Indices of the border vertices of an (n + 1) x (n + 1) grid, in order around it"""
+    top = np.arange(0, n)
+    right = np.arange(n, (n + 1) * n, n + 1)
+    bottom = np.arange((n + 1) * (n + 1) - 1, (n + 1) * n, -1)
+    left = np.arange((n + 1) * n, 0, -(n + 1))
+    return np.concatenate([top, right, bottom, left])
+
+def reduce_2x2(data, op):
+    """Combine 2x2 blocks with a ufunc, a last odd row or column stays alone"""
+    # Strided views avoid padding a copy of the full resolution data
+    rows, cols = data.shape[0] // 2, data.shape[1] // 2
+    result = data[0::2, 0::2].copy()
+    op(result[:rows], data[1::2, 0::2], out=result[:rows])
+    op(result[:, :cols], data[0::2, 1::2], out=result[:, :cols])
+    op(result[:rows, :cols], data[1::2, 1::2], out=result[:rows, :cols])
+    return result
+
+class TerrainChunks:
+    def __init__(self, terrain, scale_x, scale_z, height_scale,
+                 chunk_size=64, pixel_error=2.0, max_cached_chunks=1024, resources=None):
+        """
+        Quadtree of terrain chunks with screen-space error LOD and
+        view-frustum culling
+
+        Every node is a chunk of (chunk_size + 1)^2 vertices, sampled from
+        the terrain with a stride that halves at each level so leaves are at
+        full resolution. Chunks are built and uploaded on first use and kept
+        in an LRU cache of meshes. Skirts hang from every chunk border
+        to hide cracks between neighbours of different levels.
+
+        Args:
+            terrain (numpy.ndarray): Height data in metres
+            scale_x (float): World width of the terrain, centred on 0
+            scale_z (float): World depth of the terrain, centred on 0
+            height_scale (float): Factor from metres to world height
+            chunk_size (int): Cells per chunk side, a power of two
+            pixel_error (float): Allowed screen-space error in pixels
+            max_cached_chunks (int): Chunks kept on the GPU
+            resources (GPUResources): Owner of the chunk meshes
+        """
+        self.terrain = terrain
+        self.scale_x = scale_x
+        self.scale_z = scale_z
+        self.height_scale = height_scale
+        self.chunk_size = chunk_size
+        self.pixel_error = pixel_error
+        self.max_cached_chunks = max_cached_chunks
+        self.chunk_cache = OrderedDict()
+        self.resources = resources or GPUResources()
+
+        rows, cols = terrain.shape
+        self.rows = rows
+        self.cols = cols
+
+        # Levels until the root chunk covers the whole terrain
+        self.levels = 0
+        while chunk_size * 2 ** self.levels < max(rows - 1, cols - 1):
+            self.levels += 1
+
+        self._build_min_max(terrain)
+        self._build_errors(terrain)
+
+        # All chunks share one topology: the grid plus a skirt around it
+        n = chunk_size
+        ring = border_ring(n)
+        skirt_start = (n + 1) * (n + 1)
+        top = ring
+        next_top = np.roll(ring, -1)
+        bottom = skirt_start + np.arange(len(ring))
+        next_bottom = skirt_start + np.roll(np.arange(len(ring)), -1)
+        skirt = np.stack([top, bottom, next_top, next_top, bottom, next_bottom], axis=1)
+        self.ring = ring
+        self.indices = np.concatenate([grid_triangle_indices(n), skirt.ravel().astype(np.uint32)])
+        # 16-bit indices halve the index buffer when a chunk fits
+        if skirt_start + len(ring) <= 0xFFFF:
+            self.indices = self.indices.astype(np.uint16)
+        self.index_type = GL_UNSIGNED_SHORT if self.indices.dtype == np.uint16 else GL_UNSIGNED_INT
+        self.index_buffer = None
+
+    def _build_min_max(self, terrain):
+        """Min/max pyramid over blocks of 2^k cells, for node bounds and errors"""
+        mins = [np.asarray(terrain, dtype=np.float32)]
+        maxs = [mins[0]]
+        while max(mins[-1].shape) > 1:
+            mins.append(reduce_2x2(mins[-1], np.minimum))
+            maxs.append(reduce_2x2(maxs[-1], np.maximum))
+        self.mins = mins
+        self.maxs = maxs
+
+    def _build_errors(self, terrain):
+        """
+        Vertical error of every cell at strides 2^k, for k = 1 .. levels
+
+        A cell at stride s is checked against the points the stride s/2 grid
+        adds, with the same diagonal the chunk triangles use. The error of a
+        cell is its worst midpoint plus the worst error of its children, a
+        strict bound on its distance to the full resolution surface.
+        """
+        rows, cols = terrain.shape
+        errors = [None]
+        for k in range(1, self.levels + 1):
+            half = 2 ** (k - 1)
+            cell_rows = -(-(rows - 1) // (2 * half))
+            cell_cols = -(-(cols - 1) // (2 * half))
+
+            # Stride s/2 lattice, samples past the edge repeat the last one
+            row_index = np.minimum(np.arange(2 * cell_rows + 1) * half, rows - 1)
+            col_index = np.minimum(np.arange(2 * cell_cols + 1) * half, cols - 1)
+            if len(row_index) == rows and len(col_index) == cols:
+                # Full resolution with odd sides, no copy needed
+                lattice = np.asarray(terrain, dtype=np.float32)
+            else:
+                lattice = np.asarray(terrain[np.ix_(row_index, col_index)], dtype=np.float32)
+
+            corners = lattice[::2, ::2]
+            vertical = np.abs(lattice[1::2, ::2] - (corners[:-1] + corners[1:]) / 2)
+            horizontal = np.abs(lattice[::2, 1::2] - (corners[:, :-1] + corners[:, 1:]) / 2)
+            centre = np.abs(lattice[1::2, 1::2] - (corners[:-1, 1:] + corners[1:, :-1]) / 2)
+
+            error = np.maximum.reduce([
+                centre,
+                vertical[:, :-1], vertical[:, 1:],
+                horizontal[:-1], horizontal[1:]
+            ])
+
+            if k > 1:
+                children = errors[-1]
+                pad = ((0, 2 * cell_rows - children.shape[0]), (0, 2 * cell_cols - children.shape[1]))
+                children = np.pad(children, pad)
+                error += children.reshape(cell_rows, 2, cell_cols, 2).max(axis=(1, 3))
+            errors.append(error)
+        self.errors = errors
+
+    def _range(self, row0, row1, col0, col1, block):
+        """Min and max heights of a cell range from pyramid level log2(block)"""
+        k = min(int(math.log2(block)), len(self.mins) - 1)
+        size = 2 ** k
+        rows = slice(row0 // size, max(row0 // size + 1, -(-row1 // size)))
+        cols = slice(col0 // size, max(col0 // size + 1, -(-col1 // size)))
+        return self.mins[k][rows, cols], self.maxs[k][rows, cols]
+
+    def node_info(self, level, ix, iz):
+        """
+        Bounds and geometric error of a node
+
+        Returns:
+            tuple: (row0, row1, col0, col1, y_min, y_max, error) or None if
+                the node lies outside the terrain
+        """
+        stride = 2 ** (self.levels - level)
+        size = self.chunk_size * stride
+        col0, row0 = ix * size, iz * size
+        if col0 >= self.cols - 1 or row0 >= self.rows - 1:
+            return None
+        col1 = min(col0 + size, self.cols - 1)
+        row1 = min(row0 + size, self.rows - 1)
+
+        mins, maxs = self._range(row0, row1 + 1, col0, col1 + 1, size)
+        y_min, y_max = float(mins.min()), float(maxs.max())
+
+        error = 0.0
+        if stride > 1:
+            n = self.chunk_size
+            error = float(self.errors[self.levels - level][iz * n:(iz + 1) * n, ix * n:(ix + 1) * n].max())
+        return row0, row1, col0, col1, y_min, y_max, error
+
+    def select(self, view_projection, camera_position, viewport_height, fov):
+        """
+        Choose the chunks to draw this frame
+
+        Args:
+            view_projection (numpy.ndarray): Row-major projection * view matrix
+            camera_position (numpy.ndarray): Camera position in world space
+            viewport_height (int): Viewport height in pixels
+            fov (float): Vertical field of view in degrees
+
+        Returns:
+            list: (level, ix, iz, info) of the visible chunks
+        """
+        planes = self._frustum_planes(view_projection)
+        # Pixels per world unit at distance 1
+        pixels_per_unit = viewport_height / (2 * math.tan(math.radians(fov) / 2))
+
+        selected = []
+        stack = [(0, 0, 0)]
+        while stack:
+            level, ix, iz = stack.pop()
+            info = self.node_info(level, ix, iz)
+            if info is None:
+                continue
+            box_min, box_max = self._world_box(info)
+            if not self._box_in_frustum(planes, box_min, box_max):
+                continue
+
+            closest = np.clip(camera_position, box_min, box_max)
+            distance = max(float(np.linalg.norm(camera_position - closest)), 1e-6)
+            screen_error = info[6] * self.height_scale * pixels_per_unit / distance
+
+            if level < self.levels and screen_error > self.pixel_error:
+                for child_iz in (2 * iz, 2 * iz + 1):
+                    for child_ix in (2 * ix, 2 * ix + 1):
+                        stack.append((level + 1, child_ix, child_iz))
+            else:
+                selected.append((level, ix, iz, info))
+        return selected
+
+    def render(self, view_projection, camera_position, viewport_height, fov):
+        """Draw the selected chunks, the shader program must already be in use"""
+        if self.index_buffer is None:
+            self.index_buffer = self.resources.buffer(GL_ELEMENT_ARRAY_BUFFER)
+            self.index_buffer.upload(self.indices)
+
+        for level, ix, iz, info in self.select(view_projection, camera_position, viewport_height, fov):
+            self._chunk_mesh(level, ix, iz, info).draw()
+
+    def release(self):
+        """Free every chunk mesh, needs the GL context to be current"""
+        for mesh in self.chunk_cache.values():
+            mesh.delete()
+        self.chunk_cache.clear()
+        if self.index_buffer is not None:
+            self.index_buffer.delete()
+            self.index_buffer = None
+
+    def chunk_vertices(self, level, ix, iz, info):
+        """float32 vertices of a chunk, grid first and then its skirt"""
+        n = self.chunk_size
+        stride = 2 ** (self.levels - level)
+        col0, row0 = ix * n * stride, iz * n * stride
+
+        # Samples past the terrain edge collapse onto the edge
+        rows = np.minimum(row0 + np.arange(n + 1) * stride, self.rows - 1)
+        cols = np.minimum(col0 + np.arange(n + 1) * stride, self.cols - 1)
+        heights = self.terrain[np.ix_(rows, cols)]
+
+        grid = np.empty((n + 1, n + 1, 3), dtype=np.float32)
+        grid[..., 0] = (cols[None, :] / (self.cols - 1) - 0.5) * self.scale_x
+        grid[..., 1] = heights * self.height_scale
+        grid[..., 2] = (rows[:, None] / (self.rows - 1) - 0.5) * self.scale_z
+        grid = grid.reshape(-1, 3)
+
+        # Neighbours interpolate the same edge samples, so their edges never
+        # drop below the lowest point of this chunk
+        skirt = grid[self.ring].copy()
+        skirt[:, 1] = (info[4] - 1.0) * self.height_scale
+        return np.concatenate([grid, skirt])
+
+    def _chunk_mesh(self, level, ix, iz, info):
+        key = (level, ix, iz)
+        mesh = self.chunk_cache.get(key)
+        if mesh is not None:
+            self.chunk_cache.move_to_end(key)
+            return mesh
+
+        mesh = self.resources.mesh()
+        mesh.set_vertices(self.chunk_vertices(level, ix, iz, info))
+        mesh.set_index_buffer(self.index_buffer, len(self.indices), self.index_type, GL_TRIANGLES)
+        self.chunk_cache[key] = mesh
+        while len(self.chunk_cache) > self.max_cached_chunks:
+            _, old_mesh = self.chunk_cache.popitem(last=False)
+            old_mesh.delete()
+        return mesh
+
+    def _world_box(self, info):
+        row0, row1, col0, col1, y_min, y_max, error = info
+        box_min = np.array([
+            (col0 / (self.cols - 1) - 0.5) * self.scale_x,
+            y_min * self.height_scale,
+            (row0 / (self.rows - 1) - 0.5) * self.scale_z
+        ])
+        box_max = np.array([
+            (col1 / (self.cols - 1) - 0.5) * self.scale_x,
+            y_max * self.height_scale,
+            (row1 / (self.rows - 1) - 0.5) * self.scale_z
+        ])
+        return box_min, box_max
+
+    def _frustum_planes(self, m):
+        """Clip planes (a, b, c, d) of a row-major view-projection matrix"""
+        planes = np.array([
+            m[3] + m[0], m[3] - m[0],
+            m[3] + m[1], m[3] - m[1],
+            m[3] + m[2], m[3] - m[2]
+        ])
+        return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+    def _box_in_frustum(self, planes, box_min, box_max):
+        # Test the corner furthest along each plane normal
+        corners = np.where(planes[:, :3] >= 0, box_max, box_min)
+        return bool(np.all(np.einsum('ij,ij->i', planes[:, :3], corners) + planes[:, 3] >= 0))
@@ -0,0 +1,183 @@
+import numpy as np
+from .terrain_chunks import reduce_2x2
+
+class TerrainPicker:
+    def __init__(self, terrain, scale_x, scale_z, height_scale):
+        """
+        CPU ray casting against the terrain heightfield
+
+        Cells of the vertex grid are bounded by a min/max pyramid, so a ray
+        is traced from coarse blocks down to the cells it can hit and then
+        intersected with their bilinear surface. Nothing is read back from
+        the GPU and the result does not depend on the last rendered frame.
+
+        Args:
+            terrain (numpy.ndarray): Height data in metres
+            scale_x (float): World width of the terrain, centred on 0
+            scale_z (float): World depth of the terrain, centred on 0
+            height_scale (float): World units per metre of height
+        """
+        self.terrain = np.asarray(terrain, dtype=np.float32)
+        self.rows, self.cols = self.terrain.shape
+        self.scale_x = scale_x
+        self.scale_z = scale_z
+        self.height_scale = height_scale
+        self._build_pyramid()
+
+    def _build_pyramid(self):
+        """Min and max of each cell's four corners, then of 2^k x 2^k blocks of cells"""
+        t = self.terrain
+        if self.rows < 2 or self.cols < 2:
+            self.mins = self.maxs = []
+            return
+        cell_min = np.minimum(np.minimum(t[:-1, :-1], t[:-1, 1:]), np.minimum(t[1:, :-1], t[1:, 1:]))
+        cell_max = np.maximum(np.maximum(t[:-1, :-1], t[:-1, 1:]), np.maximum(t[1:, :-1], t[1:, 1:]))
+        mins, maxs = [cell_min], [cell_max]
+        while max(mins[-1].shape) > 1:
+            mins.append(reduce_2x2(mins[-1], np.minimum))
+            maxs.append(reduce_2x2(maxs[-1], np.maximum))
+        self.mins = mins
+        self.maxs = maxs
+
+    def to_grid(self, point):
+        """World (x, y, z) to (column, metres, row) grid coordinates"""
+        return np.array([
+            (point[0] / self.scale_x + 0.5) * (self.cols - 1),
+            point[1] / self.height_scale,
+            (point[2] / self.scale_z + 0.5) * (self.rows - 1)
+        ])
+
+    def to_world(self, point):
+        """(column, metres, row) grid coordinates to world (x, y, z)"""
+        return np.array([
+            (point[0] / (self.cols - 1) - 0.5) * self.scale_x,
+            point[1] * self.height_scale,
+            (point[2] / (self.rows - 1) - 0.5) * self.scale_z
+        ])
+
+    def pick(self, origin, direction):
+        """
+        First intersection of a ray with the terrain
+
+        Args:
+            origin (numpy.ndarray): World position the ray starts at, above the terrain
+            direction (numpy.ndarray): World direction of the ray
+
+        Returns:
+            numpy.ndarray: World (x, y, z) of the hit, or None if the ray misses
+        """
+        if not self.mins:
+            return None
+
+        # The grid mapping is affine, so the ray parameter is the same in both spaces
+        o = self.to_grid(origin)
+        d = self.to_grid(np.asarray(origin) + np.asarray(direction)) - o
+
+        # Start from every node of the coarsest level
+        level = len(self.mins) - 1
+        top_rows, top_cols = self.mins[level].shape
+        nodes_i, nodes_j = np.meshgrid(np.arange(top_rows), np.arange(top_cols), indexing='ij')
+        nodes_i, nodes_j = nodes_i.ravel(), nodes_j.ravel()
+
+        while True:
+            size = 1 << level
+            lo = self.mins[level][nodes_i, nodes_j]
+            hi = self.maxs[level][nodes_i, nodes_j]
+            enter, leave = self._footprint_interval(o, d, nodes_i * size, nodes_j * size, size)
+
+            # Part of the footprint interval where the ray is within the height bounds
+            y_enter, y_leave = self._slab(o[1], d[1], lo, hi)
+            box_enter = np.maximum(enter, y_enter)
+            box_leave = np.minimum(leave, y_leave)
+            keep = box_enter <= box_leave
+            if level == 0:
+                break
+
+            # A ray that leaves a node below its lowest point has hit the
+            # surface by then, so nodes it only reaches later are skipped
+            below = keep & (o[1] + d[1] * leave <= lo)
+            if below.any():
+                keep &= box_enter <= leave[below].min()
+
+            nodes_i, nodes_j = nodes_i[keep], nodes_j[keep]
+            if nodes_i.size == 0:
+                return None
+
+            # Children that exist at the next level
+            level -= 1
+            child_rows, child_cols = self.mins[level].shape
+            nodes_i = (nodes_i[:, None] * 2 + np.array([0, 0, 1, 1])[None, :]).ravel()
+            nodes_j = (nodes_j[:, None] * 2 + np.array([0, 1, 0, 1])[None, :]).ravel()
+            inside = (nodes_i < child_rows) & (nodes_j < child_cols)
+            nodes_i, nodes_j = nodes_i[inside], nodes_j[inside]
+
+        cells_i, cells_j = nodes_i[keep], nodes_j[keep]
+        if cells_i.size == 0:
+            return None
+        t = self._bilinear_hits(o, d, cells_i, cells_j, enter[keep], leave[keep])
+        if not np.isfinite(t).any():
+            return None
+        return self.to_world(o + d * t.min())
+
+    def _slab(self, start, step, low, high):
+        """Ray parameters between which start + t * step is in [low, high]"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = (low - start) / step
+            t1 = (high - start) / step
+        if step == 0:
+            # Parallel to the slab, inside it for all t or never
+            inside = (start >= low) & (start <= high)
+            return np.where(inside, -np.inf, np.inf), np.where(inside, np.inf, -np.inf)
+        return np.minimum(t0, t1), np.maximum(t0, t1)
+
+    def _footprint_interval(self, o, d, row0, col0, size):
+        """Ray parameters over the grid footprint of blocks of cells, from t = 0"""
+        col_enter, col_leave = self._slab(o[0], d[0], col0, np.minimum(col0 + size, self.cols - 1))
+        row_enter, row_leave = self._slab(o[2], d[2], row0, np.minimum(row0 + size, self.rows - 1))
+        enter = np.maximum(np.maximum(col_enter, row_enter), 0.0)
+        leave = np.minimum(col_leave, row_leave)
+        return enter, leave
+
+    def _bilinear_hits(self, o, d, cells_i, cells_j, enter, leave):
+        """
+        First ray parameter at which the ray meets the bilinear surface of
+        each cell, within its footprint interval, inf where it does not
+
+        Along the ray both cell coordinates are linear in t, so the surface
+        height minus the ray height is a quadratic in t.
+        """
+        t = self.terrain
+        h00 = t[cells_i, cells_j].astype(np.float64)
+        h01 = t[cells_i, cells_j + 1] - h00
+        h10 = t[cells_i + 1, cells_j] - h00
+        cross = t[cells_i + 1, cells_j + 1] - h00 - h01 - h10
+
+        # Cell local coordinates at t = 0
+        s0 = o[0] - cells_j
+        r0 = o[2] - cells_i
+        a = cross * d[0] * d[2]
+        b = h01 * d[0] + h10 * d[2] + cross * (s0 * d[2] + r0 * d[0]) - d[1]
+        c = h00 + h01 * s0 + h10 * r0 + cross * s0 * r0 - o[1]
+
+        # Numerically stable roots, also covering a == 0 through c / q
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = np.sqrt(b * b - 4 * a * c)
+            q = -0.5 * (b + np.copysign(root, b))
+            roots = np.stack([q / a, c / q])
+
+        eps = 1e-9 * np.maximum(1.0, np.abs(leave))
+        valid = np.isfinite(roots) & (roots >= enter - eps) & (roots <= leave + eps)
+        return np.where(valid, roots, np.inf).min(axis=0)
+
+    def height_at(self, x, z):
+        """Bilinearly interpolated height in metres at world x and z, None outside the terrain"""
+        col, _, row = self.to_grid((x, 0.0, z))
+        if not (0 <= col <= self.cols - 1 and 0 <= row <= self.rows - 1):
+            return None
+        i = min(int(row), self.rows - 2)
+        j = min(int(col), self.cols - 2)
+        s, r = col - j, row - i
+        t = self.terrain
+        top = t[i, j] * (1 - s) + t[i, j + 1] * s
+        bottom = t[i + 1, j] * (1 - s) + t[i + 1, j + 1] * s
+        return float(top * (1 - r) + bottom * r)
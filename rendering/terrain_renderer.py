@@ -1,28 +1,110 @@
 from PyQt6.QtOpenGLWidgets import QOpenGLWidget
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThreadPool, pyqtSignal
 from PyQt6.QtGui import QVector3D, QPainter, QColor, QFont
 from OpenGL.GL import *
-from OpenGL.GLU import *
 import numpy as np
+import os
+import threading
 from .camera import Camera
 from utils.terrain_loader import TerrainLoader
-from utils.terrain_processor import TerrainProcessor
-from OpenGL.arrays import vbo
-from .shaders import ShaderProgram
-from PyQt6.QtWidgets import QMainWindow
+from utils.terrain_mosaic import shared_mosaic
+from utils.terrain_processor import TerrainProcessor, target_shape
+from utils.pyramid_cache import PyramidCache
+from utils.terrain_stats import TerrainStats
+from .shaders import ShaderProgram, UniformBuffer
+from PyQt6.QtWidgets import QMainWindow, QToolTip
 import math
 from .dam_builder import DamBuilder
+from .adaptive_mesh import RTINMesher
+from .terrain_chunks import TerrainChunks
+from .terrain_picker import TerrainPicker
+from .terrain_task import TerrainTask
+from .gpu_resources import GPUResources, StreamingUpload, PRIMITIVE_RESTART
+
+# Uniform buffer binding point of the view and projection matrices
+MATRIX_BINDING = 0
 
 class TerrainRenderer(QOpenGLWidget):
+    # Background terrain loading, see start_terrain_task
+    load_progress = pyqtSignal(str, int)  # stage, percent
+    load_finished = pyqtSignal()
+    load_failed = pyqtSignal(str)  # error message
+    # Flooding order behind the dam is ready, see start_flood_task
+    flood_levels_ready = pyqtSignal()
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.camera = Camera()
         self.terrain_data = None
+        self.terrain_stats = None  # TerrainStats of terrain_data
         self.render_scheme = "Color Height"
         self.detail_level = 100
-        self.vertex_vbo = None
-        self.index_vbo = None
         self.shader_program = None
+        self.matrix_buffer = None
+        
+        # All buffers, textures and vertex arrays are owned by the resource
+        # manager, which frees them when terrain or dam data is replaced
+        self.gpu = GPUResources()
+        self.reported_gpu_bytes = None
+        self.terrain_mesh = None
+        
+        # Strip indices only depend on the grid shape, so they are kept
+        # across loads of terrains with the same size
+        self.grid_indices = None
+        self.grid_index_shape = None
+        self.grid_index_count = 0
+        self.grid_index_type = GL_UNSIGNED_INT
+        
+        # Maximum vertical error in metres of the adaptive mesh, 0 keeps the
+        # uniform grid. The mesher keeps its error hierarchy per terrain.
+        self.max_vertical_error = 0.0
+        self.adaptive_mesher = RTINMesher()
+        
+        # Quadtree of chunks picked per frame by screen-space error instead
+        # of one mesh, for full resolution views of large terrains
+        self.chunked_lod = False
+        self.lod_pixel_error = 2.0
+        self.terrain_chunks = None
+        
+        # Uniform grids are drawn from a height texture, the vertex shader
+        # derives x and z from gl_VertexID so only the indices are buffered
+        self.use_height_texture = True
+        self.max_texture_size = 0  # Queried once the GL context exists
+        self.height_texture = None
+        self.terrain_textured = False  # Whether terrain_mesh reads the texture
+        self.terrain_scale = (1.0, 1.0, 1.0)  # (scale_x, height_scale, scale_z)
+        
+        # Picking casts rays against the heightfield on the CPU, the picker
+        # is built on the first pick after the terrain changes
+        self.terrain_picker = None
+        self.show_elevation = True
+        
+        # On-disk cache of cleaned terrain levels, set to None to disable.
+        # It owns detail changes, the processor's in-memory cache of the
+        # cleaned data is only used while it is disabled.
+        self.pyramid_cache = PyramidCache()
+        
+        self.processor = TerrainProcessor(low_memory=True, tiled=True)
+        self.terrain_source = None  # (file_path, region) of the loaded terrain
+        self.loaded_detail_level = None  # Detail level the source was read at
+        
+        # Loading, cleaning and meshing run on a single worker thread, so the
+        # processor, pyramid cache, mesher and loaded_detail_level are only
+        # used by one task at a time. Only GL uploads happen on this thread.
+        self.task_pool = QThreadPool(self)
+        self.task_pool.setMaxThreadCount(1)
+        self.terrain_task = None
+        self.loading_source = None  # (source, reload) of a load in flight
+        
+        # Long side of the coarse overview shown first while a large terrain
+        # loads, 0 waits for the full pipeline
+        self.overview_size = 512
+        
+        # Meshes larger than a chunk are streamed into new buffers over
+        # several frames while the current terrain keeps rendering, then
+        # swapped in together with their terrain data
+        self.upload_chunk_bytes = 8 << 20
+        self.terrain_upload = None
         
         # Mouse tracking for camera control
         self.setMouseTracking(True)
@@ -32,11 +114,19 @@ class TerrainRenderer(QOpenGLWidget):
         self.isoline_spacing = 500.0
         
         # Replace dam attributes with DamBuilder
-        self.dam_builder = DamBuilder()
+        self.dam_builder = DamBuilder(self.gpu)
+        
+        # Ordering the reservoir for water level changes runs on its own
+        # daemon thread, so terrain loads never wait for it and closing the
+        # window never waits for a cancelled one to reach its next stage
+        self.flood_task = None
         
     def initializeGL(self):
         glClearColor(0.5, 0.7, 1.0, 1.0)  # Sky blue background
         glEnable(GL_DEPTH_TEST)
+        self.max_texture_size = int(glGetIntegerv(GL_MAX_TEXTURE_SIZE))
+        glEnable(GL_PRIMITIVE_RESTART)
+        self.context().aboutToBeDestroyed.connect(self.release_gpu_resources)
         
         # Initialize shaders
         self.init_shaders()
@@ -49,18 +139,39 @@ class TerrainRenderer(QOpenGLWidget):
         layout(location = 0) in vec3 position;
         
         uniform mat4 model;
-        uniform mat4 view;
-        uniform mat4 projection;
+        
+        // Written once per frame, shared by every draw
+        layout(std140) uniform Matrices {
+            mat4 view;
+            mat4 projection;
+        };
+        
+        uniform bool use_height_texture;
+        uniform sampler2D height_texture;
+        uniform vec3 terrain_scale;
         
         out float raw_height;
         out vec2 texCoord;
         
         void main() {
-            gl_Position = projection * view * model * vec4(position, 1.0);
-            raw_height = position.y / 0.000025;
+            vec3 vertex_position = position;
+            if (use_height_texture) {
+                // Regular grid, the vertex index gives the texel
+                ivec2 size = textureSize(height_texture, 0);
+                ivec2 texel = ivec2(gl_VertexID % size.x, gl_VertexID / size.x);
+                vec2 grid = vec2(texel) / vec2(size - 1);
+                vertex_position = vec3(
+                    (grid.x - 0.5) * terrain_scale.x,
+                    texelFetch(height_texture, texel, 0).r * terrain_scale.y,
+                    (grid.y - 0.5) * terrain_scale.z
+                );
+            }
+            
+            gl_Position = projection * view * model * vec4(vertex_position, 1.0);
+            raw_height = vertex_position.y / 0.000025;
             texCoord = vec2(
-                (position.x + 0.5),
-                (position.z + 0.5)
+                (vertex_position.x + 0.5),
+                (vertex_position.z + 0.5)
             );
         }
         """
@@ -123,6 +234,12 @@ class TerrainRenderer(QOpenGLWidget):
         self.shader_program.add_shader(GL_VERTEX_SHADER, vertex_shader)
         self.shader_program.add_shader(GL_FRAGMENT_SHADER, fragment_shader)
         self.shader_program.link()
+        self.shader_program.bind_uniform_block("Matrices", MATRIX_BINDING)
+        self.matrix_buffer = UniformBuffer(2 * 16 * 4, MATRIX_BINDING)
+        
+        # The terrain is never transformed, so the model matrix is set once
+        self.shader_program.use()
+        self.shader_program.set_uniform_matrix4fv("model", np.identity(4, dtype=np.float32))
 
     def resizeGL(self, w, h):
         glViewport(0, 0, w, h)
@@ -131,30 +248,38 @@ class TerrainRenderer(QOpenGLWidget):
     def paintGL(self):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         
+        if self.terrain_upload is not None:
+            self.continue_terrain_upload()
+            
         if self.terrain_data is not None:
             self.render_terrain()
-
-    def generate_terrain_mesh(self):
-        if self.terrain_data is None:
-            return
             
-        rows, cols = self.terrain_data.shape
-        
-        # Calculate decimation factor based on detail level
-        # Higher numbers mean more decimation (fewer vertices)
-        decimation = max(1, int((100 - self.detail_level) / 10))
-        
-        # Use fewer vertices based on decimation
-        used_rows = max(50, rows // decimation)  # Ensure minimum resolution
-        used_cols = max(50, cols // decimation)
+        if self.gpu.total_bytes != self.reported_gpu_bytes:
+            self.update_gpu_statistics()
+
+    def terrain_mesh_settings(self):
+        """Snapshot of the meshing options for a background task"""
+        return {
+            'chunked_lod': self.chunked_lod,
+            'lod_pixel_error': self.lod_pixel_error,
+            'max_vertical_error': self.max_vertical_error,
+            'use_height_texture': self.use_height_texture,
+            'max_texture_size': self.max_texture_size,
+            'grid_index_shape': self.grid_index_shape
+        }
         
-        # Sample terrain data
-        row_indices = np.linspace(0, rows-1, used_rows, dtype=int)
-        col_indices = np.linspace(0, cols-1, used_cols, dtype=int)
-        sampled_terrain = self.terrain_data[row_indices][:, col_indices]
+    def prepare_terrain_mesh(self, terrain_data, settings):
+        """
+        Build the CPU side of the terrain mesh, without any GL calls
         
-        vertices = []
-        indices = []
+        Args:
+            terrain_data (numpy.ndarray): Terrain resampled to the detail level
+            settings (dict): Meshing options from terrain_mesh_settings
+            
+        Returns:
+            dict: Arrays and objects for upload_terrain_mesh
+        """
+        rows, cols = terrain_data.shape
         
         # Calculate terrain scale and center
         height_scale = 0.00003  # Scale down height values
@@ -167,51 +292,160 @@ class TerrainRenderer(QOpenGLWidget):
         else:
             scale_x = aspect_ratio
             scale_z = 1.0
+        mesh = {'scale': (scale_x, height_scale, scale_z), 'shape': (rows, cols)}
+            
+        if settings['chunked_lod']:
+            # Chunks are meshed and uploaded as the camera needs them
+            mesh['kind'] = 'chunks'
+            mesh['chunks'] = TerrainChunks(
+                terrain_data, scale_x, scale_z, height_scale,
+                pixel_error=settings['lod_pixel_error'], resources=self.gpu
+            )
+            return mesh
+            
+        if settings['max_vertical_error'] > 0:
+            # Fewer triangles on flat ground, ridges stay within the error
+            mesh['kind'] = 'adaptive'
+            mesh['vertices'], mesh['indices'] = self.adaptive_mesher.mesh(
+                terrain_data, settings['max_vertical_error'], scale_x, scale_z, height_scale
+            )
+            return mesh
+            
+        mesh['kind'] = 'grid'
+        if settings['grid_index_shape'] != (rows, cols):
+            mesh['strip_indices'] = self.grid_strip_indices(rows, cols)
+            
+        if settings['use_height_texture'] and max(rows, cols) <= settings['max_texture_size']:
+            # Only the heights go to the GPU, read into memory here
+            mesh['heights'] = np.ascontiguousarray(terrain_data, dtype=np.float32)
+            return mesh
             
-        # Generate vertices using NumPy operations
-        x_coords = np.linspace(-scale_x/2, scale_x/2, used_cols)
-        z_coords = np.linspace(-scale_z/2, scale_z/2, used_rows)
-        X, Z = np.meshgrid(x_coords, z_coords)
-        Y = sampled_terrain * height_scale
-        
-        vertices = np.column_stack((X.flatten(), Y.flatten(), Z.flatten()))
-        
-        # Generate indices for triangle strips
-        indices = []
-        for i in range(used_rows - 1):
-            row1 = i * used_cols
-            row2 = (i + 1) * used_cols
-            for j in range(used_cols):
-                indices.extend([row1 + j, row2 + j])
-            # Add degenerate triangles if not at the end
-            if i < used_rows - 2:
-                indices.extend([row2 + used_cols - 1, row2])
-        
-        # Create VBOs
-        self.vertex_vbo = vbo.VBO(vertices.astype(np.float32))
-        self.index_vbo = vbo.VBO(np.array(indices, dtype=np.uint32),
-                                target=GL_ELEMENT_ARRAY_BUFFER)
+        # Generate vertices using NumPy operations, straight into float32
+        vertices = np.empty((rows, cols, 3), dtype=np.float32)
+        vertices[..., 0] = np.linspace(-scale_x/2, scale_x/2, cols, dtype=np.float32)[None, :]
+        vertices[..., 1] = terrain_data
+        vertices[..., 1] *= height_scale
+        vertices[..., 2] = np.linspace(-scale_z/2, scale_z/2, rows, dtype=np.float32)[:, None]
+        mesh['vertices'] = vertices.reshape(-1, 3)
+        return mesh
+        
+    def upload_terrain_mesh(self, mesh):
+        """Replace the terrain on the GPU with a prepared mesh, the context must be current"""
+        self.terrain_scale = mesh['scale']
+        self.release_terrain_chunks()
+        if mesh['kind'] == 'chunks':
+            self.release_terrain_mesh()
+            self.terrain_chunks = mesh['chunks']
+            return
+            
+        # The same vertex array and buffers are refilled for every terrain
+        if self.terrain_mesh is None:
+            self.terrain_mesh = self.gpu.mesh()
+            
+        if mesh['kind'] == 'adaptive':
+            self.terrain_mesh.set_vertices(mesh['vertices'])
+            self.terrain_mesh.set_indices(mesh['indices'], GL_TRIANGLES)
+            self.terrain_textured = False
+            self.release_height_texture()
+            return
+            
+        if self.grid_index_shape != mesh['shape']:
+            indices = mesh.get('strip_indices')
+            if indices is None:
+                # The shared buffer was released after the task started
+                indices = self.grid_strip_indices(*mesh['shape'])
+            if self.grid_indices is None:
+                self.grid_indices = self.gpu.buffer(GL_ELEMENT_ARRAY_BUFFER)
+            self.grid_indices.upload(indices)
+            self.grid_index_shape = mesh['shape']
+            self.grid_index_count = len(indices)
+            self.grid_index_type = GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT
+        self.terrain_mesh.set_index_buffer(
+            self.grid_indices, self.grid_index_count, self.grid_index_type, GL_TRIANGLE_STRIP
+        )
+        
+        if 'heights' in mesh:
+            if self.height_texture is None:
+                self.height_texture = self.gpu.texture()
+            self.height_texture.upload_heights(mesh['heights'])
+            self.terrain_mesh.clear_vertices()
+            self.terrain_textured = True
+            return
+            
+        self.terrain_mesh.set_vertices(mesh['vertices'])
+        self.terrain_textured = False
+        self.release_height_texture()
+        
+    def grid_strip_indices(self, used_rows, used_cols):
+        """
+        Triangle strip indices of a rows x cols vertex grid, one strip per
+        row of cells separated by the primitive restart index
 
+        Returns:
+            numpy.ndarray: uint16 indices when the grid fits, uint32 otherwise
+        """
+        # Keep the largest value free for the restart index
+        dtype = np.uint16 if used_rows * used_cols < 0xFFFF else np.uint32
+        
+        top = (np.arange(used_rows - 1, dtype=dtype)[:, None] * dtype(used_cols) +
+               np.arange(used_cols, dtype=dtype)[None, :])
+        strips = np.empty((used_rows - 1, 2 * used_cols + 1), dtype=dtype)
+        strips[:, 0:-1:2] = top
+        strips[:, 1:-1:2] = top + dtype(used_cols)
+        strips[:, -1] = PRIMITIVE_RESTART[dtype]
+        return strips.ravel()[:-1]
+        
+    def release_terrain_chunks(self):
+        """Free the GPU buffers of the chunked terrain, the context must be current"""
+        if self.terrain_chunks is None:
+            return
+        self.terrain_chunks.release()
+        self.terrain_chunks = None
+        
+    def release_terrain_mesh(self):
+        """Free the single terrain mesh and its height texture"""
+        if self.terrain_mesh is not None:
+            self.terrain_mesh.delete()
+            self.terrain_mesh = None
+        self.release_height_texture()
+        
+    def release_height_texture(self):
+        if self.height_texture is not None:
+            self.height_texture.delete()
+            self.height_texture = None
+            
+    def release_gpu_resources(self):
+        """Free everything before the GL context is destroyed"""
+        self.makeCurrent()
+        self.cancel_terrain_upload()
+        self.gpu.release_all()
+        self.doneCurrent()
+        self.terrain_mesh = None
+        self.terrain_chunks = None
+        self.height_texture = None
+        self.grid_indices = None
+        self.grid_index_shape = None
+        
     def render_terrain(self):
-        if self.terrain_data is None or self.vertex_vbo is None:
+        if self.terrain_data is None:
+            return
+        if self.terrain_mesh is None and self.terrain_chunks is None:
             return
             
         self.shader_program.use()
         
-        # Set common uniforms
-        model = np.identity(4, dtype=np.float32)
-        self.shader_program.set_uniform_matrix4fv("model", model)
-        self.shader_program.set_uniform_matrix4fv("view", self.camera.get_view_matrix())
-        self.shader_program.set_uniform_matrix4fv("projection", self.camera.get_projection_matrix())
+        # Both matrices in one buffer update, column-major as std140 expects
+        self.matrix_buffer.update(0, np.concatenate([
+            np.asarray(self.camera.get_view_matrix(), dtype=np.float32),
+            np.asarray(self.camera.get_projection_matrix(), dtype=np.float32)
+        ]))
         
         # Disable face culling for terrain
         glDisable(GL_CULL_FACE)
         
         # Set height range uniforms using original height values (not scaled)
-        min_height = np.min(self.terrain_data)
-        max_height = np.max(self.terrain_data)
-        self.shader_program.set_uniform_1f("min_height", min_height)
-        self.shader_program.set_uniform_1f("max_height", max_height)
+        self.shader_program.set_uniform_1f("min_height", self.terrain_stats.min)
+        self.shader_program.set_uniform_1f("max_height", self.terrain_stats.max)
         
         # Set color scheme and isolines flags based on render scheme
         show_isolines = "Isolines" in self.render_scheme
@@ -220,52 +454,421 @@ class TerrainRenderer(QOpenGLWidget):
         self.shader_program.set_uniform_1i("show_isolines", show_isolines)
         self.shader_program.set_uniform_1i("color_scheme", 1 if use_yellow_red else 0)
         self.shader_program.set_uniform_1f("isoline_spacing", self.isoline_spacing)
+        self.shader_program.set_uniform_1i("use_height_texture", False)
         
-        # Enable vertex attributes
-        self.vertex_vbo.bind()
-        self.index_vbo.bind()
-        
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        if self.terrain_chunks is not None:
+            # QMatrix4x4.data() is column-major
+            projection = np.array(self.camera.get_projection_matrix(), dtype=np.float64).reshape(4, 4).T
+            view = np.array(self.camera.get_view_matrix(), dtype=np.float64).reshape(4, 4).T
+            position = self.camera.position
+            self.terrain_chunks.render(
+                projection @ view,
+                np.array([position.x(), position.y(), position.z()]),
+                self.height(),
+                self.camera.fov
+            )
+            self.dam_builder.render(self.shader_program)
+            return
         
-        # Draw terrain
-        glDrawElements(GL_TRIANGLE_STRIP, self.index_vbo.size, GL_UNSIGNED_INT, None)
+        if self.terrain_textured:
+            # Height texture path, no vertex attributes
+            self.height_texture.bind(0)
+            self.shader_program.set_uniform_1i("height_texture", 0)
+            self.shader_program.set_uniform_3f("terrain_scale", *self.terrain_scale)
+            self.shader_program.set_uniform_1i("use_height_texture", True)
+            
+            self.terrain_mesh.draw()
+            
+            self.shader_program.set_uniform_1i("use_height_texture", False)
+            glBindTexture(GL_TEXTURE_2D, 0)
+        else:
+            self.terrain_mesh.draw()
         
         # Render dam if exists
         self.dam_builder.render(self.shader_program)
         
-        # Cleanup
-        glDisableVertexAttribArray(0)
-        self.vertex_vbo.unbind()
-        self.index_vbo.unbind()
-
     def load_terrain(self, file_path, region=None):
+        """Load a terrain in the background, cancelling any load in flight"""
+        self.start_terrain_task((file_path, region), reload=True)
+            
+    def set_detail_level(self, detail_level):
+        """Re-mesh the loaded terrain at a new detail level from the caches"""
+        self.detail_level = detail_level
+        if self.loading_source is not None:
+            self.start_terrain_task(*self.loading_source)
+        elif self.terrain_source is not None:
+            self.start_terrain_task(self.terrain_source)
+            
+    def remesh_terrain(self):
+        """Rebuild the terrain mesh with the current options"""
+        if self.loading_source is not None:
+            # The load in flight started with the old options
+            self.start_terrain_task(*self.loading_source)
+        elif self.terrain_data is not None:
+            self.start_terrain_task()
+            
+    def start_terrain_task(self, source=None, reload=False):
+        """
+        Run the terrain pipeline on the worker thread, cancelling the task in flight
+        
+        Args:
+            source (tuple): (file_path, region) to load, None to only
+                rebuild the mesh of the current terrain
+            reload (bool): Drop the cleaned data cached for the last source
+        """
+        self.cancel_terrain_task()
+        terrain_data = self.terrain_data if source is None else None
+        task = TerrainTask(
+            self.prepare_terrain, source, reload, self.detail_level,
+            terrain_data, self.terrain_mesh_settings()
+        )
+        task.signals.progress.connect(
+            lambda stage, percent, task=task: self.report_terrain_task(task, stage, percent))
+        task.signals.partial.connect(
+            lambda result, task=task: self.show_terrain_overview(task, result))
+        task.signals.finished.connect(
+            lambda result, task=task: self.finish_terrain_task(task, result))
+        task.signals.failed.connect(
+            lambda message, task=task: self.fail_terrain_task(task, message))
+            
+        self.terrain_task = task
+        self.loading_source = (source, reload) if source is not None else None
+        self.task_pool.start(task)
+        
+    def cancel_terrain_task(self):
+        """Stop the task in flight at its next stage, its result is discarded"""
+        if self.terrain_upload is not None:
+            self.makeCurrent()
+            self.cancel_terrain_upload()
+            self.doneCurrent()
+            self.loading_source = None
+        if self.terrain_task is None:
+            return
+        self.terrain_task.cancel()
+        self.task_pool.clear()  # Drop it if it has not started yet
+        self.terrain_task = None
+        self.loading_source = None
+        
+    def prepare_terrain(self, task, source, reload, detail_level, terrain_data, settings):
+        """
+        Load, clean, resample and mesh a terrain, runs on the worker thread
+        
+        Renderer state is only replaced by finish_terrain_task, on the GUI
+        thread, so the current terrain keeps rendering meanwhile.
+        
+        Returns:
+            dict: The new terrain data and statistics when loading, and the
+                prepared mesh
+        """
+        result = {'source': source}
+        if source is not None:
+            if reload:
+                self.processor.invalidate()
+                self.loaded_detail_level = None
+                
+                overview = self.prepare_overview(task, source, detail_level, settings)
+                if overview is not None:
+                    task.publish(overview)
+                    # The overview replaced the shared grid indices
+                    settings = dict(settings, grid_index_shape=overview['mesh']['shape'])
+                    
+            terrain_data = self.process_terrain(source, detail_level, task.report)
+            
+            task.report("Computing statistics", 70)
+            result['terrain_data'] = terrain_data
+            result['stats'] = TerrainStats.compute(terrain_data)
+            
+        task.report("Building mesh", 80)
+        result['mesh'] = self.prepare_terrain_mesh(terrain_data, settings)
+        task.report("Uploading", 95)
+        return result
+        
+    def prepare_overview(self, task, source, detail_level, settings):
+        """
+        Read and mesh a coarse version of a terrain through a decimated read,
+        which GDAL serves from the file's overviews when it has them
+        
+        Returns:
+            dict: A result like prepare_terrain's, or None when the full
+                result comes quickly anyway because the terrain is small at
+                this detail level or its pyramid is cached
+        """
+        if not self.overview_size:
+            return None
+        file_path, region = source
+        if self.pyramid_cache is not None and self.pyramid_cache.contains(file_path, region, detail_level):
+            return None
+            
+        loader = TerrainLoader()
+        shape = loader.shape(file_path, region)
+        if max(target_shape(shape, detail_level)) <= 2 * self.overview_size:
+            return None
+            
+        task.report("Reading overview", 0)
+        if os.path.isdir(file_path) and region is None:
+            # Whole tile directories are previewed from decimated tiles of the
+            # indexed mosaic the loader shares
+            overview = shared_mosaic(file_path).overview(self.overview_size)
+        else:
+            overview = loader.load(file_path, region, 100 * self.overview_size / max(shape))
+        terrain_data = self.processor.clean_terrain(overview).astype(np.float32, copy=False)
+        
+        task.report("Building overview mesh", 5)
+        return {
+            'source': source,
+            'terrain_data': terrain_data,
+            'stats': TerrainStats.compute(terrain_data),
+            'mesh': self.prepare_terrain_mesh(terrain_data, settings)
+        }
+        
+    def report_terrain_task(self, task, stage, percent):
+        if task is self.terrain_task:
+            self.load_progress.emit(stage, percent)
+            
+    def show_terrain_overview(self, task, result):
+        """Show the coarse overview of the load in flight until it finishes"""
+        if task is self.terrain_task:
+            self.apply_terrain_result(result)
+            
+    def finish_terrain_task(self, task, result):
+        """Upload the result of the current task on the GUI thread"""
+        if task is not self.terrain_task:
+            return
+        # loading_source stays set until the result is swapped in, so
+        # option changes during a streamed upload restart the load
+        self.terrain_task = None
+        self.apply_terrain_result(result, finished=True)
+            
+    def apply_terrain_result(self, result, finished=False):
+        """
+        Upload the mesh of a task result and swap it in with its terrain,
+        the camera is left where it is so refinements replace the terrain
+        in place. Large meshes are streamed and swapped in by paintGL.
+        
+        Args:
+            result (dict): Result of prepare_terrain or prepare_overview
+            finished (bool): Whether this is the final result of its task
+        """
+        mesh = result['mesh']
         try:
-            loader = TerrainLoader()
-            processor = TerrainProcessor()
+            self.makeCurrent()
+            try:
+                self.cancel_terrain_upload()
+                if mesh['kind'] != 'chunks' and self.mesh_upload_bytes(mesh) > self.upload_chunk_bytes:
+                    self.terrain_upload = self.start_terrain_upload(result, finished)
+                    self.update()
+                    return
+                self.upload_terrain_mesh(mesh)
+            finally:
+                self.doneCurrent()
+        except Exception as e:
+            self.fail_terrain_task(None, str(e))
+            return
             
-            # Load and store original data
-            self.original_terrain_data = loader.load(file_path, region)
+        self.swap_terrain_data(result, finished)
+        
+    def swap_terrain_data(self, result, finished):
+        """Make the terrain of a result current once its mesh is on the GPU"""
+        if 'terrain_data' in result:
+            self.terrain_source = result['source']
+            self.terrain_data = result['terrain_data']
+            self.terrain_stats = result['stats']
+            self.terrain_picker = None
             
-            # Process with current detail level
-            self.terrain_data = processor.process(self.original_terrain_data, self.detail_level)
+        self.update_main_window_statistics()
+        self.update()
+        if finished:
+            self.loading_source = None
+            self.load_finished.emit()
             
-            # Generate the mesh after loading new terrain data
-            self.generate_terrain_mesh()
+    def mesh_upload_bytes(self, mesh):
+        """Bytes a prepared mesh puts on the GPU"""
+        arrays = ('vertices', 'indices', 'strip_indices', 'heights')
+        return sum(mesh[name].nbytes for name in arrays if name in mesh)
+        
+    def start_terrain_upload(self, result, finished):
+        """
+        Create the buffers of a prepared mesh next to the current ones and
+        queue their data, the context must be current
+        
+        Returns:
+            dict: The pending upload, advanced by continue_terrain_upload
+        """
+        mesh = result['mesh']
+        upload = StreamingUpload(self.gpu, self.upload_chunk_bytes)
+        back_mesh = self.gpu.mesh()
+        pending = {
+            'result': result,
+            'finished': finished,
+            'upload': upload,
+            'mesh': back_mesh,
+            'texture': None,
+            'grid_indices': None
+        }
+        
+        if mesh['kind'] == 'adaptive':
+            vertices, indices = mesh['vertices'], mesh['indices']
+            back_mesh.set_vertex_buffer(upload.buffer(GL_ARRAY_BUFFER, vertices), len(vertices))
+            index_type = GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT
+            back_mesh.set_index_buffer(
+                upload.buffer(GL_ELEMENT_ARRAY_BUFFER, indices), len(indices),
+                index_type, GL_TRIANGLES, owned=True
+            )
+            return pending
             
-            # Update statistics in the main window
-            parent = self.parent()
-            while parent is not None:
-                if isinstance(parent, QMainWindow):
-                    parent.update_statistics(self.terrain_data)
-                    break
-                parent = parent.parent()
+        if self.grid_index_shape == mesh['shape']:
+            # Same grid, the current strip indices are shared
+            back_mesh.set_index_buffer(
+                self.grid_indices, self.grid_index_count, self.grid_index_type, GL_TRIANGLE_STRIP
+            )
+        else:
+            indices = mesh.get('strip_indices')
+            if indices is None:
+                indices = self.grid_strip_indices(*mesh['shape'])
+            index_type = GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT
+            index_buffer = upload.buffer(GL_ELEMENT_ARRAY_BUFFER, indices)
+            pending['grid_indices'] = (index_buffer, mesh['shape'], len(indices), index_type)
+            back_mesh.set_index_buffer(index_buffer, len(indices), index_type, GL_TRIANGLE_STRIP)
             
+        if 'heights' in mesh:
+            pending['texture'] = upload.texture_heights(mesh['heights'])
+        else:
+            back_mesh.set_vertex_buffer(upload.buffer(GL_ARRAY_BUFFER, mesh['vertices']), len(mesh['vertices']))
+        return pending
+        
+    def continue_terrain_upload(self):
+        """Stream the next chunk of the pending upload, swap it in once the GPU has it"""
+        pending = self.terrain_upload
+        upload = pending['upload']
+        try:
+            done = upload.step()
+        except Exception as e:
+            self.cancel_terrain_upload()
+            self.fail_terrain_task(None, str(e))
+            return
+            
+        if not done:
+            if pending['finished']:
+                percent = 95 + 5 * upload.uploaded_bytes // max(1, upload.total_bytes)
+                self.load_progress.emit("Uploading", min(percent, 99))
             self.update()
+            return
             
-        except Exception as e:
-            print(f"Error loading terrain: {str(e)}")
+        self.terrain_upload = None
+        self.swap_terrain_mesh(pending)
+        self.swap_terrain_data(pending['result'], pending['finished'])
+        
+    def swap_terrain_mesh(self, pending):
+        """Replace the drawn terrain with a finished upload and free the old buffers"""
+        self.release_terrain_chunks()
+        if self.terrain_mesh is not None:
+            self.terrain_mesh.delete()
+        self.terrain_mesh = pending['mesh']
+        
+        if pending['grid_indices'] is not None:
+            if self.grid_indices is not None:
+                self.grid_indices.delete()
+            (self.grid_indices, self.grid_index_shape,
+             self.grid_index_count, self.grid_index_type) = pending['grid_indices']
+             
+        self.release_height_texture()
+        self.height_texture = pending['texture']
+        self.terrain_textured = pending['texture'] is not None
+        self.terrain_scale = pending['result']['mesh']['scale']
+        
+    def cancel_terrain_upload(self):
+        """Drop the pending upload, the context must be current"""
+        if self.terrain_upload is None:
+            return
+        self.terrain_upload['upload'].cancel()
+        self.terrain_upload['mesh'].delete()
+        self.terrain_upload = None
+        
+    def fail_terrain_task(self, task, message):
+        """
+        End the current load with an error. task is None when uploading a
+        result failed on the GUI thread, which also stops the task if it is
+        still preparing the full terrain after an overview.
+        """
+        if task is not None and task is not self.terrain_task:
+            return
+        if self.terrain_task is not None:
+            self.terrain_task.cancel()
+            self.task_pool.clear()
+            self.terrain_task = None
+        self.loading_source = None
+        print(f"Error loading terrain: {message}")
+        self.load_failed.emit(message)
+        
+    def process_terrain(self, source, detail_level, progress):
+        """
+        Return cleaned terrain for a source and detail level
+        
+        Args:
+            source (tuple): (file_path, region)
+            detail_level (int): Detail level (1-100)
+            progress (callable): Called with (stage, percent)
+        """
+        file_path, region = source
+        loader = TerrainLoader()
+        
+        if self.pyramid_cache is not None:
+            # Cleaned levels come from the on-disk pyramid, built on first load,
+            # so detail changes never clean again and the processor caches nothing
+            return self.pyramid_cache.load(
+                file_path, region, detail_level, loader, self.processor, progress
+            )
             
+        # Without the pyramid, lower detail levels are resampled from the
+        # processor's cached cleaned data
+        source_key = (file_path, region, self.loaded_detail_level)
+        if (self.loaded_detail_level is not None and
+                detail_level <= self.loaded_detail_level and
+                self.processor.is_cached(source_key)):
+            progress("Resampling", 30)
+            relative_detail = detail_level * 100 / self.loaded_detail_level
+            return self.processor.process(None, relative_detail, source_key)
+            
+        # Load the original data, decimated to the detail level while reading
+        progress("Loading", 0)
+        original_terrain_data = loader.load(file_path, region, detail_level)
+        self.loaded_detail_level = detail_level
+        
+        # The loader already resampled, so only clean here
+        progress("Cleaning", 30)
+        source_key = (file_path, region, self.loaded_detail_level)
+        return self.processor.process(original_terrain_data, 100, source_key,
+                                      lambda: progress("Cleaning", 30))
+        
+    def update_main_window_statistics(self):
+        """Update statistics in the main window"""
+        parent = self.parent()
+        while parent is not None:
+            if isinstance(parent, QMainWindow):
+                parent.update_statistics(self.terrain_stats)
+                break
+            parent = parent.parent()
+            
+    def update_gpu_statistics(self):
+        """Report the GPU memory in use to the main window"""
+        self.reported_gpu_bytes = self.gpu.total_bytes
+        parent = self.parent()
+        while parent is not None:
+            if isinstance(parent, QMainWindow):
+                parent.update_gpu_memory(self.reported_gpu_bytes)
+                break
+            parent = parent.parent()
+            
+    def set_max_vertical_error(self, max_error):
+        """Re-mesh with a new maximum vertical error in metres, 0 for the uniform grid"""
+        self.max_vertical_error = max_error
+        self.remesh_terrain()
+        
+    def set_chunked_lod(self, enabled):
+        """Switch between the chunked quadtree LOD and a single terrain mesh"""
+        self.chunked_lod = enabled
+        self.remesh_terrain()
+        
     def set_render_scheme(self, scheme):
         self.render_scheme = scheme
         self.update()
@@ -290,6 +893,8 @@ class TerrainRenderer(QOpenGLWidget):
 
     def mouseMoveEvent(self, event):
         if not (self.left_mouse_pressed or self.right_mouse_pressed):
+            if self.show_elevation:
+                self.show_elevation_tooltip(event)
             return
         
         current_pos = event.position()
@@ -308,53 +913,136 @@ class TerrainRenderer(QOpenGLWidget):
         self.camera.process_mouse_scroll(event.angleDelta().y())
         self.update()
 
+    def camera_ray(self, x, y):
+        """
+        World ray through a widget position
+
+        Returns:
+            tuple: (origin, direction) numpy arrays, origin on the near plane
+        """
+        # QMatrix4x4.data() is column-major
+        projection = np.array(self.camera.get_projection_matrix(), dtype=np.float64).reshape(4, 4).T
+        view = np.array(self.camera.get_view_matrix(), dtype=np.float64).reshape(4, 4).T
+        inverse = np.linalg.inv(projection @ view)
+        
+        ndc_x = 2.0 * x / self.width() - 1.0
+        ndc_y = 1.0 - 2.0 * y / self.height()
+        near = inverse @ np.array([ndc_x, ndc_y, -1.0, 1.0])
+        far = inverse @ np.array([ndc_x, ndc_y, 1.0, 1.0])
+        near = near[:3] / near[3]
+        far = far[:3] / far[3]
+        return near, far - near
+        
+    def get_terrain_picker(self):
+        """Picker of the current terrain, built on first use"""
+        if self.terrain_picker is None and self.terrain_data is not None:
+            scale_x, height_scale, scale_z = self.terrain_scale
+            self.terrain_picker = TerrainPicker(self.terrain_data, scale_x, scale_z, height_scale)
+        return self.terrain_picker
+        
     def screen_to_world(self, x, y):
         """Convert screen coordinates to world coordinates on terrain"""
         if self.terrain_data is None:
             return None
             
-        # Get normalized device coordinates
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        winX = float(x)
-        winY = float(viewport[3] - y)
-        winZ = glReadPixels(int(x), int(winY), 1, 1, GL_DEPTH_COMPONENT, GL_FLOAT)[0][0]
-        
-        # Unproject point
-        model = np.identity(4, dtype=np.float64)
-        projection = np.array(self.camera.get_projection_matrix(), dtype=np.float64).reshape(4, 4)
-        view = np.array(self.camera.get_view_matrix(), dtype=np.float64).reshape(4, 4)
-        
-        # Combine matrices for unprojection
-        modelview = np.dot(view, model)
-        
-        try:
-            world_pos = gluUnProject(
-                winX, winY, winZ,
-                modelview.flatten(),
-                projection.flatten(),
-                viewport
-            )
-            return QVector3D(*world_pos)
-        except Exception as e:
-            print(f"Error in screen_to_world: {str(e)}")
+        # Ray cast on the CPU, no depth buffer read back or GPU sync
+        origin, direction = self.camera_ray(x, y)
+        hit = self.get_terrain_picker().pick(origin, direction)
+        if hit is None:
             return None
+        return QVector3D(*hit)
+        
+    def show_elevation_tooltip(self, event):
+        """Show the elevation of the terrain under the cursor"""
+        position = event.position()
+        point = self.screen_to_world(position.x(), position.y())
+        if point is None:
+            QToolTip.hideText()
+            return
+            
+        elevation = point.y() / self.terrain_scale[1]
+        QToolTip.showText(event.globalPosition().toPoint(), f"Elevation: {elevation:.1f} m", self)
 
     def create_dam(self, dam_points, flood_point):
         """Create a dam from the given points and flood direction"""
         if self.terrain_data is None:
             return
             
-        self.dam_builder.create_dam(
-            self.terrain_data,
-            dam_points,
-            flood_point,
-            self.terrain_data.shape
+        self.cancel_flood_task()
+        self.makeCurrent()
+        try:
+            self.dam_builder.create_dam(
+                self.terrain_data,
+                dam_points,
+                flood_point,
+                self.terrain_data.shape
+            )
+        finally:
+            self.doneCurrent()
+        self.start_flood_task()
+        self.update()
+        
+    def start_flood_task(self):
+        """Order the reservoir behind the current dam on the flood worker"""
+        builder = self.dam_builder
+        if builder.flood_source is None:
+            return
+        dam_start, dam_end, seed = builder.flood_source
+        task = TerrainTask(
+            self.prepare_flood_levels, builder.flood_engine,
+            dam_start, dam_end, seed, builder.max_water_height
         )
+        task.signals.finished.connect(
+            lambda result, task=task: self.finish_flood_task(task, result))
+        task.signals.failed.connect(
+            lambda message, task=task: self.fail_flood_task(task, message))
+        self.flood_task = task
+        threading.Thread(target=task.run, daemon=True).start()
+        
+    def cancel_flood_task(self):
+        """Stop ordering the reservoir, its result is discarded"""
+        if self.flood_task is None:
+            return
+        self.flood_task.cancel()
+        self.flood_task = None
+        
+    def prepare_flood_levels(self, task, engine, dam_start, dam_end, seed, max_height):
+        """Compute the flooding order of a reservoir, runs on the flood worker"""
+        return engine.spill_order(dam_start, dam_end, seed, max_height, task.report)
+        
+    def finish_flood_task(self, task, spill_order):
+        if task is not self.flood_task:
+            return
+        self.flood_task = None
+        self.makeCurrent()
+        try:
+            self.dam_builder.set_spill_order(spill_order)
+        finally:
+            self.doneCurrent()
+        self.update()
+        self.flood_levels_ready.emit()
+        
+    def fail_flood_task(self, task, message):
+        if task is not self.flood_task:
+            return
+        self.flood_task = None
+        print(f"Error ordering flood levels: {message}")
+        
+    def set_water_level(self, water_height):
+        """Raise or lower the water behind the dam"""
+        self.makeCurrent()
+        try:
+            self.dam_builder.set_water_level(water_height)
+        finally:
+            self.doneCurrent()
         self.update()
 
     def clear_dam(self):
         """Clear the dam"""
+        self.cancel_flood_task()
+        self.makeCurrent()
         self.dam_builder.clear()
+        self.doneCurrent()
         
         # Update statistics in main window
         parent = self.parent()
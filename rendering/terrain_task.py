@@ -0,0 +1,62 @@
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+import threading
+
+class TaskCancelled(Exception):
+    """Raised inside a task at its next progress report once it is cancelled"""
+
+class TaskSignals(QObject):
+    # Emitted from the worker thread, delivered on the GUI thread
+    progress = pyqtSignal(str, int)  # stage, percent
+    partial = pyqtSignal(object)  # intermediate result, see TerrainTask.publish
+    finished = pyqtSignal(object)  # result of the task function
+    failed = pyqtSignal(str)  # error message
+
+class TerrainTask(QRunnable):
+    def __init__(self, function, *args, **kwargs):
+        """
+        Run function(task, *args, **kwargs) on a thread pool
+
+        The function reports progress through task.report, which also raises
+        TaskCancelled once cancel() was called, so cancellation takes effect
+        between stages. A cancelled task emits neither finished nor failed.
+        """
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def report(self, stage, percent):
+        """Emit progress, raises TaskCancelled if the task was cancelled"""
+        self.check_cancelled()
+        self.signals.progress.emit(stage, int(percent))
+
+    def publish(self, result):
+        """Emit an intermediate result while the task keeps running"""
+        self.check_cancelled()
+        self.signals.partial.emit(result)
+
+    def run(self):
+        try:
+            self.check_cancelled()
+            result = self.function(self, *self.args, **self.kwargs)
+        except TaskCancelled:
+            return
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(str(e))
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(result)
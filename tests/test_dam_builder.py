@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt6.QtGui")
+pytest.importorskip("OpenGL.GL")
+
+from rendering.dam_builder import DamBuilder
+
+class FakeMesh:
+    def set_vertices(self, vertices):
+        self.vertices = vertices
+
+    def set_indices(self, indices, mode):
+        self.indices = indices
+
+    def delete(self):
+        pass
+
+class FakeResources:
+    def mesh(self):
+        return FakeMesh()
+
+def basin_terrain():
+    """A bowl around (20, 30) with a spike on the dam line along row 40"""
+    rows, cols = np.mgrid[0:60, 0:60]
+    terrain = np.hypot(rows - 20, cols - 30).astype(np.float32) * 10 + 100
+    terrain[40, 5] = 2000
+    return terrain
+
+def test_water_level_drains_from_sampled_dam_top():
+    terrain = basin_terrain()
+    builder = DamBuilder(FakeResources())
+    # The dam top sampled by create_dam misses the spike on the line
+    builder.dam_height = 500.0
+    builder.calculate_flood_area(terrain, [(0.0, 40.5 / 60), (59.5 / 60, 40.5 / 60)],
+                                 (30.5 / 60, 20.5 / 60), terrain.shape)
+    assert builder.flood.water_height <= builder.max_water_height
+
+    engine = builder.flood_engine
+    dam_start, dam_end, seed = builder.flood_source
+    builder.set_spill_order(engine.spill_order(dam_start, dam_end, seed, builder.max_water_height))
+    assert builder.flood.mask.sum() == builder.flood_count
+
+    low, high = builder.water_level_range()
+    for water_height in (high, (low + high) / 2, low + 1):
+        builder.set_water_level(water_height)
+        expected = engine.flood(dam_start, dam_end, seed, water_height).mask
+        assert builder.flood.mask.sum() == builder.flood_count
+        assert np.array_equal(builder.flood.mask, expected)
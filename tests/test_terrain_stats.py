@@ -0,0 +1,18 @@
+import numpy as np
+
+from utils.terrain_stats import TerrainStats
+
+def test_percentiles_with_flat_first_block():
+    # A sea-level border fills the first blocks, the rest is a ramp
+    terrain = np.tile(np.linspace(0, 10000, 4000)[:, None], (1, 500))
+    terrain[:300] = 0.0
+    terrain[1000, :10] = np.nan
+
+    stats = TerrainStats.compute(terrain, block_size=50000)
+
+    bin_width = (stats.max - stats.min) / 1024
+    for p, value in stats.percentiles.items():
+        assert abs(value - np.nanpercentile(terrain, p)) <= bin_width
+    assert np.allclose(np.diff(stats.bin_edges), bin_width)
+    assert stats.histogram.sum() == stats.valid_count
+    assert stats.nodata_count == 10
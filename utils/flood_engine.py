@@ -0,0 +1,295 @@
+import numpy as np
+from scipy import ndimage, sparse
+from scipy.sparse import csgraph
+
+# Water spreads to the 4 direct neighbours, so an 8-connected dam line is
+# enough to hold it back
+FLOOD_STRUCTURE = ndimage.generate_binary_structure(2, 1)
+
+def grid_cell(point, shape):
+    """Convert a normalized (x, y) point to a clamped (row, col) cell"""
+    rows, cols = shape
+    row = min(max(int(point[1] * rows), 0), rows - 1)
+    col = min(max(int(point[0] * cols), 0), cols - 1)
+    return row, col
+
+def line_cells(start, end):
+    """
+    Rows and columns of the 8-connected cells on a line between two cells
+
+    Args:
+        start (tuple): (row, col) of the first end
+        end (tuple): (row, col) of the second end
+
+    Returns:
+        tuple: (rows, cols) index arrays, one entry per step of the longer axis
+    """
+    steps = max(abs(end[0] - start[0]), abs(end[1] - start[1])) + 1
+    rows = np.rint(np.linspace(start[0], end[0], steps)).astype(np.intp)
+    cols = np.rint(np.linspace(start[1], end[1], steps)).astype(np.intp)
+    return rows, cols
+
+def side_mask(shape, start, end, seed):
+    """
+    Cells strictly on the same side of the line through start and end as seed
+
+    The sign of the cross product is compared per row against a column
+    threshold, so only 1D integer arrays are built before the boolean result.
+    Cells on the line, and every cell if seed is on it, are excluded.
+    """
+    rows, cols = shape
+    dir_row, dir_col = end[0] - start[0], end[1] - start[1]
+    side = dir_col * (seed[0] - start[0]) - dir_row * (seed[1] - start[1])
+    if side == 0:
+        return np.zeros(shape, dtype=bool)
+
+    # cross = row_term - col_term for a cell at (row, col)
+    row_term = dir_col * (np.arange(rows, dtype=np.int64) - start[0])
+    col_term = dir_row * (np.arange(cols, dtype=np.int64) - start[1])
+    if side > 0:
+        return row_term[:, None] > col_term[None, :]
+    return row_term[:, None] < col_term[None, :]
+
+class FloodResult:
+    def __init__(self, mask, water_height, area, volume):
+        """
+        Args:
+            mask (numpy.ndarray): Boolean grid of flooded cells
+            water_height (float): Water surface height
+            area (float): Flooded area, in cell_area units
+            volume (float): Water volume, area times height units
+        """
+        self.mask = mask
+        self.water_height = water_height
+        self.area = area
+        self.volume = volume
+
+class SpillOrder:
+    def __init__(self, shape, cells, spill_heights, terrain_heights, cell_area=1.0, bounds=None):
+        """
+        Cells of a reservoir in the order they flood as the water rises
+
+        A cell's spill height is the lowest water level at which it joins the
+        seed, the highest terrain on the best path between them. The water at
+        a level covers exactly the cells whose spill height is below it, a
+        prefix of the order, so queries and updates between levels cost the
+        number of cells that change.
+
+        Args:
+            shape (tuple): (rows, cols) of the terrain
+            cells (numpy.ndarray): Flat cell indices sorted by spill height
+            spill_heights (numpy.ndarray): Sorted spill heights of the cells
+            terrain_heights (numpy.ndarray): Terrain heights of the cells
+            cell_area (float): Ground area of one cell
+            bounds (tuple): (top, bottom, left, right) box around the cells,
+                ends exclusive, the whole grid when None
+        """
+        self.shape = tuple(shape)
+        self.bounds = bounds if bounds is not None else (0, shape[0], 0, shape[1])
+        self.cells = cells
+        self.spill_heights = spill_heights
+        self.cell_area = cell_area
+        # Running terrain height sums give the volume at any level
+        self.height_sums = np.concatenate([[0.0], np.cumsum(terrain_heights, dtype=np.float64)])
+
+    def count(self, water_height):
+        """Number of cells under water at water_height"""
+        return int(np.searchsorted(self.spill_heights, water_height, side='left'))
+
+    def update_mask(self, mask, old_count, new_count):
+        """Flood or drain the cells between two counts of a mask in place"""
+        low, high = sorted((old_count, new_count))
+        mask.ravel()[self.cells[low:high]] = new_count > old_count
+
+    def flood(self, water_height, mask=None, old_count=0):
+        """
+        Flood the reservoir to water_height
+
+        Args:
+            water_height (float): Water surface height
+            mask (numpy.ndarray): Mask of a previous result to update in
+                place, a new one is made when None
+            old_count (int): Cells flooded in that mask
+
+        Returns:
+            FloodResult: The flooded cells with their area and volume
+        """
+        count = self.count(water_height)
+        if mask is None:
+            mask = np.zeros(self.shape, dtype=bool)
+            old_count = 0
+        self.update_mask(mask, old_count, count)
+        volume = water_height * count - self.height_sums[count]
+        return FloodResult(mask, water_height, count * self.cell_area, float(volume * self.cell_area))
+
+class FloodEngine:
+    def __init__(self, terrain_data, cell_area=1.0):
+        """
+        Flood fill of the terrain basin held back by a dam line
+
+        Args:
+            terrain_data (numpy.ndarray): Height grid, NaN cells never flood
+            cell_area (float): Ground area of one cell, 1 gives areas in cells
+        """
+        self.terrain_data = terrain_data
+        self.cell_area = cell_area
+
+    def dam_height(self, start, end):
+        """Highest terrain along the dam line between two cells"""
+        rows, cols = line_cells(start, end)
+        return float(np.nanmax(self.terrain_data[rows, cols]))
+
+    def flood(self, start, end, seed, water_height):
+        """
+        Find the cells below water_height connected to seed behind the dam
+
+        Candidate cells are below the water and on the seed's side of the dam
+        line, with the line itself blocked. The basin is the 4-connected
+        component of the candidates that contains the seed.
+
+        Args:
+            start (tuple): (row, col) of the first dam end
+            end (tuple): (row, col) of the second dam end
+            seed (tuple): (row, col) of a cell inside the reservoir
+            water_height (float): Water surface height
+
+        Returns:
+            FloodResult: The flooded cells with their area and volume
+        """
+        shape = self.terrain_data.shape
+        candidates = side_mask(shape, start, end, seed)
+        candidates &= self.terrain_data < water_height
+        candidates[line_cells(start, end)] = False
+
+        if not candidates[seed]:
+            return FloodResult(np.zeros(shape, dtype=bool), water_height, 0.0, 0.0)
+
+        labels, _ = ndimage.label(candidates, structure=FLOOD_STRUCTURE)
+        mask = labels == labels[seed]
+        depth = water_height - np.asarray(self.terrain_data[mask], dtype=np.float64)
+
+        return FloodResult(
+            mask,
+            water_height,
+            float(depth.size * self.cell_area),
+            float(depth.sum() * self.cell_area)
+        )
+
+    def spill_order(self, start, end, seed, max_height, progress=None):
+        """
+        Order the cells behind the dam by the water level that floods them
+
+        The reservoir at max_height bounds the search. Within it, spill
+        heights are maximum terrain heights along the minimum spanning tree
+        of the cell grid, weighted by the higher cell of each edge, which
+        holds the best path from the seed to every cell. They are found by
+        pointer jumping up the tree from the seed, in log(depth) passes.
+
+        Args:
+            start (tuple): (row, col) of the first dam end
+            end (tuple): (row, col) of the second dam end
+            seed (tuple): (row, col) of a cell inside the reservoir
+            max_height (float): Highest water level that will be asked for
+            progress (callable): Called with (stage, percent), may raise to
+                abandon the computation
+
+        Returns:
+            SpillOrder: Flooding order of the reservoir at max_height
+        """
+        if progress is None:
+            progress = lambda stage, percent: None
+        shape = self.terrain_data.shape
+        progress("Flooding", 0)
+        region = self.flood(start, end, seed, max_height).mask
+        if not region[seed]:
+            empty = np.zeros(0, dtype=np.intp)
+            return SpillOrder(shape, empty, np.zeros(0), np.zeros(0), self.cell_area, (0, 0, 0, 0))
+
+        # Number the reservoir cells inside its bounding box
+        occupied_rows = np.flatnonzero(region.any(axis=1))
+        top, bottom = occupied_rows[0], occupied_rows[-1] + 1
+        occupied_cols = np.flatnonzero(region[top:bottom].any(axis=0))
+        left, right = occupied_cols[0], occupied_cols[-1] + 1
+        region = region[top:bottom, left:right]
+        count = int(np.count_nonzero(region))
+        index = np.full(region.shape, -1, dtype=np.int32)
+        index[region] = np.arange(count, dtype=np.int32)
+        heights = np.asarray(self.terrain_data[top:bottom, left:right][region], dtype=np.float64)
+
+        progress("Building spanning tree", 20)
+        pairs = []
+        for first, second in ((index[:, :-1], index[:, 1:]), (index[:-1], index[1:])):
+            linked = (first >= 0) & (second >= 0)
+            pairs.append((first[linked], second[linked]))
+        first = np.concatenate([pair[0] for pair in pairs])
+        second = np.concatenate([pair[1] for pair in pairs])
+        # Offset so no weight is zero, csgraph drops zero weight edges
+        weights = np.maximum(heights[first], heights[second]) - heights.min() + 1.0
+        graph = sparse.csr_matrix((weights, (first, second)), shape=(count, count))
+        tree = csgraph.minimum_spanning_tree(graph)
+        del graph, weights, first, second, pairs
+
+        progress("Ordering cells", 60)
+        root = int(index[seed[0] - top, seed[1] - left])
+        _, parents = csgraph.breadth_first_order(tree, root, directed=False)
+        parents = parents.astype(np.int32)
+        parents[root] = root
+        spill = heights.copy()
+        while True:
+            progress("Ordering cells", 60)
+            np.maximum(spill, spill[parents], out=spill)
+            grandparents = parents[parents]
+            if np.array_equal(grandparents, parents):
+                break
+            parents = grandparents
+
+        progress("Ordering cells", 90)
+        order = np.argsort(spill, kind='stable')
+        local_rows, local_cols = np.divmod(np.flatnonzero(region)[order], region.shape[1])
+        cells = (local_rows + top) * shape[1] + (local_cols + left)
+        return SpillOrder(shape, cells, spill[order], heights[order], self.cell_area,
+                          (top, bottom, left, right))
+
+def mask_rectangles(mask):
+    """
+    Cover the True cells of a mask with disjoint rectangles
+
+    Each row is split into runs, and runs with the same columns in
+    consecutive rows are merged into one rectangle. Only the bounding box of
+    the mask is scanned, and the merge is a sort of the runs, so the cost
+    follows the run count rather than the cell count.
+
+    Args:
+        mask (numpy.ndarray): Boolean grid
+
+    Returns:
+        tuple: (row0, row1, col0, col1) int arrays, ends exclusive
+    """
+    occupied_rows = np.flatnonzero(mask.any(axis=1))
+    if occupied_rows.size == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, empty, empty
+    top, bottom = occupied_rows[0], occupied_rows[-1] + 1
+    occupied_cols = np.flatnonzero(mask[top:bottom].any(axis=0))
+    left, right = occupied_cols[0], occupied_cols[-1] + 1
+
+    # Rows of the bounding box, each ended by a False so runs stop there
+    width = right - left + 1
+    padded = np.zeros((bottom - top) * width + 1, dtype=bool)
+    padded[1:].reshape(-1, width)[:, :-1] = mask[top:bottom, left:right]
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    starts, ends = changes[0::2], changes[1::2]
+    run_rows = starts // width + top
+    run_starts = starts % width + left
+    run_ends = ends % width + left
+
+    # Runs sorted by columns then row, a rectangle ends where they change
+    order = np.lexsort((run_rows, run_ends, run_starts))
+    run_rows, run_starts, run_ends = run_rows[order], run_starts[order], run_ends[order]
+    first = np.ones(run_rows.size, dtype=bool)
+    first[1:] = ((run_starts[1:] != run_starts[:-1]) |
+                 (run_ends[1:] != run_ends[:-1]) |
+                 (run_rows[1:] != run_rows[:-1] + 1))
+    last = np.append(first[1:], True)
+
+    return run_rows[first], run_rows[last] + 1, run_starts[first], run_ends[first]
@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from scipy.ndimage import zoom
+from .terrain_processor import target_shape
+
+# Bump when the cleaning, downsampling or layout changes so old pyramids are rebuilt
+CACHE_VERSION = 2
+
+TERRAIN_EXTENSIONS = ('.tif', '.tiff', '.asc', '.hgt')
+
+def default_cache_dir():
+    """Return the pyramid cache directory, overridable with TERRAINVIZ_CACHE_DIR"""
+    return os.environ.get(
+        'TERRAINVIZ_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'terrainviz', 'pyramids')
+    )
+
+def downsample(data):
+    """Halve both dimensions by averaging 2x2 blocks (odd edges are replicated)"""
+    rows, cols = data.shape
+    if rows % 2 or cols % 2:
+        data = np.pad(data, ((0, rows % 2), (0, cols % 2)), mode='edge')
+    blocks = data.reshape(data.shape[0] // 2, 2, data.shape[1] // 2, 2)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+class PyramidCache:
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024**3, min_level_size=64):
+        """
+        On-disk cache of cleaned, power-of-two downsampled terrain levels
+
+        A pyramid starts at the detail level it was first loaded at, read
+        decimated from the source, so opening a huge file at low detail never
+        reads or cleans it at full resolution. Asking for a higher detail later
+        rebuilds the pyramid from that detail down.
+
+        Args:
+            cache_dir (str): Directory holding the pyramids
+            max_bytes (int): Size cap, least recently used pyramids are evicted
+            min_level_size (int): Stop adding levels once a side gets this small
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.min_level_size = min_level_size
+
+    def key(self, file_path, region=None):
+        """Cache key from the file path, mtime, size and region"""
+        stat = os.stat(file_path)
+        parts = [
+            os.path.abspath(file_path),
+            str(stat.st_mtime_ns),
+            str(stat.st_size),
+            repr(tuple(region) if region is not None else None),
+            str(CACHE_VERSION)
+        ]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def load(self, file_path, region=None, detail_level=100, loader=None, processor=None, progress=None):
+        """
+        Return cleaned terrain at a detail level, building the pyramid on a miss
+
+        Args:
+            file_path (str): Path to the terrain file
+            region (tuple): Optional (x_min, y_min, width, height) for cropping
+            detail_level (int): Detail level (1-100)
+            loader (TerrainLoader): Used to read the source on a miss
+            processor (TerrainProcessor): Used to clean the source on a miss
+            progress (callable): Called with (stage, percent) as a build goes
+                on, may raise to abandon the build
+
+        Returns:
+            numpy.ndarray: The cleaned terrain, memory-mapped at full detail
+        """
+        entry = self._open(self.key(file_path, region))
+        if entry is None or entry['detail_level'] < detail_level:
+            entry = self.build(file_path, region, loader, processor, progress, detail_level)
+        if progress is not None:
+            progress("Resampling", 60)
+        return self._select_level(entry, detail_level)
+
+    def contains(self, file_path, region=None, detail_level=100):
+        """Whether a cached pyramid for a file covers the detail level"""
+        meta = self._read_meta(os.path.join(self.cache_dir, self.key(file_path, region)))
+        return meta is not None and meta['detail_level'] >= detail_level
+
+    def build(self, file_path, region=None, loader=None, processor=None, progress=None, detail_level=100):
+        """
+        Read, clean and write the pyramid for a file, return its entry
+
+        The source is read decimated to detail_level, which becomes the finest
+        level, so only the levels at or below that detail are built.
+        """
+        if progress is None:
+            progress = lambda stage, percent: None
+        # Imported here so the cache can be used without pulling in GDAL
+        if loader is None:
+            from .terrain_loader import TerrainLoader
+            loader = TerrainLoader()
+        if processor is None:
+            from .terrain_processor import TerrainProcessor
+            processor = TerrainProcessor(low_memory=True, tiled=True)
+
+        key = self.key(file_path, region)
+        progress("Loading", 0)
+        full_shape = loader.shape(file_path, region)
+        data = loader.load(file_path, region, detail_level)
+        progress("Cleaning", 20)
+        data = processor.clean_terrain(data, lambda: progress("Cleaning", 20)).astype(np.float32, copy=False)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Write each level, deriving the next one from the previous level
+        shapes = []
+        level = data
+        try:
+            while True:
+                progress("Building levels", min(40 + 5 * len(shapes), 55))
+                np.save(os.path.join(tmp_dir, f"level_{len(shapes)}.npy"), level)
+                shapes.append(level.shape)
+                if min(level.shape) < 2 * self.min_level_size:
+                    break
+                level = downsample(level)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        del data, level
+
+        meta = {
+            'source': os.path.abspath(file_path),
+            'region': list(region) if region is not None else None,
+            'full_shape': list(full_shape),
+            'detail_level': detail_level,
+            'shapes': [list(shape) for shape in shapes]
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            # A coarser pyramid of the same file is replaced
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+            meta['path'] = entry_dir
+            entry = meta
+        except OSError:
+            # Another process finished the same pyramid first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            entry = self._open(key)
+        if entry is None:
+            raise RuntimeError(f"Could not cache the pyramid of {file_path}")
+
+        self.evict(keep=entry['path'])
+        return entry
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used pyramids until the cache fits max_bytes
+
+        Args:
+            keep (str): Entry directory that is never removed, such as the
+                pyramid that was just built
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, 'meta.json')
+            if name.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+                last_access = os.path.getmtime(self._access_path(entry_dir, meta_path))
+            except OSError:
+                continue
+            total += size
+            if entry_dir != keep:
+                entries.append((last_access, size, entry_dir))
+
+        # Always keep the most recently used pyramid
+        entries.sort()
+        for last_access, size, entry_dir in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every cached pyramid"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _open(self, key):
+        """Return the metadata of a cached pyramid and mark it as used"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta = self._read_meta(entry_dir)
+        if meta is None:
+            return None
+
+        # Use is recorded in the mtime of an empty file, meta.json stays untouched
+        try:
+            with open(os.path.join(entry_dir, 'access'), 'a'):
+                pass
+            os.utime(os.path.join(entry_dir, 'access'))
+        except OSError:
+            pass
+        meta['path'] = entry_dir
+        return meta
+
+    def _read_meta(self, entry_dir):
+        """Return the parsed meta.json of a pyramid, None if it is missing"""
+        try:
+            with open(os.path.join(entry_dir, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _access_path(self, entry_dir, meta_path):
+        """File whose mtime is the last use of a pyramid"""
+        access_path = os.path.join(entry_dir, 'access')
+        return access_path if os.path.isfile(access_path) else meta_path
+
+    def _select_level(self, entry, detail_level):
+        """Map the smallest level that covers the detail level and fit it exactly"""
+        shapes = [tuple(shape) for shape in entry['shapes']]
+        target = target_shape(tuple(entry['full_shape']), min(detail_level, entry['detail_level']))
+
+        index = 0
+        for i, shape in enumerate(shapes):
+            if shape[0] >= target[0] and shape[1] >= target[1]:
+                index = i
+
+        level = np.load(os.path.join(entry['path'], f"level_{index}.npy"), mmap_mode='r')
+        if level.shape == target:
+            return level
+
+        # At most a factor of two away, so this stays cheap
+        return zoom(level, (target[0] / level.shape[0], target[1] / level.shape[1]), order=1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-build terrain pyramids for a directory of files")
+    parser.add_argument('directory', help="Directory containing .tif, .asc or .hgt files")
+    parser.add_argument('--cache-dir', default=None, help="Pyramid cache directory")
+    parser.add_argument('--max-size-mb', type=int, default=2048, help="Cache size cap in MB")
+    parser.add_argument('--recursive', action='store_true', help="Also scan subdirectories")
+    args = parser.parse_args(argv)
+
+    cache = PyramidCache(args.cache_dir, max_bytes=args.max_size_mb * 1024**2)
+
+    for root, dirs, files in os.walk(args.directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in TERRAIN_EXTENSIONS:
+                continue
+            file_path = os.path.join(root, name)
+            if cache._open(cache.key(file_path)) is not None:
+                print(f"Cached: {file_path}")
+                continue
+            try:
+                start = time.time()
+                entry = cache.build(file_path)
+                print(f"Built: {file_path} ({len(entry['shapes'])} levels, {time.time() - start:.1f}s)")
+            except Exception as e:
+                print(f"Error building pyramid for {file_path}: {str(e)}")
+        if not args.recursive:
+            break
+
+if __name__ == "__main__":
+    main()
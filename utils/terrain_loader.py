@@ -1,32 +1,100 @@
-from osgeo import gdal
+from osgeo import gdal, gdal_array
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import os
+import threading
+from .terrain_processor import target_shape
+from .terrain_mosaic import shared_mosaic
 
 class TerrainLoader:
-    def load(self, file_path, region=None):
+    def __init__(self, use_mmap=True, resample_alg=gdal.GRIORA_Bilinear,
+                 num_workers=None, min_window_pixels=1 << 20,
+                 asc_sidecar=False, asc_chunk_size=64 * 1024**2):
+        """
+        Args:
+            use_mmap (bool): Map .hgt tiles from disk and only read the
+                requested window instead of loading the whole tile
+            resample_alg (int): GDAL resampling algorithm used for
+                reduced detail reads
+            num_workers (int): Threads used to decode raster blocks and
+                mosaic tiles, defaults to the number of CPUs
+            min_window_pixels (int): Smallest amount of source pixels read
+                by one thread, smaller rasters are read in a single call
+            asc_sidecar (bool): Write a binary .npy next to .asc files so
+                later loads memory-map it instead of parsing text
+            asc_chunk_size (int): Bytes of .asc text parsed at a time
+        """
+        self.use_mmap = use_mmap
+        self.resample_alg = resample_alg
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.min_window_pixels = min_window_pixels
+        self.asc_sidecar = asc_sidecar
+        self.asc_chunk_size = asc_chunk_size
+
+    def load(self, file_path, region=None, detail_level=100):
         """
         Load terrain data from a file
         
         Args:
-            file_path (str): Path to the terrain file (.tif, .asc, or .hgt)
+            file_path (str): Path to the terrain file (.tif, .asc, or .hgt),
+                or a directory of tiles that is read as one mosaic
             region (tuple): Optional (x_min, y_min, width, height) for cropping
+            detail_level (int): Detail level (1-100), below 100 the data is
+                decimated while reading so the full raster is never loaded
             
         Returns:
             numpy.ndarray: The terrain height data
         """
         try:
+            if os.path.isdir(file_path):
+                mosaic = shared_mosaic(file_path, num_workers=self.num_workers)
+                return mosaic.read(region, detail_level)
+                
             file_ext = os.path.splitext(file_path)[1].lower()
             
             if file_ext == '.hgt':
-                return self._load_hgt(file_path, region)
+                return self._load_hgt(file_path, region, detail_level)
+            elif file_ext == '.asc':
+                return self._load_asc(file_path, region, detail_level)
             else:
-                return self._load_gdal(file_path, region)
+                return self._load_gdal(file_path, region, detail_level)
                 
         except Exception as e:
             raise Exception(f"Error loading terrain: {str(e)}")
             
-    def _load_gdal(self, file_path, region=None):
-        """Load terrain using GDAL (for .tif and .asc files)"""
+    def shape(self, file_path, region=None):
+        """
+        Full resolution (height, width) of a terrain without reading its data
+        
+        Args:
+            file_path (str): Path to the terrain file or tile directory
+            region (tuple): Optional (x_min, y_min, width, height) for cropping
+            
+        Returns:
+            tuple: (height, width)
+        """
+        if region is not None:
+            return region[3], region[2]
+            
+        if os.path.isdir(file_path):
+            return shared_mosaic(file_path, num_workers=self.num_workers).shape
+            
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext == '.hgt':
+            size = int(round((os.path.getsize(file_path) / 2) ** 0.5))
+            return size, size
+        if file_ext == '.asc':
+            with open(file_path, 'rb') as f:
+                header = self._read_asc_header(f)
+            return header['nrows'], header['ncols']
+            
+        dataset = gdal.Open(file_path)
+        if dataset is None:
+            raise ValueError("Could not open terrain file")
+        return dataset.RasterYSize, dataset.RasterXSize
+        
+    def _load_gdal(self, file_path, region=None, detail_level=100):
+        """Load terrain using GDAL (for .tif and other raster formats)"""
         dataset = gdal.Open(file_path)
         if dataset is None:
             raise ValueError("Could not open terrain file")
@@ -35,42 +103,357 @@ class TerrainLoader:
         
         if region is not None:
             x_min, y_min, width, height = region
+        else:
+            x_min, y_min = 0, 0
+            width, height = dataset.RasterXSize, dataset.RasterYSize
+            
+        # Let GDAL resample into a buffer of the target size, it reads from
+        # the internal overviews when the file has them
+        buf_height, buf_width = target_shape((height, width), detail_level)
+        windows = self._block_windows(band, x_min, y_min, width, height, buf_width, buf_height)
+        
+        if self.num_workers <= 1 or len(windows) <= 1:
             data = band.ReadAsArray(
                 xoff=x_min,
                 yoff=y_min,
                 win_xsize=width,
-                win_ysize=height
+                win_ysize=height,
+                buf_xsize=buf_width,
+                buf_ysize=buf_height,
+                resample_alg=self.resample_alg
             )
-        else:
-            data = band.ReadAsArray()
+            return data
+            
+        # Decode block-aligned windows in parallel straight into one array.
+        # GDAL handles are not thread safe, so every thread opens its own.
+        data = np.empty((buf_height, buf_width),
+                        dtype=gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+        local = threading.local()
+        
+        def read_window(window):
+            xoff, yoff, xsize, ysize, row0, row1, col0, col1 = window
+            if not hasattr(local, 'band'):
+                local.dataset = gdal.Open(file_path)
+                local.band = local.dataset.GetRasterBand(1)
+            local.band.ReadAsArray(
+                xoff=xoff,
+                yoff=yoff,
+                win_xsize=xsize,
+                win_ysize=ysize,
+                buf_xsize=col1 - col0,
+                buf_ysize=row1 - row0,
+                buf_obj=data[row0:row1, col0:col1],
+                resample_alg=self.resample_alg
+            )
+            
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            # list() so exceptions from the workers are raised here
+            list(pool.map(read_window, windows))
             
         return data
         
-    def _load_hgt(self, file_path, region=None):
+    def _block_windows(self, band, x_min, y_min, width, height, buf_width, buf_height):
+        """
+        Split a read into windows that follow the raster's internal blocks
+        
+        Returns:
+            list: (xoff, yoff, xsize, ysize, row0, row1, col0, col1) tuples,
+                the source window and the part of the output it fills
+        """
+        block_x, block_y = band.GetBlockSize()
+        
+        # Group whole blocks until a window holds about min_window_pixels
+        step_x = min(width, block_x * max(1, int(np.sqrt(self.min_window_pixels)) // block_x))
+        step_y = block_y * max(1, self.min_window_pixels // (step_x * block_y))
+        
+        def edges(start, size, step):
+            # Window edges on multiples of step, which are block boundaries
+            first = (start // step + 1) * step
+            return [start] + list(range(first, start + size, step)) + [start + size]
+            
+        x_edges = edges(x_min, width, step_x)
+        y_edges = edges(y_min, height, step_y)
+        
+        windows = []
+        for y0, y1 in zip(y_edges[:-1], y_edges[1:]):
+            row0 = int(round((y0 - y_min) * buf_height / height))
+            row1 = int(round((y1 - y_min) * buf_height / height))
+            if row1 == row0:
+                continue
+            for x0, x1 in zip(x_edges[:-1], x_edges[1:]):
+                col0 = int(round((x0 - x_min) * buf_width / width))
+                col1 = int(round((x1 - x_min) * buf_width / width))
+                if col1 == col0:
+                    continue
+                windows.append((x0, y0, x1 - x0, y1 - y0, row0, row1, col0, col1))
+        return windows
+        
+    def _load_hgt(self, file_path, region=None, detail_level=100):
         """Load SRTM HGT file"""
         # HGT files are 16-bit signed integers in big-endian format
         # Standard SRTM3 files are 1201x1201 pixels
+        file_size = os.path.getsize(file_path)
+        if file_size == 1201 * 1201 * 2:  # SRTM3 (3 arc-second)
+            width = height = 1201
+        elif file_size == 3601 * 3601 * 2:  # SRTM1 (1 arc-second)
+            width = height = 3601
+        else:
+            raise ValueError("Unsupported HGT file format")
+
+        if not self.use_mmap:
+            with open(file_path, 'rb') as f:
+                # Read the entire file as a 16-bit signed integer array
+                data = np.fromfile(f, dtype='>i2')  # Big-endian 16-bit signed integer
+            data = data.reshape((height, width))
+        else:
+            # Map the tile instead of reading it, only the pages covering
+            # the requested window are ever touched
+            data = np.memmap(file_path, dtype='>i2', mode='r', shape=(height, width))
+
+        # Byte-swap and convert only the cropped window, then drop the mapping
+        window = np.array(self._crop(data, region, detail_level), dtype=np.float32)
+        del data
+
+        # Replace no-data values (-32768) with NaN
+        window[window == -32768] = np.nan
+
+        return window
+        
+    def _crop(self, data, region=None, detail_level=100):
+        """Slice a region out of an array or memmap and decimate it to the detail level"""
+        # Handle region selection if specified
+        if region is not None:
+            x_min, y_min, reg_width, reg_height = region
+            data = data[y_min:y_min+reg_height, x_min:x_min+reg_width]
+            
+        # Pick only the rows and columns needed for the target size
+        if detail_level < 100:
+            rows, cols = self._sample_indices(data.shape, detail_level)
+            data = data[np.ix_(rows, cols)]
+            
+        return data
+        
+    def _sample_indices(self, shape, detail_level):
+        """Row and column indices that decimate an array of shape to the detail level"""
+        buf_height, buf_width = target_shape(shape, detail_level)
+        rows = np.linspace(0, shape[0] - 1, buf_height).astype(int)
+        cols = np.linspace(0, shape[1] - 1, buf_width).astype(int)
+        return rows, cols
+        
+    def _load_asc(self, file_path, region=None, detail_level=100):
+        """Load an ESRI ASCII Grid without going through GDAL's text driver"""
+        if self.asc_sidecar:
+            sidecar_path = file_path + '.npy'
+            try:
+                if not (os.path.exists(sidecar_path) and
+                        os.path.getmtime(sidecar_path) >= os.path.getmtime(file_path)):
+                    self._write_asc_sidecar(file_path, sidecar_path)
+                # The sidecar holds the whole grid with NaN for no-data
+                data = np.load(sidecar_path, mmap_mode='r')
+            except OSError:
+                # Read-only location, fall back to parsing the text
+                data = None
+                
+            if data is not None:
+                window = np.array(self._crop(data, region, detail_level), dtype=np.float32)
+                del data
+                return window
+            
         with open(file_path, 'rb') as f:
-            # Get file size to determine resolution
-            file_size = os.path.getsize(file_path)
-            if file_size == 1201 * 1201 * 2:  # SRTM3 (3 arc-second)
-                width = height = 1201
-            elif file_size == 3601 * 3601 * 2:  # SRTM1 (1 arc-second)
-                width = height = 3601
+            header = self._read_asc_header(f)
+            nrows, ncols = header['nrows'], header['ncols']
+            
+            if region is not None:
+                x_min, y_min, width, height = region
+                width = min(width, ncols - x_min)
+                height = min(height, nrows - y_min)
             else:
-                raise ValueError("Unsupported HGT file format")
+                x_min, y_min, width, height = 0, 0, ncols, nrows
                 
-            # Read the entire file as a 16-bit signed integer array
-            data = np.fromfile(f, dtype='>i2')  # Big-endian 16-bit signed integer
-            data = data.reshape((height, width))
+            if detail_level < 100:
+                rows, cols = self._sample_indices((height, width), detail_level)
+            else:
+                rows, cols = np.arange(height), np.arange(width)
+            rows = rows + y_min
+            cols = cols + x_min
             
-            # Handle region selection if specified
-            if region is not None:
-                x_min, y_min, reg_width, reg_height = region
-                data = data[y_min:y_min+reg_height, x_min:x_min+reg_width]
+            data = np.empty((len(rows), len(cols)), dtype=np.float32)
+            self._parse_asc_body(f, header, data, rows, cols)
+                
+        if header['nodata'] is not None:
+            data[data == np.float32(header['nodata'])] = np.nan
+        return data
+        
+    def _read_asc_header(self, f):
+        """Parse the ASCII Grid header and leave the file at the first data row"""
+        header = {'nodata': None}
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            parts = line.split()
+            if not parts:
+                if not line:
+                    break
+                continue
+            if not parts[0][:1].isalpha():
+                f.seek(offset)
+                break
+            key = parts[0].decode('ascii').lower()
+            if key == 'nodata_value':
+                header['nodata'] = float(parts[1])
+            elif key in ('ncols', 'nrows'):
+                header[key] = int(parts[1])
+            else:
+                header[key] = float(parts[1])
+                
+        if 'ncols' not in header or 'nrows' not in header:
+            raise ValueError("Invalid ASCII Grid header")
+            
+        # Rows can only be skipped without parsing when each one is a line,
+        # _parse_asc_body falls back if a later line breaks this
+        offset = f.tell()
+        header['one_row_per_line'] = len(f.readline().split()) == header['ncols']
+        f.seek(offset)
+        return header
+        
+    def _parse_asc_body(self, f, header, out, rows=None, cols=None):
+        """
+        Parse the wanted rows and columns of the body into out
+        
+        Args:
+            f (file): Binary file positioned at the first data row
+            header (dict): Header from _read_asc_header
+            out (numpy.ndarray): Preallocated float32 output
+            rows (numpy.ndarray): Sorted row indices to keep, all when None
+            cols (numpy.ndarray): Column indices to keep, all when None
+        """
+        nrows, ncols = header['nrows'], header['ncols']
+        body_offset = f.tell()
+        if header['one_row_per_line']:
+            try:
+                self._parse_asc_rows(f, ncols,
+                                     np.arange(nrows) if rows is None else rows,
+                                     slice(None) if cols is None else cols, out)
+                return
+            except ValueError:
+                # Only the first line was checked, the rows may wrap later
+                f.seek(body_offset)
+                
+        # Rows wrap over several lines, so the whole body has to be parsed
+        if rows is None and cols is None:
+            self._parse_asc_values(f, out)
+            return
+        full = np.empty((nrows, ncols), dtype=np.float32)
+        self._parse_asc_values(f, full)
+        out[:] = full[np.ix_(np.arange(nrows) if rows is None else rows,
+                             np.arange(ncols) if cols is None else cols)]
+        
+    def _parse_asc_rows(self, f, ncols, rows, cols, out):
+        """
+        Stream the body in large chunks and parse only the wanted rows
+        
+        Args:
+            f (file): Binary file positioned at the first data row
+            ncols (int): Values per row
+            rows (numpy.ndarray): Sorted row indices to keep, one per row of out
+            cols: Column indices or slice to keep
+            out (numpy.ndarray): Preallocated float32 output
+        """
+        if len(rows) == 0:
+            return
+            
+        # Output row for every source row, -1 for rows that are skipped
+        row_map = np.full(rows[-1] + 1, -1, dtype=np.int64)
+        row_map[rows] = np.arange(len(rows))
+        
+        line_index = 0
+        remainder = b''
+        while line_index < len(row_map):
+            chunk = f.read(self.asc_chunk_size)
+            if not chunk:
+                if not remainder.strip():
+                    break
+                # Last row without a trailing newline
+                chunk, remainder = remainder + b'\n', b''
+            else:
+                chunk = remainder + chunk
+                end = chunk.rfind(b'\n') + 1
+                chunk, remainder = chunk[:end], chunk[end:]
+                
+            line_count = chunk.count(b'\n')
+            if line_count == 0:
+                continue
+                
+            local = row_map[line_index:line_index + line_count]
+            line_index += line_count
+            wanted = np.nonzero(local >= 0)[0]
+            if len(wanted) == 0:
+                # Skipped rows are only counted, never parsed
+                continue
+                
+            if len(wanted) == line_count:
+                text = chunk
+            else:
+                lines = chunk.split(b'\n')
+                text = b' '.join([lines[i] for i in wanted])
+            values = np.fromstring(text.decode('ascii'), dtype=np.float32, sep=' ')
+            if values.size != len(wanted) * ncols:
+                raise ValueError("ASCII Grid row does not match ncols")
+            out[local[wanted]] = values.reshape(len(wanted), ncols)[:, cols]
+            
+        if line_index < len(row_map):
+            raise ValueError("ASCII Grid has fewer rows than nrows")
+            
+    def _parse_asc_values(self, f, out):
+        """Stream the body in large chunks and fill out in order, ignoring line breaks"""
+        flat = out.reshape(-1)
+        position = 0
+        remainder = b''
+        while True:
+            chunk = f.read(self.asc_chunk_size)
+            if chunk:
+                # Only parse up to the last complete value
+                chunk = remainder + chunk
+                end = max(chunk.rfind(b' '), chunk.rfind(b'\n')) + 1
+                chunk, remainder = chunk[:end], chunk[end:]
+            else:
+                chunk, remainder = remainder, b''
+                
+            values = np.fromstring(chunk.decode('ascii'), dtype=np.float32, sep=' ')
+            if position + values.size > flat.size:
+                raise ValueError("ASCII Grid has more values than nrows * ncols")
+            flat[position:position + values.size] = values
+            position += values.size
+            
+            if not chunk and not remainder:
+                break
+                
+        if position < flat.size:
+            raise ValueError("ASCII Grid has fewer values than nrows * ncols")
+            
+    def _write_asc_sidecar(self, file_path, sidecar_path):
+        """Parse the whole grid once into a .npy file that later loads map"""
+        with open(file_path, 'rb') as f:
+            header = self._read_asc_header(f)
+            nrows, ncols = header['nrows'], header['ncols']
             
-            # Replace no-data values (-32768) with NaN
-            data = data.astype(np.float32)
-            data[data == -32768] = np.nan
+            tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+            data = None
+            try:
+                data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                                 shape=(nrows, ncols))
+                self._parse_asc_body(f, header, data)
+                if header['nodata'] is not None:
+                    for start in range(0, nrows, 1024):
+                        block = data[start:start + 1024]
+                        block[block == np.float32(header['nodata'])] = np.nan
+                data.flush()
+            except BaseException:
+                # Don't leave a grid-sized temporary file behind
+                data = None
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            del data
             
-            return data 
\ No newline at end of file
+        os.replace(tmp_path, sidecar_path)
\ No newline at end of file
@@ -0,0 +1,316 @@
+from osgeo import gdal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import re
+import threading
+from scipy.ndimage import zoom
+from .terrain_processor import target_shape
+
+MOSAIC_EXTENSIONS = ('.hgt', '.tif', '.tiff')
+
+# SRTM tile names give the latitude/longitude of the south-west corner
+HGT_NAME = re.compile(r'^([NS])(\d{1,2})([EW])(\d{1,3})', re.IGNORECASE)
+
+# Mosaics shared by every loader, so the tile index and decoded tiles
+# survive between loads of the same directory
+_shared_mosaics = OrderedDict()
+_shared_lock = threading.Lock()
+
+def shared_mosaic(directory, max_mosaics=4, num_workers=None):
+    """
+    Return the mosaic of a directory, indexed once and reused
+
+    The mosaic is indexed again when the directory's modification time
+    changes, which happens when tiles are added or removed.
+
+    Args:
+        directory (str): Directory containing the tiles
+        max_mosaics (int): Number of directories kept indexed
+        num_workers (int): Threads used to decode tiles of a new mosaic
+    """
+    key = os.path.abspath(directory)
+    mtime = os.stat(directory).st_mtime_ns
+    with _shared_lock:
+        entry = _shared_mosaics.get(key)
+        if entry is not None and entry[0] == mtime:
+            _shared_mosaics.move_to_end(key)
+            return entry[1]
+
+    mosaic = TerrainMosaic(directory, num_workers=num_workers)
+    with _shared_lock:
+        _shared_mosaics[key] = (mtime, mosaic)
+        while len(_shared_mosaics) > max_mosaics:
+            _shared_mosaics.popitem(last=False)
+    return mosaic
+
+class MosaicTile:
+    def __init__(self, path, west, north, width, height, res, nodata=None):
+        self.path = path
+        self.west = west
+        self.north = north
+        self.width = width
+        self.height = height
+        self.res = res
+        self.nodata = nodata
+        # Pixel offset of the tile inside the mosaic, set by TerrainMosaic
+        self.col = 0
+        self.row = 0
+
+class TerrainMosaic:
+    def __init__(self, directory, max_cached_tiles=16, num_workers=None):
+        """
+        Virtual raster over a directory of .hgt/.tif tiles
+
+        Tiles are indexed by their geographic footprint and only opened when
+        a read touches them. Decoded tiles are kept in a bounded LRU cache.
+
+        Args:
+            directory (str): Directory containing the tiles
+            max_cached_tiles (int): Number of decoded tiles kept in memory
+            num_workers (int): Threads used to decode tiles, defaults to the
+                number of CPUs
+        """
+        self.directory = directory
+        self.max_cached_tiles = max_cached_tiles
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.tile_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.tiles = self._index_tiles(directory)
+        if not self.tiles:
+            raise ValueError("No .hgt or .tif tiles found in directory")
+
+        # All tiles are placed on the pixel grid of the first one
+        self.res = self.tiles[0].res
+        for tile in self.tiles:
+            if not np.isclose(tile.res, self.res, rtol=1e-3):
+                raise ValueError(f"Tile resolution does not match the mosaic: {tile.path}")
+
+        self.west = min(tile.west for tile in self.tiles)
+        self.north = max(tile.north for tile in self.tiles)
+        east = max(tile.west + tile.width * self.res for tile in self.tiles)
+        south = min(tile.north - tile.height * self.res for tile in self.tiles)
+
+        for tile in self.tiles:
+            tile.col = int(round((tile.west - self.west) / self.res))
+            tile.row = int(round((self.north - tile.north) / self.res))
+
+        self.width = max(int(round((east - self.west) / self.res)),
+                         max(tile.col + tile.width for tile in self.tiles))
+        self.height = max(int(round((self.north - south) / self.res)),
+                          max(tile.row + tile.height for tile in self.tiles))
+        self.geo_transform = (self.west, self.res, 0.0, self.north, 0.0, -self.res)
+
+    @property
+    def shape(self):
+        return (self.height, self.width)
+
+    def _index_tiles(self, directory):
+        """Build the footprint index without decoding any tile"""
+        tiles = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            ext = os.path.splitext(name)[1].lower()
+            if ext not in MOSAIC_EXTENSIONS or not os.path.isfile(path):
+                continue
+            tile = self._index_hgt(path) if ext == '.hgt' else self._index_gdal(path)
+            if tile is not None:
+                tiles.append(tile)
+        return tiles
+
+    def _index_hgt(self, path):
+        match = HGT_NAME.match(os.path.basename(path))
+        if match is None:
+            return None
+
+        lat = int(match.group(2)) * (1 if match.group(1).upper() == 'N' else -1)
+        lon = int(match.group(4)) * (1 if match.group(3).upper() == 'E' else -1)
+
+        file_size = os.path.getsize(path)
+        if file_size == 1201 * 1201 * 2:
+            size = 1201
+        elif file_size == 3601 * 3601 * 2:
+            size = 3601
+        else:
+            return None
+
+        # HGT samples sit on the tile edges, shift by half a pixel to corners
+        res = 1.0 / (size - 1)
+        return MosaicTile(path, lon - res / 2, lat + 1 + res / 2, size, size, res)
+
+    def _index_gdal(self, path):
+        dataset = gdal.Open(path)
+        if dataset is None:
+            return None
+
+        geo_transform = dataset.GetGeoTransform()
+        if geo_transform[2] != 0 or geo_transform[4] != 0:
+            raise ValueError(f"Rotated tiles are not supported: {path}")
+
+        nodata = dataset.GetRasterBand(1).GetNoDataValue()
+        return MosaicTile(path, geo_transform[0], geo_transform[3],
+                          dataset.RasterXSize, dataset.RasterYSize,
+                          geo_transform[1], nodata)
+
+    def tiles_in(self, region):
+        """Return the tiles intersecting a (x_min, y_min, width, height) window"""
+        x_min, y_min, width, height = region
+        return [
+            tile for tile in self.tiles
+            if tile.col < x_min + width and tile.col + tile.width > x_min
+            and tile.row < y_min + height and tile.row + tile.height > y_min
+        ]
+
+    def _decode(self, tile):
+        """Return the decoded float32 tile, going through the LRU cache"""
+        with self.cache_lock:
+            data = self.tile_cache.get(tile.path)
+            if data is not None:
+                self.tile_cache.move_to_end(tile.path)
+                return data
+
+        # Imported here to avoid a circular import with the loader. Tiles
+        # are already decoded in parallel, so each one uses a single thread.
+        from .terrain_loader import TerrainLoader
+        data = np.asarray(TerrainLoader(num_workers=1).load(tile.path), dtype=np.float32)
+        if tile.nodata is not None and not np.isnan(tile.nodata):
+            data[data == tile.nodata] = np.nan
+
+        with self.cache_lock:
+            self.tile_cache[tile.path] = data
+            while len(self.tile_cache) > self.max_cached_tiles:
+                self.tile_cache.popitem(last=False)
+        return data
+
+    def _read_samples(self, tile, rows, cols, decimated):
+        """
+        Read rows and columns of a tile, given in tile pixels
+
+        Full resolution reads go through the LRU cache of decoded tiles.
+        Decimated reads only touch the sampled pixels: .hgt tiles are memory
+        mapped and GDAL reads the window straight into a buffer of the sample
+        size, so no tile is decoded whole for them.
+        """
+        if not decimated:
+            return self._decode(tile)[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        with self.cache_lock:
+            cached = self.tile_cache.get(tile.path)
+        if cached is not None:
+            return cached[np.ix_(rows, cols)]
+
+        if tile.path.lower().endswith('.hgt'):
+            data = np.memmap(tile.path, dtype='>i2', mode='r', shape=(tile.height, tile.width))
+            samples = np.array(data[np.ix_(rows, cols)], dtype=np.float32)
+            del data
+            samples[samples == -32768] = np.nan
+            return samples
+
+        dataset = gdal.Open(tile.path)
+        if dataset is None:
+            raise ValueError(f"Could not open tile: {tile.path}")
+        samples = dataset.GetRasterBand(1).ReadAsArray(
+            xoff=int(cols[0]),
+            yoff=int(rows[0]),
+            win_xsize=int(cols[-1] - cols[0] + 1),
+            win_ysize=int(rows[-1] - rows[0] + 1),
+            buf_xsize=len(cols),
+            buf_ysize=len(rows),
+            resample_alg=gdal.GRIORA_NearestNeighbour
+        ).astype(np.float32)
+        if tile.nodata is not None and not np.isnan(tile.nodata):
+            samples[samples == tile.nodata] = np.nan
+        return samples
+
+    def read(self, region=None, detail_level=100):
+        """
+        Read a window across tile seams
+
+        Below full detail the window is decimated by sampling rows and
+        columns, like single files, and every tile is read at the sampled
+        pixels straight into the output.
+
+        Args:
+            region (tuple): Optional (x_min, y_min, width, height) in mosaic pixels
+            detail_level (int): Detail level (1-100)
+
+        Returns:
+            numpy.ndarray: float32 heights, NaN where no tile covers the window
+        """
+        if region is None:
+            region = (0, 0, self.width, self.height)
+        x_min, y_min, width, height = region
+
+        # Mosaic rows and columns sampled into the output
+        buf_height, buf_width = target_shape((height, width), detail_level)
+        rows = np.linspace(y_min, y_min + height - 1, buf_height).astype(int)
+        cols = np.linspace(x_min, x_min + width - 1, buf_width).astype(int)
+        decimated = buf_height < height or buf_width < width
+        data = np.full((buf_height, buf_width), np.nan, dtype=np.float32)
+
+        def paste(tile):
+            # Output rows and columns whose samples fall inside the tile.
+            # Tiles only share their edge samples, which hold the same
+            # heights, so threads can write their blocks concurrently
+            row0, row1 = np.searchsorted(rows, [tile.row, tile.row + tile.height])
+            col0, col1 = np.searchsorted(cols, [tile.col, tile.col + tile.width])
+            if row0 == row1 or col0 == col1:
+                return
+            data[row0:row1, col0:col1] = self._read_samples(
+                tile, rows[row0:row1] - tile.row, cols[col0:col1] - tile.col, decimated
+            )
+
+        tiles = self.tiles_in(region)
+        if self.num_workers > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.num_workers, len(tiles))) as pool:
+                # Tiles are pasted as they are read and dropped, list()
+                # raises the workers' exceptions here
+                list(pool.map(paste, tiles))
+        else:
+            for tile in tiles:
+                paste(tile)
+
+        return data
+
+    def overview(self, max_size=400):
+        """
+        Low resolution image of the whole mosaic for browsing
+
+        Each tile is read decimated, so no tile is decoded at full resolution.
+
+        Args:
+            max_size (int): Size of the longer side of the overview
+
+        Returns:
+            numpy.ndarray: float32 heights, gaps filled with the lowest height
+        """
+        from .terrain_loader import TerrainLoader
+        loader = TerrainLoader(num_workers=1)
+
+        scale = max_size / max(self.width, self.height)
+        out_height = max(1, int(round(self.height * scale)))
+        out_width = max(1, int(round(self.width * scale)))
+        overview = np.full((out_height, out_width), np.nan, dtype=np.float32)
+
+        for tile in self.tiles:
+            top = int(tile.row * scale)
+            left = int(tile.col * scale)
+            bottom = min(out_height, max(top + 1, int(round((tile.row + tile.height) * scale))))
+            right = min(out_width, max(left + 1, int(round((tile.col + tile.width) * scale))))
+
+            detail_level = max(1, min(100, int(np.ceil(100 * scale))))
+            tile_data = np.asarray(loader.load(tile.path, None, detail_level), dtype=np.float32)
+            if tile.nodata is not None and not np.isnan(tile.nodata):
+                tile_data = np.where(tile_data == tile.nodata, np.nan, tile_data)
+
+            tile_data = zoom(tile_data,
+                             ((bottom - top) / tile_data.shape[0],
+                              (right - left) / tile_data.shape[1]),
+                             order=0)
+            overview[top:bottom, left:right] = tile_data[:bottom - top, :right - left]
+
+        if np.all(np.isnan(overview)):
+            return np.zeros_like(overview)
+        overview[np.isnan(overview)] = np.nanmin(overview)
+        return overview
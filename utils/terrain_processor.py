@@ -1,36 +1,153 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
+import os
 from scipy.ndimage import zoom, gaussian_filter
 from scipy import stats
 
+# Shared arrays of the tile worker process, set by _init_tile_worker
+_tile_worker_arrays = {}
+
+def _init_tile_worker(input_name, output_name, shape):
+    """Map the parent's input and output arrays once per worker process"""
+    for key, name in (('input', input_name), ('output', output_name)):
+        shm = shared_memory.SharedMemory(name=name)
+        _tile_worker_arrays[key + '_shm'] = shm
+        _tile_worker_arrays[key] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+
+def _clean_tile(task):
+    """Clean and smooth one tile plus its halo and write back the tile interior"""
+    (row0, row1, col0, col1), halo, sigma, mean, std, replacement, threshold, alpha = task
+    source = _tile_worker_arrays['input']
+    output = _tile_worker_arrays['output']
+    
+    # The halo makes the smoothing at tile seams identical to a global pass
+    halo_row0 = max(0, row0 - halo)
+    halo_row1 = min(source.shape[0], row1 + halo)
+    halo_col0 = max(0, col0 - halo)
+    halo_col1 = min(source.shape[1], col1 + halo)
+    
+    processor = TerrainProcessor(outlier_threshold=threshold)
+    block = np.array(source[halo_row0:halo_row1, halo_col0:halo_col1])
+    processor._replace_outliers(block, mean, std, replacement)
+    smoothed = gaussian_filter(block, sigma=sigma)
+    
+    inner = (slice(row0 - halo_row0, row1 - halo_row0), slice(col0 - halo_col0, col1 - halo_col0))
+    output[row0:row1, col0:col1] = (np.float32(alpha) * block[inner] +
+                                    np.float32(1 - alpha) * smoothed[inner])
+
+def target_shape(shape, detail_level):
+    """
+    Calculate the output size for a detail level while maintaining aspect ratio
+    
+    Args:
+        shape (tuple): (height, width) of the full resolution data
+        detail_level (int): Detail level (1-100)
+        
+    Returns:
+        tuple: (target_height, target_width)
+    """
+    original_height, original_width = shape
+    if detail_level == 100:
+        return original_height, original_width
+        
+    aspect_ratio = original_width / original_height
+    
+    # Base the target size on the larger dimension
+    if original_width >= original_height:
+        target_width = max(10, int(original_width * detail_level / 100))
+        target_height = max(10, int(target_width / aspect_ratio))
+    else:
+        target_height = max(10, int(original_height * detail_level / 100))
+        target_width = max(10, int(target_height * aspect_ratio))
+        
+    return target_height, target_width
+
 class TerrainProcessor:
-    def process(self, data, detail_level):
+    def __init__(self, low_memory=False, block_size=1 << 20,
+                 tiled=False, tile_size=2048, num_workers=None,
+                 outlier_threshold=4.0, blend_alpha=0.7, keep_scratch=False):
+        """
+        Args:
+            low_memory (bool): Clean in float32 with streaming statistics and
+                in-place updates instead of full-size float64 temporaries
+            block_size (int): Elements handled per block by the streaming passes
+            tiled (bool): Clean tiles with an overlapping halo on a process
+                pool that shares the input and output arrays with this process
+            tile_size (int): Side length of a tile in tiled mode
+            num_workers (int): Worker processes in tiled mode, defaults to
+                the number of CPUs
+            outlier_threshold (float): Z-score above which a value is an outlier
+            blend_alpha (float): Weight of the unsmoothed data in the blend
+            keep_scratch (bool): Keep the low-memory smoothing buffer between
+                cleans of same-sized terrains instead of freeing it after each
+        """
+        self.low_memory = low_memory
+        self.block_size = block_size
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.outlier_threshold = outlier_threshold
+        self.blend_alpha = blend_alpha
+        self.keep_scratch = keep_scratch
+        # Estimated peak bytes of the last low-memory clean, from its array sizes
+        self.estimated_working_set = None
+        self._scratch = None
+        
+        # Cleaned data and last resampled level of the last source, see process()
+        self._cache_key = None
+        self._cleaned = None
+        self._level = None  # (detail_level, data)
+        
+    def process(self, data, detail_level, source_key=None, check_cancelled=None):
         """
         Process terrain data based on detail level
         
         Args:
-            data (numpy.ndarray): Raw terrain data
+            data (numpy.ndarray): Raw terrain data, may be None when the
+                cleaned data for source_key is already cached
             detail_level (int): Detail level (1-100)
+            source_key: Identifies the source of data. When given, the
+                cleaned data and the last resampled level are cached and
+                reused until the source or the cleaning parameters change.
+            check_cancelled (callable): Passed on to clean_terrain
             
         Returns:
             numpy.ndarray: Processed terrain data
         """
-        # First clean and smooth the terrain data
-        cleaned_data = self.clean_terrain(data)
+        if source_key is None:
+            return self._resample(self.clean_terrain(data, check_cancelled), detail_level)
+            
+        cache_key = (source_key, self.outlier_threshold, self.blend_alpha)
+        if cache_key != self._cache_key:
+            if data is None:
+                raise ValueError("No cached terrain for this source")
+            self.invalidate()
+            self._cleaned = self.clean_terrain(data, check_cancelled)
+            self._cache_key = cache_key
+            
+        if self._level is None or self._level[0] != detail_level:
+            self._level = (detail_level, self._resample(self._cleaned, detail_level))
+        return self._level[1]
+        
+    def is_cached(self, source_key):
+        """Whether cleaned data for source_key with the current parameters is cached"""
+        return self._cache_key == (source_key, self.outlier_threshold, self.blend_alpha)
+        
+    def invalidate(self):
+        """Drop the cached cleaned data and resampled level"""
+        self._cache_key = None
+        self._cleaned = None
+        self._level = None
         
+    def _resample(self, cleaned_data, detail_level):
+        """Resample cleaned data to a detail level"""
         if detail_level == 100:
             return cleaned_data
             
-        # Calculate target size based on detail level while maintaining aspect ratio
         original_height, original_width = cleaned_data.shape
-        aspect_ratio = original_width / original_height
-        
-        # Base the target size on the larger dimension
-        if original_width >= original_height:
-            target_width = max(10, int(original_width * detail_level / 100))
-            target_height = max(10, int(target_width / aspect_ratio))
-        else:
-            target_height = max(10, int(original_height * detail_level / 100))
-            target_width = max(10, int(target_height * aspect_ratio))
+        target_height, target_width = target_shape(cleaned_data.shape, detail_level)
         
         # Use scipy's zoom for better interpolation
         processed_data = zoom(cleaned_data, 
@@ -40,16 +157,26 @@ class TerrainProcessor:
         
         return processed_data
         
-    def clean_terrain(self, data):
+    def clean_terrain(self, data, check_cancelled=None):
         """
         Clean terrain data by removing outliers and smoothing
         
         Args:
             data (numpy.ndarray): Raw terrain data
+            check_cancelled (callable): Called between the blocks and tiles
+                of the low-memory and tiled modes, may raise to abandon
+                the clean
             
         Returns:
             numpy.ndarray: Cleaned terrain data
         """
+        if check_cancelled is None:
+            check_cancelled = lambda: None
+        if self.tiled and max(data.shape) > self.tile_size and self.num_workers > 1:
+            return self._clean_terrain_tiled(data, check_cancelled)
+        if self.low_memory:
+            return self._clean_terrain_low_memory(data, check_cancelled)
+            
         # Remove NaN values if any
         data = np.nan_to_num(data, nan=np.nanmean(data))
         
@@ -58,7 +185,7 @@ class TerrainProcessor:
         data_clean = data.flatten()
         
         # Remove extreme outliers (z-score > 4) - increased threshold
-        outlier_mask = np.abs(z_scores) > 4
+        outlier_mask = np.abs(z_scores) > self.outlier_threshold
         data_clean[outlier_mask] = np.mean(data_clean[~outlier_mask])
         
         # Reshape back to original shape
@@ -69,7 +196,175 @@ class TerrainProcessor:
         smoothed_data = gaussian_filter(cleaned_data, sigma=sigma)
         
         # Blend smoothed and original data to preserve some detail
-        alpha = 0.7  # Blend factor (origina lvalue)
+        alpha = self.blend_alpha  # Blend factor (origina lvalue)
         final_data = alpha * cleaned_data + (1 - alpha) * smoothed_data
         
-        return final_data
\ No newline at end of file
+        return final_data
+        
+    def _row_blocks(self, shape, check_cancelled):
+        """Yield row slices holding about block_size elements each, checking for cancellation before each"""
+        rows_per_block = max(1, self.block_size // max(1, shape[1]))
+        for start in range(0, shape[0], rows_per_block):
+            check_cancelled()
+            yield slice(start, min(start + rows_per_block, shape[0]))
+            
+    def _outlier_statistics(self, data, check_cancelled):
+        """
+        Streaming statistics needed by the outlier pass
+        
+        Returns:
+            tuple: (mean, std, replacement) where mean also fills NaN values,
+                std is taken after filling and replacement is the mean of the
+                values that are not outliers
+        """
+        # One pass of per-block mean and M2 merged with Chan's formula
+        count = 0
+        mean = 0.0
+        m2 = 0.0
+        for rows in self._row_blocks(data.shape, check_cancelled):
+            block = np.asarray(data[rows], dtype=np.float64).ravel()
+            block = block[~np.isnan(block)]
+            if block.size == 0:
+                continue
+            block_mean = block.mean()
+            block_m2 = np.square(block - block_mean).sum()
+            delta = block_mean - mean
+            total = count + block.size
+            mean += delta * block.size / total
+            m2 += block_m2 + delta * delta * count * block.size / total
+            count = total
+            
+        if count == 0:
+            return np.nan, np.nan, np.nan
+            
+        # NaN cells are filled with the mean, which adds nothing to M2
+        std = np.sqrt(m2 / data.size)
+        
+        # Mean of the values that are not outliers
+        kept_sum = 0.0
+        kept_count = 0
+        for rows in self._row_blocks(data.shape, check_cancelled):
+            block = np.asarray(data[rows], dtype=np.float64)
+            block = np.where(np.isnan(block), mean, block)
+            kept = np.abs(block - mean) <= self.outlier_threshold * std
+            kept_sum += block[kept].sum()
+            kept_count += np.count_nonzero(kept)
+            
+        replacement = kept_sum / kept_count if kept_count else mean
+        return mean, std, replacement
+        
+    def _replace_outliers(self, block, mean, std, replacement):
+        """Fill NaN and replace outliers of a float32 block in place"""
+        np.copyto(block, np.float32(mean), where=np.isnan(block))
+        if std > 0:
+            block[np.abs(block - np.float32(mean)) > np.float32(self.outlier_threshold * std)] = replacement
+            
+    def _scratch_buffer(self, shape):
+        """Return a float32 buffer of the given shape, reused if keep_scratch is set"""
+        if self._scratch is None or self._scratch.shape != shape:
+            self._scratch = None
+            self._scratch = np.empty(shape, dtype=np.float32)
+        return self._scratch
+        
+    def _clean_terrain_low_memory(self, data, check_cancelled):
+        """Same cleaning as clean_terrain, in float32 with one output and one scratch array"""
+        mean, std, replacement = self._outlier_statistics(data, check_cancelled)
+        
+        # Copy, fill and replace outliers block by block into the output
+        cleaned_data = np.empty(data.shape, dtype=np.float32)
+        for rows in self._row_blocks(data.shape, check_cancelled):
+            block = cleaned_data[rows]
+            block[...] = data[rows]
+            self._replace_outliers(block, mean, std, replacement)
+            
+        # Apply Gaussian smoothing into the scratch buffer by row blocks. A
+        # halo of the kernel radius makes each block match a whole-array pass.
+        sigma = max(1, min(cleaned_data.shape) / 200)  # Adaptive smoothing based on terrain size
+        halo = int(4.0 * sigma + 0.5)  # gaussian_filter's kernel radius (truncate=4.0)
+        smoothed_data = self._scratch_buffer(cleaned_data.shape)
+        rows, cols = cleaned_data.shape
+        rows_per_block = max(self.block_size // max(1, cols), 8 * halo)
+        for start in range(0, rows, rows_per_block):
+            check_cancelled()
+            stop = min(start + rows_per_block, rows)
+            top, bottom = max(start - halo, 0), min(stop + halo, rows)
+            smoothed = gaussian_filter(cleaned_data[top:bottom], sigma=sigma)
+            smoothed_data[start:stop] = smoothed[start - top:stop - top]
+            del smoothed
+        
+        # Blend in place
+        alpha = self.blend_alpha
+        cleaned_data *= np.float32(alpha)
+        smoothed_data *= np.float32(1 - alpha)
+        cleaned_data += smoothed_data
+        
+        # Input when held in memory, output and scratch, plus the larger of
+        # the float64 temporaries of one block and one smoothed block.
+        # Allocator overhead is not counted.
+        input_bytes = 0 if isinstance(data, np.memmap) else np.asarray(data).nbytes
+        block_bytes = max(min(self.block_size, data.size) * 8 * 3,
+                          min(rows_per_block + 2 * halo, rows) * cols * 4)
+        self.estimated_working_set = input_bytes + cleaned_data.nbytes + smoothed_data.nbytes + block_bytes
+        
+        del smoothed_data
+        if not self.keep_scratch:
+            self._scratch = None
+        return cleaned_data
+        
+    def _clean_terrain_tiled(self, data, check_cancelled):
+        """Same cleaning as clean_terrain, split into haloed tiles on a process pool"""
+        # Global statistics are computed once so every tile uses the same ones
+        mean, std, replacement = self._outlier_statistics(data, check_cancelled)
+        
+        sigma = max(1, min(data.shape) / 200)  # Adaptive smoothing based on terrain size
+        halo = int(4.0 * sigma + 0.5)  # gaussian_filter's kernel radius (truncate=4.0)
+        
+        rows, cols = data.shape
+        tiles = [
+            (row0, min(row0 + self.tile_size, rows), col0, min(col0 + self.tile_size, cols))
+            for row0 in range(0, rows, self.tile_size)
+            for col0 in range(0, cols, self.tile_size)
+        ]
+        
+        nbytes = max(1, rows * cols * 4)
+        input_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        output_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        try:
+            source = np.ndarray(data.shape, dtype=np.float32, buffer=input_shm.buf)
+            for block_rows in self._row_blocks(data.shape, check_cancelled):
+                source[block_rows] = data[block_rows]
+            del source
+            
+            tasks = [(tile, halo, sigma, mean, std, replacement,
+                      self.outlier_threshold, self.blend_alpha) for tile in tiles]
+            # Spawned workers stay safe when called from a GUI or worker thread
+            with ProcessPoolExecutor(max_workers=min(self.num_workers, len(tiles)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_tile_worker,
+                                     initargs=(input_shm.name, output_shm.name, data.shape)) as pool:
+                futures = [pool.submit(_clean_tile, task) for task in tasks]
+                try:
+                    for future in as_completed(futures):
+                        # Raises the workers' exceptions here
+                        future.result()
+                        check_cancelled()
+                except BaseException:
+                    # Drop the tiles that have not started, so leaving the
+                    # pool only waits for the running ones
+                    for future in futures:
+                        future.cancel()
+                    raise
+                
+            # Free the input before copying the result out of shared memory
+            input_shm.close()
+            input_shm.unlink()
+            input_shm = None
+            cleaned_data = np.array(np.ndarray(data.shape, dtype=np.float32, buffer=output_shm.buf))
+        finally:
+            if input_shm is not None:
+                input_shm.close()
+                input_shm.unlink()
+            output_shm.close()
+            output_shm.unlink()
+            
+        return cleaned_data
\ No newline at end of file
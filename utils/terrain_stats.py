@@ -0,0 +1,131 @@
+import numpy as np
+
+DEFAULT_PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+# Working histogram bins per reported bin, see TerrainStats.compute
+OVERSAMPLING = 4
+
+class TerrainStats:
+    def __init__(self, shape):
+        """
+        Summary statistics of a terrain, computed once per load
+
+        Use TerrainStats.compute to fill one in. Heights that are NaN or equal
+        to the nodata value are counted in nodata_count and left out of
+        everything else.
+
+        Args:
+            shape (tuple): (rows, cols) of the terrain
+        """
+        self.shape = tuple(shape)
+        self.min = 0.0
+        self.max = 0.0
+        self.mean = 0.0
+        self.valid_count = 0
+        self.nodata_count = 0
+        self.histogram = np.zeros(0, dtype=np.int64)
+        self.bin_edges = np.zeros(1)
+        self.percentiles = {}
+
+    @classmethod
+    def compute(cls, data, nodata=None, bins=1024, percentiles=DEFAULT_PERCENTILES, block_size=1 << 20):
+        """
+        Compute all statistics in one pass over row blocks of the terrain
+
+        A finer working histogram starts on the range of the first block and
+        doubles its bin width whenever a later block falls outside, so
+        memory-mapped terrain is only read once. It has OVERSAMPLING times
+        more bins than asked for, which keeps its bins within range / bins
+        however far the first block's range was from the terrain's.
+        Percentiles are interpolated within those bins, and the working
+        histogram is re-binned once at the end onto bins over min to max.
+
+        Args:
+            data (numpy.ndarray): Height data, may be memory-mapped
+            nodata (float): Optional nodata value besides NaN
+            bins (int): Histogram bins, an even number
+            percentiles (tuple): Percentiles to report, 0-100
+            block_size (int): Approximate number of values per block
+
+        Returns:
+            TerrainStats: The statistics
+        """
+        stats = cls(data.shape)
+        rows = data.shape[0]
+        step = max(1, block_size // max(1, data.shape[1]))
+        # Coverage can end up to four times the terrain's range, see above
+        fine_bins = bins * OVERSAMPLING
+
+        low = high = None
+        total = 0.0
+        counts = np.zeros(fine_bins, dtype=np.int64)
+        origin, width = 0.0, 0.0
+
+        for start in range(0, rows, step):
+            block = np.asarray(data[start:start + step], dtype=np.float64).ravel()
+            valid = ~np.isnan(block)
+            if nodata is not None:
+                valid &= block != nodata
+            block = block[valid]
+            stats.nodata_count += int(valid.size - block.size)
+            if block.size == 0:
+                continue
+
+            block_min, block_max = float(block.min()), float(block.max())
+            if low is None:
+                low, high = block_min, block_max
+                origin = block_min
+                width = max((block_max - block_min) / fine_bins, 1e-6)
+            else:
+                low, high = min(low, block_min), max(high, block_max)
+
+            # Widen the histogram until it covers the block
+            while block_min < origin or block_max > origin + width * fine_bins:
+                merged = counts.reshape(fine_bins // 2, 2).sum(axis=1)
+                padding = np.zeros(fine_bins // 2, dtype=np.int64)
+                if block_min < origin:
+                    counts = np.concatenate([padding, merged])
+                    origin -= width * fine_bins
+                else:
+                    counts = np.concatenate([merged, padding])
+                width *= 2
+
+            index = ((block - origin) / width).astype(np.int64)
+            counts += np.bincount(np.clip(index, 0, fine_bins - 1), minlength=fine_bins)
+            total += float(block.sum())
+            stats.valid_count += int(block.size)
+
+        if stats.valid_count == 0:
+            return stats
+
+        stats.min = low
+        stats.max = high
+        stats.mean = total / stats.valid_count
+
+        fine_edges = origin + width * np.arange(fine_bins + 1)
+        cumulative = np.cumsum(counts)
+        for p in percentiles:
+            target = p / 100 * stats.valid_count
+            i = min(int(np.searchsorted(cumulative, target)), fine_bins - 1)
+            before = cumulative[i - 1] if i > 0 else 0
+            fraction = (target - before) / counts[i] if counts[i] else 0.0
+            value = fine_edges[i] + fraction * width
+            stats.percentiles[p] = float(min(max(value, low), high))
+
+        # Counts spread evenly within each working bin, rounded on the
+        # cumulative counts so they still add up to valid_count
+        stats.bin_edges = np.linspace(low, high if high > low else low + width, bins + 1)
+        fine_cumulative = np.concatenate([[0], cumulative]).astype(np.float64)
+        edge_cumulative = np.rint(np.interp(stats.bin_edges, fine_edges, fine_cumulative))
+        edge_cumulative[0], edge_cumulative[-1] = 0, stats.valid_count
+        stats.histogram = np.diff(edge_cumulative).astype(np.int64)
+        return stats
+
+    @property
+    def range(self):
+        return self.max - self.min
+
+    def normalize(self, data):
+        """Scale heights to 0-1 with the terrain's min and max"""
+        if self.range == 0:
+            return np.zeros(data.shape, dtype=np.float32)
+        return (data - np.float32(self.min)) / np.float32(self.range)